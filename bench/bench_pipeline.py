@@ -0,0 +1,334 @@
+# bench_pipeline.py
+"""
+End-to-end benchmark: scan -> convert -> upload -> DB against local stand-ins.
+
+  NAS  : synthetic ZIP deliveries in a temp directory (nas_generator.py)
+  DB   : SQLite files (db.py attaches one file per MySQL schema)
+  FTP  : local pyftpdlib server on 127.0.0.1
+
+    pip install pyftpdlib
+    python bench/bench_pipeline.py --lots 4 --wafers 25 --rows 68 --cols 68
+
+Reports per-stage wall time, wafers/sec and peak RSS.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from functools import wraps
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCH_DIR), "src")
+sys.path.insert(0, SRC_DIR)
+
+from nas_generator import generate_nas, DEFAULT_BIN_MIX  # noqa: E402
+from log_setup import setup_logging  # noqa: E402
+
+FTP_USER = "bench"
+FTP_PASS = "bench"
+
+GTK_PRODUCT = "FT233H-B"
+ASE_PRODUCT = "FT4232HA"
+
+
+# -------------------------
+# Peak RSS (Linux/macOS: resource, Windows: psutil)
+# -------------------------
+def peak_rss_mb():
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports KiB, macOS reports bytes
+        return peak / 1024 / (1024 if sys.platform == "darwin" else 1)
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss) / 1024 / 1024
+    except ImportError:
+        return float("nan")
+
+
+# -------------------------
+# Stage timer (inclusive wall time per stage)
+# -------------------------
+class StageTimer:
+    """Stages run in several threads (subcon groups, async steps): nesting depth is per thread."""
+
+    def __init__(self):
+        self.stats = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def active(self):
+        return getattr(self._local, "depth", 0)
+
+    @active.setter
+    def active(self, depth):
+        self._local.depth = depth
+
+    def add(self, stage, seconds):
+        with self._lock:
+            calls, total = self.stats.get(stage, (0, 0.0))
+            self.stats[stage] = (calls + 1, total + seconds)
+
+    def wrap(self, stage, func, outermost_only=False):
+        @wraps(func)
+        def timed(*args, **kwargs):
+            if outermost_only and self.active:
+                return func(*args, **kwargs)
+            self.active += 1
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - start)
+                self.active -= 1
+        return timed
+
+    def wrap_generator(self, stage, func):
+        """Time a generator including the work done between yields (ZIP member reads)."""
+        @wraps(func)
+        def timed(*args, **kwargs):
+            gen = func(*args, **kwargs)
+            while True:
+                self.active += 1
+                start = time.perf_counter()
+                try:
+                    item = next(gen)
+                except StopIteration:
+                    return
+                finally:
+                    self.add(stage, time.perf_counter() - start)
+                    self.active -= 1
+                yield item
+        return timed
+
+
+# -------------------------
+# Local stand-ins
+# -------------------------
+def create_sqlite_db(db_dir):
+    """
+    Main DB file plus one file per schema, matching configs.DB_UPLOAD_TABLE /
+    DB_FACT_REPORT_TABLE (schema.table).
+    """
+    main_db = os.path.join(db_dir, "wmu_bench.db")
+    sqlite3.connect(main_db).close()
+
+    with sqlite3.connect(os.path.join(db_dir, "umc_uploaded_wafers.db")) as con:
+        for table in ("wafers_uploaded", "wafers_uploaded_for_test_script"):
+            con.execute(f"""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    Product TEXT, Lot_Number TEXT, Wafer_Id INTEGER,
+                    stage TEXT, status TEXT, upload_agent TEXT
+                )""")
+    with sqlite3.connect(os.path.join(db_dir, "factory_reports.db")) as con:
+        con.execute("""
+            CREATE TABLE IF NOT EXISTS gtk_cp_report_sg (
+                Lot_No TEXT, ID INTEGER, Product TEXT,
+                Machine TEXT, Program TEXT, Operator TEXT, Class TEXT
+            )""")
+    return main_db
+
+
+def seed_factory_reports(db_dir, keys):
+    rows = []
+    for lot, wafer, stage in keys["GTK"]:
+        rows.append((f"{lot}.1", wafer, GTK_PRODUCT, "J750-07", "", "OP01", "A"))
+    for lot, wafer, stage in keys["ASE"]:
+        rows.append((f"{lot}.00", wafer, ASE_PRODUCT, "J750-01", "", "OP02", "B"))
+    # get_factory_info() expects one row per (lot, wafer, product)
+    rows = list(dict.fromkeys(rows))
+    with sqlite3.connect(os.path.join(db_dir, "factory_reports.db")) as con:
+        con.executemany(
+            "INSERT INTO gtk_cp_report_sg (Lot_No, ID, Product, Machine, Program, Operator, Class) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+
+
+def start_ftp_server(home_dir):
+    try:
+        from pyftpdlib.authorizers import DummyAuthorizer
+        from pyftpdlib.handlers import FTPHandler
+        from pyftpdlib.servers import ThreadedFTPServer
+    except ImportError:
+        print("[BENCH] pyftpdlib is required: pip install pyftpdlib")
+        sys.exit(1)
+
+    import logging
+    logging.getLogger("pyftpdlib").setLevel(logging.WARNING)
+
+    authorizer = DummyAuthorizer()
+    authorizer.add_user(FTP_USER, FTP_PASS, home_dir, perm="elradfmw")
+    handler = FTPHandler
+    handler.authorizer = authorizer
+    server = ThreadedFTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, kwargs={"handle_exit": False}, daemon=True)
+    thread.start()
+    return server, server.address[1]
+
+
+# -------------------------
+# Benchmark
+# -------------------------
+def run_benchmark(args):
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="wmu_bench_")
+    nas_dir = os.path.join(work_dir, "nas")
+    db_dir = os.path.join(work_dir, "db")
+    ftp_dir = os.path.join(work_dir, "ftp")
+    out_dir = os.path.join(work_dir, "out")
+    for d in (nas_dir, db_dir, ftp_dir, out_dir):
+        os.makedirs(d, exist_ok=True)
+
+    start = time.perf_counter()
+    nas = generate_nas(
+        nas_dir, args.lots, args.wafers, args.rows, args.cols,
+        args.bin_mix, tuple(args.stages.split(",")), args.ase_format, args.seed,
+        args.redeliveries,
+    )
+    gen_time = time.perf_counter() - start
+
+    # Before the FTP server starts, so pyftpdlib keeps its hands off the root logger
+    setup_logging(os.path.join(out_dir, "bench.log"), level=args.log_level)
+
+    main_db = create_sqlite_db(db_dir)
+    seed_factory_reports(db_dir, nas["keys"])
+    server, port = start_ftp_server(ftp_dir)
+
+    # configs.py reads these at import time
+    os.environ["DB_URI"] = f"sqlite:///{main_db}"
+    os.environ["FTP_USERPWD"] = f"{FTP_USER}:{FTP_PASS}"
+    os.environ["WMU_FTP_BASE_URL"] = f"ftp://127.0.0.1:{port}"
+    os.environ["WMU_NAS_MAP_DIR_GTK"] = nas["gtk_dir"]
+    os.environ["WMU_NAS_MAP_DIR_ASE"] = nas["ase_dir"]
+    os.environ["WMU_ROOT_DIR"] = os.path.join(out_dir, "converted_umc")
+    os.environ["WMU_TEMP_DL_DIR"] = os.path.join(out_dir, "temp_dl")
+    os.environ["WMU_EXE_DIR"] = out_dir
+
+    import main
+    import utils
+    import ftp_client
+    import inventory
+
+    main.enable_email = False
+    utils.diff_file = os.path.join(out_dir, "wafer_upload_diff.html")
+
+    timer = StageTimer()
+    main.scan_maps = timer.wrap_generator("scan_maps", main.scan_maps)
+    inventory.wait_until_stable = timer.wrap("wait_until_stable", inventory.wait_until_stable)
+    main.stage_zip = timer.wrap("stage_zip", main.stage_zip)
+    main.get_factory_info = timer.wrap("factory_info", main.get_factory_info)
+    # extract + convert (inline or the pool's result) + .umc write, on every runner path
+    main.convert_wafer = timer.wrap("convert", main.convert_wafer)
+    main.upsert_upload = timer.wrap("db_upsert", main.upsert_upload)
+    main.html_diff = timer.wrap("html_diff", main.html_diff)
+    ftp_client.FTPClient.upload = timer.wrap("ftp_upload", ftp_client.FTPClient.upload)
+    ftp_client.FTPClient.verify = timer.wrap("ftp_verify", ftp_client.FTPClient.verify)
+
+    # DB status lookups (and the upload ledger statements) are inline session.execute() calls
+    create_upload_session = main.create_upload_session
+
+    def timed_upload_session():
+        session = create_upload_session()
+        session.execute = timer.wrap("db_status", session.execute, outermost_only=True)
+        return session
+    main.create_upload_session = timed_upload_session
+
+    products = []
+    if "GTK" in args.subcons:
+        products.append(GTK_PRODUCT)
+    if "ASE" in args.subcons:
+        products.append(ASE_PRODUCT)
+
+    passes = []
+    try:
+        for pass_no in range(1, args.passes + 1):
+            timer.stats.clear()
+            start = time.perf_counter()
+            main.run_main(products)
+            wall = time.perf_counter() - start
+            passes.append({"pass": pass_no, "wall_s": wall, "stages": dict(timer.stats)})
+    finally:
+        server.close_all()
+
+    wafers = sum(len(nas["keys"][s]) for s in args.subcons)
+    report = {
+        "work_dir": work_dir,
+        "lots": args.lots,
+        "wafers_per_lot": args.wafers,
+        "grid": f"{args.rows}x{args.cols}",
+        "wafers": wafers,
+        "generate_s": gen_time,
+        "passes": [
+            {
+                "pass": p["pass"],
+                "wall_s": round(p["wall_s"], 3),
+                "wafers_per_s": round(wafers / p["wall_s"], 2) if p["wall_s"] else 0,
+                "stages": {
+                    name: {"calls": calls, "total_s": round(total, 4)}
+                    for name, (calls, total) in sorted(p["stages"].items())
+                },
+            }
+            for p in passes
+        ],
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+    return report
+
+
+def print_report(report):
+    print("\n" + "=" * 60)
+    print(f"Benchmark: {report['wafers']} wafers, grid {report['grid']}")
+    print(f"Work dir : {report['work_dir']}")
+    print(f"Generate : {report['generate_s']:.2f}s")
+    for p in report["passes"]:
+        print(f"\n-- Pass {p['pass']}: {p['wall_s']:.2f}s, {p['wafers_per_s']} wafers/s")
+        print(f"   {'stage':<20}{'calls':>8}{'total s':>12}{'mean ms':>12}")
+        for name, s in p["stages"].items():
+            mean_ms = s["total_s"] / s["calls"] * 1000 if s["calls"] else 0
+            print(f"   {name:<20}{s['calls']:>8}{s['total_s']:>12.3f}{mean_ms:>12.2f}")
+    print(f"\nPeak RSS : {report['peak_rss_mb']} MB")
+    print("=" * 60)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end wafermap_uploader benchmark")
+    parser.add_argument("--lots", type=int, default=4)
+    parser.add_argument("--wafers", type=int, default=25, help="wafers per lot")
+    parser.add_argument("--rows", type=int, default=68)
+    parser.add_argument("--cols", type=int, default=68)
+    parser.add_argument("--bin-mix", default=DEFAULT_BIN_MIX, help='e.g. "1:0.95,2:0.05"')
+    parser.add_argument("--stages", default="CP1", help="comma separated, e.g. CP1,CP2")
+    parser.add_argument("--ase-format", choices=("old", "new"), default="new")
+    parser.add_argument("--subcons", default="GTK,ASE", help="GTK, ASE or GTK,ASE")
+    parser.add_argument("--passes", type=int, default=1,
+                        help="repeat the run; pass 2+ measures the all-uploaded steady state")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--redeliveries", type=int, default=0,
+                        help="extra newer ZIPs per lot/stage; only the newest is uploaded")
+    parser.add_argument("--work-dir", default="", help="keep artefacts here instead of a temp dir")
+    parser.add_argument("--json", default="", help="also write the report to this file")
+    parser.add_argument("--log-level", default="WARNING",
+                        help="pipeline log level; DEBUG measures per-wafer logging overhead")
+    args = parser.parse_args()
+    args.subcons = [s.strip().upper() for s in args.subcons.split(",") if s.strip()]
+
+    report = run_benchmark(args)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"[BENCH] Report written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+# bench_umc_writer.py
+"""
+Golden-output regression suite and micro-benchmarks for the UMC converters.
+
+    python bench/bench_umc_writer.py                  # compare against bench/golden/*.umc
+    python bench/bench_umc_writer.py --regen          # rewrite the golden files
+    python bench/bench_umc_writer.py --bench          # time parse / trim / soft-bin / render
+    python bench/bench_umc_writer.py --bench --sizes 32,100,200,360 --repeat 5
+
+Golden files are stored with LF line endings; the check expects the
+converters' text-mode output (os.linesep) byte-for-byte, from both
+process_wafer_GTK / _ASE and converter.convert_bytes.
+Exit code is 1 when any golden case differs.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCH_DIR), "src")
+GOLDEN_DIR = os.path.join(BENCH_DIR, "golden")
+sys.path.insert(0, SRC_DIR)
+
+# configs.py requires these; the converters never touch DB or FTP
+os.environ.setdefault("DB_URI", "sqlite://")
+os.environ.setdefault("FTP_USERPWD", "bench:bench")
+WORK_DIR = tempfile.mkdtemp(prefix="wmu_golden_")
+os.environ["WMU_ROOT_DIR"] = os.path.join(WORK_DIR, "converted_umc")
+
+import umc_writer  # noqa: E402
+from converter import convert_bytes  # noqa: E402
+from configs import PRODUCT_CONFIG  # noqa: E402
+from nas_generator import die_grid, gtk_wafer_txt, ase_wafer_txt, parse_bin_mix, DEFAULT_BIN_MIX  # noqa: E402
+
+GTK_PRODUCT = "FT233H-B"
+ASE_PRODUCT = "FT4232HA"
+
+
+def load_cases():
+    with open(os.path.join(GOLDEN_DIR, "cases.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def convert_case(case):
+    convert = umc_writer.process_wafer_GTK if case["converter"] == "GTK" else umc_writer.process_wafer_ASE
+    return convert(
+        lot=case["lot"],
+        wafer=case["wafer"],
+        filename=os.path.join(GOLDEN_DIR, "raw", case["raw"]),
+        product=case["product"],
+        stage=case["stage"],
+        zip_timestamp=case["zip_timestamp"],
+        factory_info=case["factory_info"],
+    )
+
+
+def convert_case_bytes(case):
+    """Same case through converter.convert_bytes (the pipeline / process-pool path)."""
+    with open(os.path.join(GOLDEN_DIR, "raw", case["raw"]), "rb") as f:
+        raw = f.read()
+    _, _, umc_bytes = convert_bytes(
+        case["converter"], raw,
+        lot=case["lot"],
+        wafer=case["wafer"],
+        product=case["product"],
+        stage=case["stage"],
+        zip_timestamp=case["zip_timestamp"],
+        factory_info=case["factory_info"],
+    )
+    return umc_bytes
+
+
+# -------------------------
+# Golden check / regen
+# -------------------------
+def check_golden(regen=False):
+    failed = []
+    for case in load_cases():
+        golden_path = os.path.join(GOLDEN_DIR, f"{case['name']}.umc")
+        with open(convert_case(case), "rb") as f:
+            actual = f.read()
+
+        if regen:
+            with open(golden_path, "wb") as f:
+                f.write(actual.replace(os.linesep.encode(), b"\n"))
+            print(f"[GOLDEN] Wrote {os.path.basename(golden_path)}")
+            continue
+
+        if not os.path.exists(golden_path):
+            print(f"[GOLDEN] MISSING {case['name']}")
+            failed.append(case["name"])
+            continue
+        with open(golden_path, "rb") as f:
+            expected = f.read().replace(b"\n", os.linesep.encode())
+
+        if actual == expected and convert_case_bytes(case) != actual:
+            failed.append(case["name"])
+            print(f"[GOLDEN] DIFF    {case['name']} (convert_bytes differs from the file converter)")
+        elif actual == expected:
+            print(f"[GOLDEN] OK      {case['name']}")
+        else:
+            failed.append(case["name"])
+            print(f"[GOLDEN] DIFF    {case['name']}")
+            for i, (a, e) in enumerate(zip(actual.splitlines(), expected.splitlines()), 1):
+                if a != e:
+                    print(f"    line {i}: expected {e!r}")
+                    print(f"    line {i}: actual   {a!r}")
+                    break
+            else:
+                print(f"    length: expected {len(expected)} bytes, actual {len(actual)} bytes")
+    return failed
+
+
+# -------------------------
+# Stage micro-benchmarks
+# -------------------------
+def time_call(func, repeat):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples), result
+
+
+def bench_gtk(text, repeat):
+    cfg = PRODUCT_CONFIG[GTK_PRODUCT]
+    lines = text.replace("\r\n", "\n").splitlines(keepends=True)
+    t_parse, (txt, wafer_map_lines) = time_call(lambda: umc_writer.parse_GTK(lines), repeat)
+    t_trim, (map_lines, width) = time_call(lambda: umc_writer.trim_map_GTK(wafer_map_lines), repeat)
+    total_test = int(txt.get("TOTAL_TEST", 0))
+    t_bins, _ = time_call(lambda: umc_writer.soft_bin_lines_GTK(cfg["soft_bins"], txt, total_test), repeat)
+    t_render, _ = time_call(
+        lambda: umc_writer.convert_GTK(lines, "SG000", "01", GTK_PRODUCT, "CP1", "2025-11-01 08:00:00", {}),
+        repeat,
+    )
+    return {"parse": t_parse, "trim": t_trim, "soft_bin": t_bins, "render": t_render}
+
+
+def bench_ase(text, repeat):
+    cfg = PRODUCT_CONFIG[ASE_PRODUCT]
+    lines = text.replace("\r\n", "\n").splitlines(keepends=True)
+    t_parse, parsed = time_call(lambda: umc_writer.parse_ASE(lines), repeat)
+    metadata, bin_counts, _, wafer_map_raw = parsed
+    t_trim, _ = time_call(lambda: umc_writer.trim_map_ASE(wafer_map_raw), repeat)
+    total_test = int(metadata.get("Die Per Wafer", "0").split()[0] or "0")
+    t_bins, _ = time_call(lambda: umc_writer.soft_bin_lines_ASE(cfg["soft_bins"], bin_counts, total_test), repeat)
+    t_render, _ = time_call(
+        lambda: umc_writer.convert_ASE(lines, "SA000", 1, ASE_PRODUCT, "CP1", "2025-11-01 08:00:00", {}),
+        repeat,
+    )
+    return {"parse": t_parse, "trim": t_trim, "soft_bin": t_bins, "render": t_render}
+
+
+def run_bench(sizes, repeat, bin_mix):
+    """
+    "render" is the full convert_* call (header + map assembly + join),
+    i.e. the in-memory cost of one wafer without file I/O.
+    """
+    rng = random.Random(1)
+    mix = parse_bin_mix(bin_mix)
+    print(f"\n{'conv':<5}{'grid':>10}{'dies':>9}{'parse ms':>11}{'trim ms':>10}"
+          f"{'bins ms':>10}{'convert ms':>12}")
+    results = []
+    for size in sizes:
+        grid = die_grid(size, size, mix, rng)
+        dies = sum(isinstance(c, int) for row in grid for c in row)
+        texts = {
+            "GTK": gtk_wafer_txt("SG000", 1, grid),
+            "ASE": ase_wafer_txt("SA000", 1, "CP1", "2025_11_01_08_00_00", grid),
+        }
+        for conv, text in texts.items():
+            stages = bench_gtk(text, repeat) if conv == "GTK" else bench_ase(text, repeat)
+            results.append({"converter": conv, "grid": size, "dies": dies,
+                            **{k: round(v * 1000, 3) for k, v in stages.items()}})
+            print(f"{conv:<5}{f'{size}x{size}':>10}{dies:>9}{stages['parse'] * 1000:>11.2f}"
+                  f"{stages['trim'] * 1000:>10.2f}{stages['soft_bin'] * 1000:>10.3f}"
+                  f"{stages['render'] * 1000:>12.2f}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="UMC converter golden suite and micro-benchmarks")
+    parser.add_argument("--regen", action="store_true", help="rewrite golden .umc files")
+    parser.add_argument("--bench", action="store_true", help="time converter stages after the golden check")
+    parser.add_argument("--sizes", default="32,100,200,360",
+                        help="square grid sizes; 360x360 is ~100k dies")
+    parser.add_argument("--repeat", type=int, default=3, help="median of N runs per stage")
+    parser.add_argument("--bin-mix", default=DEFAULT_BIN_MIX)
+    parser.add_argument("--json", default="", help="write benchmark results to this file")
+    args = parser.parse_args()
+
+    try:
+        failed = check_golden(regen=args.regen)
+        if args.bench:
+            sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+            results = run_bench(sizes, args.repeat, args.bin_mix)
+            if args.json:
+                with open(args.json, "w", encoding="utf-8") as f:
+                    json.dump(results, f, indent=2)
+                print(f"[BENCH] Results written to {args.json}")
+    finally:
+        shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+    if failed:
+        print(f"\n[GOLDEN] {len(failed)} case(s) differ: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
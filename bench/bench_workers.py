@@ -0,0 +1,201 @@
+# bench_workers.py
+"""
+Worker mode against local stand-ins: several processes share one SQLite DB,
+one synthetic NAS and one local FTP server, each leasing lot/stage groups
+(python main.py --worker). Every process gets its own output directories,
+as if it were on a separate host.
+
+    python bench/bench_workers.py --workers 3 --lots 6 --wafers 10
+    python bench/bench_workers.py --workers 3 --crash   # kill one, take over its leases
+
+Reports wall time, lease groups / uploads per worker and any remote file
+uploaded more than once.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCH_DIR), "src")
+sys.path.insert(0, SRC_DIR)
+
+from nas_generator import generate_nas  # noqa: E402
+from log_setup import setup_logging  # noqa: E402
+from bench_pipeline import (  # noqa: E402
+    FTP_USER, FTP_PASS, GTK_PRODUCT, ASE_PRODUCT,
+    create_sqlite_db, seed_factory_reports, start_ftp_server,
+)
+
+
+# -------------------------
+# Child process (one worker)
+# -------------------------
+def run_child(args):
+    out_dir = args.out
+    setup_logging(os.path.join(out_dir, "worker.log"), level=args.log_level, console=False)
+
+    import main
+    import utils
+    import ftp_client
+    from leases import run_worker
+
+    main.enable_email = False
+    utils.diff_file = os.path.join(out_dir, "wafer_upload_diff.html")
+
+    # One line per completed transfer, flushed, so a killed worker still counts
+    upload_log = open(os.path.join(out_dir, "uploads.txt"), "a", encoding="utf-8")
+    upload = ftp_client.FTPClient.upload
+
+    def counted_upload(self, local_file, *a, **kw):
+        ok = upload(self, local_file, *a, **kw)
+        if ok:
+            upload_log.write(os.path.basename(local_file) + "\n")
+            upload_log.flush()
+        return ok
+    ftp_client.FTPClient.upload = counted_upload
+
+    groups = run_worker(args.products.split(","), main.run_main, worker_id=args.worker_id)
+    with open(os.path.join(out_dir, "result.json"), "w", encoding="utf-8") as f:
+        json.dump({"worker": args.worker_id, "lease_groups": groups}, f)
+
+
+# -------------------------
+# Parent
+# -------------------------
+def spawn_worker(worker_id, work_dir, products, log_level, env):
+    out_dir = os.path.join(work_dir, "hosts", worker_id)
+    worker_env = dict(env)
+    worker_env["WMU_EXE_DIR"] = out_dir
+    worker_env["WMU_ROOT_DIR"] = os.path.join(out_dir, "converted_umc")
+    worker_env["WMU_TEMP_DL_DIR"] = os.path.join(out_dir, "temp_dl")
+    os.makedirs(out_dir, exist_ok=True)
+    cmd = [sys.executable, os.path.abspath(__file__), "--child", "--worker-id", worker_id,
+           "--out", out_dir, "--products", ",".join(products), "--log-level", log_level]
+    return subprocess.Popen(cmd, env=worker_env, cwd=out_dir)
+
+
+def collect(work_dir):
+    uploads = Counter()
+    per_worker = {}
+    hosts = os.path.join(work_dir, "hosts")
+    for worker_id in sorted(os.listdir(hosts)):
+        out_dir = os.path.join(hosts, worker_id)
+        names = []
+        if os.path.exists(os.path.join(out_dir, "uploads.txt")):
+            with open(os.path.join(out_dir, "uploads.txt"), encoding="utf-8") as f:
+                names = [line.strip() for line in f if line.strip()]
+        uploads.update(names)
+        result = {}
+        if os.path.exists(os.path.join(out_dir, "result.json")):
+            with open(os.path.join(out_dir, "result.json"), encoding="utf-8") as f:
+                result = json.load(f)
+        per_worker[worker_id] = {"uploads": len(names), "lease_groups": result.get("lease_groups", "killed")}
+    return uploads, per_worker
+
+
+def db_uploaded_rows(db_dir):
+    # production or test-script table, whichever configs.py selects
+    with sqlite3.connect(os.path.join(db_dir, "umc_uploaded_wafers.db")) as con:
+        return con.execute(
+            "SELECT COUNT(*), COUNT(DISTINCT Product || '|' || Lot_Number || '|' || Wafer_Id || '|' || stage) FROM ("
+            " SELECT * FROM wafers_uploaded UNION ALL SELECT * FROM wafers_uploaded_for_test_script"
+            ") WHERE upper(status) = 'UPLOADED'"
+        ).fetchone()
+
+
+def run_workers(args):
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="wmu_workers_")
+    nas_dir = os.path.join(work_dir, "nas")
+    db_dir = os.path.join(work_dir, "db")
+    ftp_dir = os.path.join(work_dir, "ftp")
+    for d in (nas_dir, db_dir, ftp_dir):
+        os.makedirs(d, exist_ok=True)
+
+    nas = generate_nas(nas_dir, args.lots, args.wafers, args.rows, args.cols, seed=args.seed,
+                       redeliveries=args.redeliveries)
+    setup_logging(os.path.join(work_dir, "bench.log"), level="WARNING")
+    main_db = create_sqlite_db(db_dir)
+    seed_factory_reports(db_dir, nas["keys"])
+    server, port = start_ftp_server(ftp_dir)
+
+    env = dict(os.environ)
+    env["DB_URI"] = f"sqlite:///{main_db}?timeout=30"   # processes wait on each other's write locks
+    env["FTP_USERPWD"] = f"{FTP_USER}:{FTP_PASS}"
+    env["WMU_FTP_BASE_URL"] = f"ftp://127.0.0.1:{port}"
+    env["WMU_NAS_MAP_DIR_GTK"] = nas["gtk_dir"]
+    env["WMU_NAS_MAP_DIR_ASE"] = nas["ase_dir"]
+    env["WMU_LEASE_SECONDS"] = str(args.lease_seconds)
+    products = [GTK_PRODUCT, ASE_PRODUCT]
+
+    start = time.perf_counter()
+    try:
+        procs = [spawn_worker(f"w{i}", work_dir, products, args.log_level, env) for i in range(args.workers)]
+        if args.crash:
+            time.sleep(args.crash_after)
+            procs[0].kill()
+            print(f"[BENCH] Killed w0 after {args.crash_after}s")
+        for proc in procs:
+            proc.wait()
+        if args.crash:
+            # w0's leases are still held until they expire; a fresh worker takes them over
+            time.sleep(args.lease_seconds + 1)
+            spawn_worker("recovery", work_dir, products, args.log_level, env).wait()
+    finally:
+        server.close_all()
+    wall = time.perf_counter() - start
+
+    uploads, per_worker = collect(work_dir)
+    rows, distinct_rows = db_uploaded_rows(db_dir)
+    wafers = sum(len(keys) for keys in nas["keys"].values())
+    return {
+        "work_dir": work_dir,
+        "workers": args.workers,
+        "wafers": wafers,
+        "wall_s": round(wall, 3),
+        "per_worker": per_worker,
+        "uploads": sum(uploads.values()),
+        "uploaded_more_than_once": sorted(name for name, n in uploads.items() if n > 1),
+        "db_uploaded_rows": rows,
+        "db_distinct_wafers": distinct_rows,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run several lease-sharing workers against SQLite + local FTP")
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--lots", type=int, default=6)
+    parser.add_argument("--wafers", type=int, default=10, help="wafers per lot")
+    parser.add_argument("--rows", type=int, default=40)
+    parser.add_argument("--cols", type=int, default=40)
+    parser.add_argument("--redeliveries", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--lease-seconds", type=int, default=10)
+    parser.add_argument("--crash", action="store_true", help="kill w0 mid-run, then run a recovery worker")
+    parser.add_argument("--crash-after", type=float, default=3.0)
+    parser.add_argument("--work-dir", default="")
+    parser.add_argument("--log-level", default="INFO")
+    # child process
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--worker-id", help=argparse.SUPPRESS)
+    parser.add_argument("--out", help=argparse.SUPPRESS)
+    parser.add_argument("--products", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+
+    report = run_workers(args)
+    print(json.dumps(report, indent=2))
+    ok = (not report["uploaded_more_than_once"] or args.crash) and report["db_distinct_wafers"] == report["wafers"]
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+# nas_generator.py
+"""
+Synthetic NAS generator.
+
+Builds GTK and ASE style ZIP deliveries that scanner.scan_maps and the
+umc_writer converters accept, so the pipeline can be exercised without the
+production NAS.
+
+    python bench/nas_generator.py OUT_DIR --lots 4 --wafers 25 --rows 68 --cols 68
+"""
+import argparse
+import math
+import os
+import random
+import zipfile
+from datetime import datetime, timedelta
+
+# Devices must exist in product_config.csv
+GTK_DEVICE = "FT233H REVB DIE-AP"
+ASE_DEVICE = "FT4232HA DIE-AP"
+
+DEFAULT_BIN_MIX = "1:0.95,2:0.02,3:0.02,4:0.01"
+BASE_TIMESTAMP = datetime(2025, 11, 1, 8, 0, 0)
+
+
+# -------------------------
+# Helpers
+# -------------------------
+def parse_bin_mix(spec):
+    """
+    "1:0.95,2:0.05" -> [(1, 0.95), (2, 0.05)]
+    """
+    mix = []
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        b, weight = part.split(":", 1)
+        mix.append((int(b), float(weight)))
+    return mix
+
+
+def zip_timestamp(lot_idx, stage_idx=0, delivery=0):
+    ts = BASE_TIMESTAMP + timedelta(days=delivery, hours=lot_idx, minutes=stage_idx)
+    return ts.strftime("%Y_%m_%d_%H_%M_%S")
+
+
+def die_grid(rows, cols, bin_mix, rng):
+    """
+    Circular wafer on a rows x cols grid.
+    Returns list of rows; each cell is a bin number, "#" (edge) or None (off-wafer).
+    """
+    bins = [b for b, _ in bin_mix]
+    weights = [w for _, w in bin_mix]
+    cy, cx = (rows - 1) / 2, (cols - 1) / 2
+    radius = min(rows, cols) / 2
+
+    grid = []
+    for r in range(rows):
+        row = []
+        for c in range(cols):
+            dist = math.hypot((r - cy) / radius, (c - cx) / radius) * radius
+            if dist > radius:
+                row.append(None)
+            elif dist > radius - 1.5:
+                row.append("#")
+            else:
+                row.append(rng.choices(bins, weights)[0])
+        grid.append(row)
+    return grid
+
+
+def bin_counts(grid):
+    counts = {}
+    for row in grid:
+        for cell in row:
+            if isinstance(cell, int):
+                counts[cell] = counts.get(cell, 0) + 1
+    return counts
+
+
+# -------------------------
+# GTK format
+# -------------------------
+def gtk_wafer_txt(lot, wafer, grid):
+    counts = bin_counts(grid)
+    total = sum(counts.values())
+    good = counts.get(1, 0)
+    rows, cols = len(grid), len(grid[0])
+
+    lines = [
+        f"DEVICE_NAME={GTK_DEVICE}",
+        f"WAFER_ID={lot}{wafer:02d}-A5",
+        "FLAT=180___(DOWN)",
+        f"ROW={rows}",
+        f"COL={cols}",
+        f"TOTAL_TEST={total}",
+        f"TOTAL_PASS={good}",
+        f"TOTAL_FAIL={total - good}",
+        f"TEST_YIELD={good * 100 / total if total else 0:.2f}%",
+    ]
+    for r, row in enumerate(grid):
+        bottom = r >= rows - 2
+        line = ""
+        for cell in row:
+            if cell is None:
+                line += "."
+            elif cell == "#":
+                line += "~" if bottom else "#"
+            else:
+                line += str(cell % 10)
+        lines.append(line)
+    for b in sorted(counts):
+        lines.append(f"BIN{b:02d}({b}) = {counts[b]}")
+    return "\r\n".join(lines) + "\r\n"
+
+
+def write_gtk_zip(out_dir, lot, stage, ts, wafers, rows, cols, bin_mix, rng):
+    zip_name = f"{lot}.1_{stage}_{ts}.map.zip"
+    with zipfile.ZipFile(os.path.join(out_dir, zip_name), "w", zipfile.ZIP_DEFLATED) as zf:
+        for wafer in range(1, wafers + 1):
+            grid = die_grid(rows, cols, bin_mix, rng)
+            zf.writestr(f"{lot}{wafer:02d}-A5.txt", gtk_wafer_txt(lot, wafer, grid))
+    return zip_name
+
+
+# -------------------------
+# ASE format (old: lettered header, new: numbered header)
+# -------------------------
+def ase_wafer_txt(lot, wafer, stage, ts, grid, fmt="new"):
+    counts = bin_counts(grid)
+    total = sum(counts.values())
+    good = counts.get(1, 0)
+    start = datetime.strptime(ts, "%Y_%m_%d_%H_%M_%S").strftime("%Y-%m-%d %H:%M:%S")
+
+    header = [
+        ("Device Name", ASE_DEVICE),
+        ("Lot No", f"{lot}.00"),
+        ("Wafer ID", f"{wafer:02d}"),
+        ("Tester No", "J750-01"),
+        ("Operator Badge", "OP1234"),
+        ("Probe Card", "PC-SYN-01"),
+        ("Start Time", start),
+        ("Die Per Wafer", f"{total} ea"),
+        ("Total Good Dices", f"{good} ea"),
+        ("F/N Location", "DOWN"),
+    ]
+    if fmt == "old":
+        tags = [chr(ord("A") + i) for i in range(7)]
+        lines = [f"{tags[i]}. {k} : {v}" for i, (k, v) in enumerate(header[:7])]
+        lines += [f"{k}={v}" for k, v in header[7:]]
+    else:
+        lines = [f"{i + 1}. {k} : {v}" for i, (k, v) in enumerate(header)]
+
+    bins = sorted(counts)
+    lines += [
+        "",
+        f"{stage} Bin Count & Yield",
+        "BIN   " + " ".join(f"{b:>6}" for b in bins) + "  TOTAL",
+        "COUNT " + " ".join(f"{counts[b]:>6}" for b in bins) + f" {total:>6}",
+        "",
+        "NO. Bin Description Yield",
+    ]
+    for b in bins:
+        lines.append(f"{b:>3} BIN{b} {counts[b] * 100 / total if total else 0:.2f}%")
+    lines += ["=" * 40, "", "Wafer Map (In Hexadecimal Format)"]
+
+    cols = len(grid[0])
+    lines.append("    +|" + "---+" * cols)
+    for r, row in enumerate(grid, 1):
+        cells = []
+        for cell in row:
+            if cell is None:
+                cells.append("   .")
+            elif cell == "#":
+                cells.append("    ")
+            else:
+                cells.append(f"{cell:>4X}")
+        lines.append(f"{r:>4}|" + "".join(cells))
+    lines += ["", "[EXTENSION]", "[EOF]"]
+    return "\r\n".join(lines) + "\r\n"
+
+
+def write_ase_zip(out_dir, lot, stage, ts, wafers, rows, cols, bin_mix, rng, fmt="new"):
+    zip_name = f"{lot}_{stage}_{ts}.map.zip"
+    with zipfile.ZipFile(os.path.join(out_dir, zip_name), "w", zipfile.ZIP_DEFLATED) as zf:
+        for wafer in range(1, wafers + 1):
+            grid = die_grid(rows, cols, bin_mix, rng)
+            member = f"{lot}-{stage}T0-CJ00000000-{wafer:02d}.txt"
+            zf.writestr(member, ase_wafer_txt(lot, wafer, stage, ts, grid, fmt))
+    return zip_name
+
+
+# -------------------------
+# NAS tree
+# -------------------------
+def generate_nas(out_dir, lots=4, wafers=25, rows=68, cols=68,
+                 bin_mix=DEFAULT_BIN_MIX, stages=("CP1",), ase_format="new", seed=1, redeliveries=0):
+    """
+    Create <out_dir>/GREATEK/MAP and <out_dir>/ASE/MAP.
+    redeliveries: extra ZIPs per lot/stage with later timestamps (re-test
+    deliveries of the same wafers; only the newest should be uploaded).
+    Returns dict with both directories and the generated wafer keys
+    [(lot, wafer, stage), ...] per subcon.
+    """
+    rng = random.Random(seed)
+    mix = parse_bin_mix(bin_mix) if isinstance(bin_mix, str) else bin_mix
+    gtk_dir = os.path.join(out_dir, "GREATEK", "MAP")
+    ase_dir = os.path.join(out_dir, "ASE", "MAP")
+    os.makedirs(gtk_dir, exist_ok=True)
+    os.makedirs(ase_dir, exist_ok=True)
+
+    keys = {"GTK": [], "ASE": []}
+    for lot_idx in range(lots):
+        gtk_lot = f"SG{lot_idx:03d}"
+        ase_lot = f"SA{lot_idx:03d}"
+        for stage_idx, stage in enumerate(stages):
+            for delivery in range(redeliveries + 1):
+                ts = zip_timestamp(lot_idx, stage_idx, delivery)
+                write_gtk_zip(gtk_dir, gtk_lot, stage, ts, wafers, rows, cols, mix, rng)
+                write_ase_zip(ase_dir, ase_lot, stage, ts, wafers, rows, cols, mix, rng, ase_format)
+            for wafer in range(1, wafers + 1):
+                keys["GTK"].append((gtk_lot, wafer, stage))
+                keys["ASE"].append((ase_lot, wafer, stage))
+
+    return {"gtk_dir": gtk_dir, "ase_dir": ase_dir, "keys": keys}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic GTK/ASE NAS deliveries")
+    parser.add_argument("out_dir")
+    parser.add_argument("--lots", type=int, default=4)
+    parser.add_argument("--wafers", type=int, default=25, help="wafers per lot")
+    parser.add_argument("--rows", type=int, default=68)
+    parser.add_argument("--cols", type=int, default=68)
+    parser.add_argument("--bin-mix", default=DEFAULT_BIN_MIX, help='e.g. "1:0.95,2:0.05"')
+    parser.add_argument("--stages", default="CP1", help="comma separated, e.g. CP1,CP2")
+    parser.add_argument("--ase-format", choices=("old", "new"), default="new")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--redeliveries", type=int, default=0,
+                        help="extra newer ZIPs per lot/stage (superseded re-test deliveries)")
+    args = parser.parse_args()
+
+    nas = generate_nas(
+        args.out_dir, args.lots, args.wafers, args.rows, args.cols,
+        args.bin_mix, tuple(args.stages.split(",")), args.ase_format, args.seed,
+        args.redeliveries,
+    )
+    print(f"[GEN] GTK: {nas['gtk_dir']} ({len(nas['keys']['GTK'])} wafers)")
+    print(f"[GEN] ASE: {nas['ase_dir']} ({len(nas['keys']['ASE'])} wafers)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+# aio_runner.py
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Callable, NamedTuple, Optional
+
+from configs import (
+    FTP_BASE_URL, WAFER_MAX_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY,
+    ASYNC_WAFERS_IN_FLIGHT, ASYNC_ZIP_IO, ASYNC_FTP_CONNECTIONS, ASYNC_DB_SESSIONS,
+)
+from db import create_upload_session, create_factory_session
+from ftp_client import FTPClient
+from log_setup import get_thread_tag, set_thread_tag
+from retry import ErrorBudgetExceeded, backoff_delay
+import metrics
+
+log = logging.getLogger(__name__)
+
+# ============================================================
+# asyncio runner (main.py --runner async, GUI Options, WMU_RUNNER=async)
+# Scan, staging and the HTML diff stay in the subcon threads; the wafer
+# backlog of each product (Step 5) runs as asyncio tasks on one event loop
+# per run, shared by the subcon threads. Each step is the sync pipeline's
+# own function (main.wafer_*_step), run in a thread while holding its
+# resource, so outcomes and the journal are the same as with the sync loop:
+#   zip  extract + read + factory info + convert   ASYNC_ZIP_IO slots (own factory DB session each)
+#   ftp  upload + download-back verify              ASYNC_FTP_CONNECTIONS FTPClients
+#   db   ledger + upsert                            ASYNC_DB_SESSIONS sessions
+# At most ASYNC_WAFERS_IN_FLIGHT wafers of a product are in progress. A
+# failed wafer backs off with asyncio.sleep (no thread is held) and is
+# retried up to WAFER_MAX_ATTEMPTS; outcomes go through main.BacklogTally.
+# ============================================================
+
+
+class WaferSteps(NamedTuple):
+    """The pipeline steps of one product, bound to its journal / ledger / workspace."""
+    convert: Callable           # (fr_session, item) -> (umc_file, needs_upload)
+    upload: Optional[Callable]  # (ftp, db_session, item, umc_file); None = FTP disabled
+    db: Callable                # (db_session, item)
+
+
+class ResourcePool:
+    """A fixed set of handles; waiting for a free one is the resource's semaphore."""
+
+    def __init__(self, name, handles):
+        self.name = name
+        self.handles = list(handles)
+        self._free = asyncio.Queue()
+        for handle in self.handles:
+            self._free.put_nowait(handle)
+
+    @asynccontextmanager
+    async def get(self):
+        with metrics.span(f"async_wait_{self.name}"):
+            handle = await self._free.get()
+        try:
+            yield handle
+        finally:
+            self._free.put_nowait(handle)
+
+
+class AsyncRunner:
+    """
+    One per run: owns the event loop thread and the FTP / DB handles.
+        runner.run_backlog(wafermaps, tally, schedule, steps)   # from a subcon thread, blocks until done
+        runner.close()
+    """
+
+    def __init__(self, wafers_in_flight=ASYNC_WAFERS_IN_FLIGHT, zip_io=ASYNC_ZIP_IO,
+                 ftp_connections=ASYNC_FTP_CONNECTIONS, db_sessions=ASYNC_DB_SESSIONS):
+        self.wafers_in_flight = wafers_in_flight
+        self.loop = asyncio.new_event_loop()
+        # blocking steps run here; one thread per slot so a step never waits for a thread
+        self.loop.set_default_executor(ThreadPoolExecutor(
+            max_workers=zip_io + ftp_connections + db_sessions, thread_name_prefix="async-step"))
+        self._thread = threading.Thread(target=self.loop.run_forever, name="async-runner", daemon=True)
+        self._thread.start()
+        self.zip = self.ftp = self.db = None
+        self._call(self._open(zip_io, ftp_connections, db_sessions))
+        log.info(f"[ASYNC] Runner started: {zip_io} ZIP/convert, {ftp_connections} FTP, {db_sessions} DB slot(s), "
+                 f"{wafers_in_flight} wafers in flight per product")
+
+    def _call(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    async def _open(self, zip_io, ftp_connections, db_sessions):
+        self.zip = ResourcePool("zip", [create_factory_session() for _ in range(zip_io)])
+        self.ftp = ResourcePool("ftp", [FTPClient(FTP_BASE_URL) for _ in range(ftp_connections)])
+        self.db = ResourcePool("db", [create_upload_session() for _ in range(db_sessions)])
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.run_until_complete(self.loop.shutdown_default_executor())
+        self.loop.close()
+        if self.zip is not None:
+            for session in self.zip.handles + self.db.handles:
+                session.close()
+            for ftp in self.ftp.handles:
+                ftp.close()
+            self.zip = None
+
+    # -------------------------
+    # Backlog of one product
+    # -------------------------
+    def run_backlog(self, wafermaps, tally, schedule, steps):
+        """Process the wafermaps (in schedule order) on the loop; raises ErrorBudgetExceeded like the sync loop."""
+        self._call(self._backlog(wafermaps, tally, schedule, steps, get_thread_tag()))
+
+    async def _backlog(self, wafermaps, tally, schedule, steps, tag):
+        in_flight = asyncio.Semaphore(self.wafers_in_flight)
+        deferred = []
+        tasks = [
+            asyncio.ensure_future(self._wafer(item, tally, schedule, steps, tag, in_flight, deferred))
+            for item in wafermaps
+        ]
+        try:
+            done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+            for task in done:
+                if task.exception() is not None:
+                    raise task.exception()
+        finally:
+            for task in tasks:
+                task.cancel()
+        if deferred:
+            set_thread_tag(tag)
+            tally.deferred(schedule, deferred, len(wafermaps))
+
+    async def _wafer(self, item, tally, schedule, steps, tag, in_flight, deferred):
+        attempt = 1
+        while True:
+            async with in_flight:
+                # the time budget is checked at every wafer boundary, as in the sync loop
+                if schedule is not None and schedule.expired():
+                    deferred.append(item)
+                    return
+                wafer_desc = f"{item['lot']} W{item['wafer']} {item['stage']}"
+                log.debug(f"----- {wafer_desc} (attempt {attempt}) -----")
+                try:
+                    result = await self._attempt(item, steps, tag)
+                except (ErrorBudgetExceeded, asyncio.CancelledError):
+                    raise
+                except Exception as e:
+                    delay = backoff_delay(attempt, RETRY_BASE_DELAY, RETRY_MAX_DELAY) \
+                        if attempt < WAFER_MAX_ATTEMPTS else None
+                    set_thread_tag(tag)   # the loop thread logs for every subcon; no await until the next call
+                    tally.failed(item, attempt, e, delay)
+                    if delay is None:
+                        return
+                else:
+                    set_thread_tag(tag)
+                    tally.done(item, *result)
+                    return
+            await asyncio.sleep(delay)   # outside the in-flight slot, other wafers go ahead meanwhile
+            attempt += 1
+
+    async def _attempt(self, item, steps, tag):
+        async with self.zip.get() as fr_session:
+            umc_file, needs_upload = await self._in_thread(tag, steps.convert, fr_session, item)
+        uploaded = False
+        if needs_upload:
+            if steps.upload is None:
+                return umc_file, False, False
+            async with self.ftp.get() as ftp, self.db.get() as db_session:
+                await self._in_thread(tag, steps.upload, ftp, db_session, item, umc_file)
+            uploaded = True
+        async with self.db.get() as db_session:
+            await self._in_thread(tag, steps.db, db_session, item)
+        return umc_file, uploaded, True
+
+    @staticmethod
+    async def _in_thread(tag, func, *args):
+        def call():
+            set_thread_tag(tag)   # console lines keep the subcon prefix
+            return func(*args)
+        step = asyncio.ensure_future(asyncio.to_thread(call))
+        try:
+            return await asyncio.shield(step)
+        except asyncio.CancelledError:
+            # a thread cannot be interrupted: keep the handle until the step is over (run aborted)
+            await asyncio.wait([step])
+            raise
@@ -0,0 +1,134 @@
+# catalog.py
+import bisect
+import csv
+import logging
+import os
+import threading
+
+from utils import parse_soft_bins
+
+log = logging.getLogger(__name__)
+
+# ============================================================
+# Product catalog (product_config.csv)
+# Parsed once per process into every product of the CSV plus a device
+# name index, and parsed again only when the file's mtime / size changed
+# (CatalogCache.refresh() at the start of each run and when the GUI
+# lists products). DEVICE_NAME entries ("|" separated):
+#   FT233H REVB DIE-AP       exact name                              dict, O(1)
+#   FT232R V2 REVC DIE-AP*   prefix: any name starting with it       sorted list + bisect, O(log n)
+# A map device "FT233H REVB DIE-AP~ENG1" (~suffix variant) matches the
+# entry of "FT233H REVB DIE-AP" unless it is listed itself.
+# Results are memoized per distinct device name.
+# ============================================================
+
+
+class DeviceIndex:
+    """Device name -> product: exact, then ~suffix variant, then longest prefix entry."""
+
+    def __init__(self, device_to_product):
+        self.exact = {}
+        self.prefix_product = {}
+        for device, product in device_to_product.items():
+            if device.endswith("*"):
+                self.prefix_product[device[:-1]] = product
+            else:
+                self.exact[device] = product
+        self.prefixes = sorted(self.prefix_product)
+        self._memo = {}
+
+    def lookup(self, device):
+        if not device:
+            return None
+        try:
+            return self._memo[device]
+        except KeyError:
+            pass
+        product = self.exact.get(device)
+        if product is None and "~" in device:
+            product = self.exact.get(device.split("~", 1)[0].rstrip())
+        if product is None:
+            prefix = self.longest_prefix(device)
+            product = self.prefix_product[prefix] if prefix is not None else None
+        self._memo[device] = product
+        return product
+
+    def longest_prefix(self, name):
+        """
+        Longest prefix entry of name. The candidate is the largest entry <= name;
+        if it is not a prefix, no longer entry can be, so search again for the
+        part name and candidate have in common.
+        """
+        while name:
+            i = bisect.bisect_right(self.prefixes, name)
+            if i == 0:
+                return None
+            candidate = self.prefixes[i - 1]
+            if name.startswith(candidate):
+                return candidate
+            name = os.path.commonprefix([name, candidate])
+        return None
+
+
+def read_catalog(path):
+    """({product: config}, {device entry: product}) from product_config.csv, in file order."""
+    products = {}
+    devices = {}
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f, delimiter=","):
+            product = row["PRODUCT"].strip()
+            if not product:
+                continue
+            for device in row["DEVICE_NAME"].split("|"):
+                device = device.strip()
+                if device:
+                    devices[device] = product
+            products[product] = {
+                "subcon": row["SUBCON"].strip(),
+                "tester": row["TESTER"].strip(),
+                "test_program": row["TEST_PROGRAM"].strip(),
+                "load_board": row["LOAD_BOARD"].strip(),
+                "probe_card": row["PROBE_CARD"].strip(),
+                "soft_bins": parse_soft_bins(row["SOFT_BINS"]),
+            }
+    return products, devices
+
+
+class CatalogCache:
+    """
+    The parsed CSV of this process. `products` is one dict updated in place,
+    so modules holding it (configs.PRODUCT_CONFIG) see a reloaded file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.products = {}
+        self.devices = DeviceIndex({})
+        self._stamp = None
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self):
+        """Re-read the CSV if it changed since the last read. Returns True if it was (re)loaded."""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            if self._stamp is None:
+                log.warning(f"[CONFIG] {self.path} not found. No products loaded.")
+            return False
+        stamp = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            if stamp == self._stamp:
+                return False
+            products, devices = read_catalog(self.path)
+            self.products.clear()
+            self.products.update(products)
+            self.devices = DeviceIndex(devices)
+            reloaded = self._stamp is not None
+            self._stamp = stamp
+        log.info(f"[CONFIG] {'Reloaded' if reloaded else 'Loaded'} {len(products)} products from {self.path}")
+        return True
+
+    def device_product(self, device):
+        """Product of a wafer map DEVICE_NAME, None if not in the CSV."""
+        return self.devices.lookup(device)
@@ -1,9 +1,8 @@
 # configs.py
 import os
 from dotenv import load_dotenv
-import csv
 import sys
-from utils import parse_soft_bins
+from catalog import CatalogCache
 
 load_dotenv()
 
@@ -14,6 +13,7 @@ if getattr(sys, 'frozen', False):
 else:
     BASE_DIR = os.path.dirname(os.path.abspath(__file__))
     EXE_DIR = BASE_DIR
+EXE_DIR = os.getenv("WMU_EXE_DIR", EXE_DIR)   # Local override for run outputs (benchmarks / dry runs)
 
 
 #script details
@@ -29,6 +29,95 @@ if IS_PRODUCTION_MODE == IS_TEST_DEBUG_MODE:
     print("Wrong Debug Mode")
     sys.exit(1)
 
+#Log level: DEBUG shows per-wafer detail, INFO keeps production logs to summaries
+LOG_LEVEL = os.getenv("WMU_LOG_LEVEL", "INFO" if IS_PRODUCTION_MODE else "DEBUG")
+
+#Service mode (main.py --service): NAS poll interval and how often to do a full sweep
+SERVICE_POLL_INTERVAL = int(os.getenv("WMU_SERVICE_INTERVAL", "300"))  # seconds
+SERVICE_FULL_SWEEP_EVERY = 12   # polls; also retries wafers left NOT_UPLOADED
+
+#Failure handling: a failed wafer is retried with exponential backoff + jitter,
+#the run is aborted once RUN_ERROR_BUDGET failed attempts have been spent
+WAFER_MAX_ATTEMPTS = 3
+RETRY_BASE_DELAY = 5        # seconds, doubled per attempt
+RETRY_MAX_DELAY = 120       # seconds
+RUN_ERROR_BUDGET = int(os.getenv("WMU_RUN_ERROR_BUDGET", "25"))
+
+#Upload ledger: a .umc whose name + SHA-256 match a verified upload is not sent again.
+#True = download it back once more to re-verify instead of skipping outright
+LEDGER_REVERIFY = False
+
+#Scratch area in TEMP_DL_DIR: per-run subdirectory, ZIP copies deleted once their wafers are done;
+#leftovers are evicted after SCRATCH_MAX_AGE_DAYS or (oldest first) while over SCRATCH_MAX_BYTES
+SCRATCH_MAX_BYTES = int(os.getenv("WMU_SCRATCH_MAX_MB", "20480")) * 1024 * 1024
+SCRATCH_MAX_AGE_DAYS = 7
+SCRATCH_IDLE_SECONDS = 3600     # leftovers touched more recently may belong to a live instance
+
+#NAS staging: ZIPs are copied by STAGE_WORKERS threads with a large buffer, hashed while copying,
+#and reused by later runs while the NAS file keeps the same size + mtime
+STAGE_WORKERS = 4
+STAGE_BUFFER_BYTES = 1024 * 1024
+STAGE_RETRIES = 5
+
+#Worker mode (main.py --worker): instances split the backlog by leasing lot/stage groups.
+#A lease not renewed for LEASE_SECONDS (worker crashed) is taken over by another worker
+LEASE_SECONDS = int(os.getenv("WMU_LEASE_SECONDS", "600"))
+LEASE_BATCH = 4             # lot/stage groups leased per run_main call
+LEASE_DB_RETRIES = 3        # attempts per lease statement on DB errors (locked, deadlock, lost connection)
+LEASE_RETRY_WAIT = 30       # seconds before a worker retries a pass the DB failed
+
+#HTML status diff: rows matched by product/lot/wafer/stage, changed fields highlighted.
+#True = leave unchanged rows out of wafer_upload_diff_<product>.html (compact report)
+DIFF_CHANGES_ONLY = os.getenv("WMU_DIFF_CHANGES_ONLY", "0") == "1"
+
+#Notification: one digest mail per run, sent by a background thread (notifier.py).
+#MAIL_TRANSPORT: outlook (Outlook COM), smtp (SMTP_HOST relay) or file (.eml files in MAIL_OUTBOX_DIR)
+MAIL_TRANSPORT = os.getenv("WMU_MAIL_TRANSPORT", "outlook")
+MAIL_FROM = os.getenv("WMU_MAIL_FROM", "wafermap_uploader@ftdichip.com")
+SMTP_HOST = os.getenv("WMU_SMTP_HOST", "localhost")
+SMTP_PORT = int(os.getenv("WMU_SMTP_PORT", "25"))
+SMTP_USERPWD = os.getenv("WMU_SMTP_USERPWD", "")      # "user:password", empty = no login
+SMTP_STARTTLS = os.getenv("WMU_SMTP_STARTTLS", "0") == "1"
+MAIL_OUTBOX_DIR = os.getenv("WMU_MAIL_OUTBOX_DIR", os.path.join(EXE_DIR, "outbox"))
+MAIL_RETRIES = 3
+MAIL_FLUSH_TIMEOUT = 120    # seconds the process waits at exit for queued mails
+
+#UMC conversion: CONVERT_WORKERS processes (spawned on first use; 1 = convert in the upload thread),
+#CONVERT_CHUNK wafers per task, up to CONVERT_AHEAD_CHUNKS tasks queued ahead of the wafer being uploaded
+CONVERT_WORKERS = int(os.getenv("WMU_CONVERT_WORKERS", str(max(1, min(4, (os.cpu_count() or 1) - 1)))))
+CONVERT_CHUNK = 8
+CONVERT_AHEAD_CHUNKS = 2
+
+#GUI progress: events from the pipeline are drained every GUI_POLL_MS;
+#wafers/min and the ETA use the wafers finished in the last PROGRESS_RATE_WINDOW seconds
+GUI_POLL_MS = 250
+PROGRESS_RATE_WINDOW = 300
+
+#Lot prefilter: the product of each lot is learned from scans (lot_products.json) and ZIPs of lots
+#belonging to another product are skipped unopened; a lot not re-read for LOT_PREFILTER_RECHECK_DAYS is opened again
+LOT_PREFILTER = os.getenv("WMU_LOT_PREFILTER", "1") == "1"
+LOT_PREFILTER_RECHECK_DAYS = 30
+
+#Backlog scheduling (scheduler.py): NOT_UPLOADED wafers are processed HOT_LOTS first, then by SCHEDULE_ORDER
+#("oldest" = delivery timestamp in the ZIP name, "scan" = NAS name order). PRODUCT_QUOTAS ("FT233H-B=200,...") caps
+#the wafers per product per run; RUN_TIME_BUDGET (minutes, 0 = none) stops the run at the next wafer boundary.
+#Wafers left over stay NOT_UPLOADED for the next run
+SCHEDULE_ORDER = os.getenv("WMU_SCHEDULE_ORDER", "oldest")
+HOT_LOTS = [lot.strip() for lot in os.getenv("WMU_HOT_LOTS", "").split(",") if lot.strip()]
+PRODUCT_QUOTAS = {
+    product.strip(): int(count)
+    for product, count in (item.split("=", 1) for item in os.getenv("WMU_PRODUCT_QUOTAS", "").split(",") if "=" in item)
+}
+RUN_TIME_BUDGET = int(os.getenv("WMU_RUN_TIME_BUDGET", "0"))
+
+#Run backend: "sync" (each product's wafers one at a time) or "async" (aio_runner.py: the wafers run as asyncio
+#tasks, at most ASYNC_WAFERS_IN_FLIGHT per product; ZIP/convert, FTP and DB slots are shared by the whole run)
+RUNNER = os.getenv("WMU_RUNNER", "sync")
+ASYNC_WAFERS_IN_FLIGHT = 8
+ASYNC_ZIP_IO = 4            # wafers being extracted / read / converted at once
+ASYNC_FTP_CONNECTIONS = int(os.getenv("WMU_ASYNC_FTP_CONNECTIONS", "2"))
+ASYNC_DB_SESSIONS = int(os.getenv("WMU_ASYNC_DB_SESSIONS", "4"))
+
 # -------------------------
 # CONFIG
 # -------------------------
@@ -54,6 +143,8 @@ PRODUCT_TO_CHECK.append("FT232RV2-C")   #FT232R V2 REVC DIE-AP_TW02
 #ASE Products
 PRODUCT_TO_CHECK.append("FT4232HA")      #FT4232HA DIE-AP
 PRODUCT_TO_CHECK.append("FT4232HAN")     #FT4232HAN DIE-AP
+#Products processed by service / worker mode when none are given on the command line
+ENABLED_PRODUCTS = list(PRODUCT_TO_CHECK)
 
 
 
@@ -66,6 +157,7 @@ if IS_PRODUCTION_MODE:
     ROOT_DIR = fr"D:\UMC_log_Processing\files_for_FTP_processing\wmu_v{script_ver}"
 elif IS_TEST_DEBUG_MODE:
     ROOT_DIR = os.path.join(EXE_DIR, "converted_umc")
+ROOT_DIR = os.getenv("WMU_ROOT_DIR", ROOT_DIR)   # Local override (benchmarks / dry runs)
 
 ##Path for the raw wafer map to be converted
 ##NAS_MAP_DIR = r"M:\DOWNLOADED\CR_Micro\PROBE\MAP"      # REFERENCE contains wafermap from the OSAT
@@ -81,6 +173,7 @@ if IS_PRODUCTION_MODE:
     TEMP_DL_DIR = fr"D:\UMC_log_Processing\files_for_FTP_processing\wmu_v{script_ver}\temp_dl_area"
 elif IS_TEST_DEBUG_MODE:
     TEMP_DL_DIR = os.path.join(EXE_DIR, "temp_dl")
+TEMP_DL_DIR = os.getenv("WMU_TEMP_DL_DIR", TEMP_DL_DIR)   # Local override (benchmarks / dry runs)
 
 
 # -------------------------
@@ -98,6 +191,9 @@ elif IS_TEST_DEBUG_MODE:
 #DB Factory reports
 DB_FACT_REPORT_TABLE = "factory_reports.gtk_cp_report_sg"               #
 
+#SQL instrumentation (db.py): statements slower than DB_SLOW_QUERY_MS are written to the log as [SLOW SQL]
+DB_SLOW_QUERY_MS = int(os.getenv("WMU_DB_SLOW_QUERY_MS", "500"))
+
 
 # -------------------------
 # FTP
@@ -113,20 +209,31 @@ if IS_PRODUCTION_MODE:
     FTP_BASE_URL = "ftp://tftdi@ftp1.umc.com/CP_S_UMC"               # PRODUCTION
 elif IS_TEST_DEBUG_MODE:
     FTP_BASE_URL = "ftp://tftdi@ftp1.umc.com/CP_S_UMC/test_dir_geoff" # TEST Environment
+FTP_BASE_URL = os.getenv("WMU_FTP_BASE_URL", FTP_BASE_URL)   # Local override (benchmarks / dry runs)
 
 # -------------------------
 # Set NAS Directory based from  Product Configs in CSV
 # -------------------------
+#Local override of the NAS share per subcon (benchmarks / dry runs)
+NAS_MAP_DIR_ENV = {
+    "GREATEK TAIWAN": "WMU_NAS_MAP_DIR_GTK",
+    "ASE TAIWAN": "WMU_NAS_MAP_DIR_ASE",
+}
+
 def set_nas_dir(subcon):
     NAS_MAP_DIR = "NA"
+    override = os.getenv(NAS_MAP_DIR_ENV.get(subcon, ""), "")
+    if override:
+        print(f"Directory  is set to {override}")
+        return override
+
     if IS_PRODUCTION_MODE:
         if subcon == "GREATEK TAIWAN":
             NAS_MAP_DIR = r"M:\DOWNLOADED\GREATEK\MAP"  # PRODUCTION
         elif subcon == "ASE TAIWAN":
             NAS_MAP_DIR = r"M:\DOWNLOADED\ASE\MAP"  #NEED TO PUT CORRECT PATH
         else:
-            print("Unknown subcon")
-            sys.exit(1)
+            raise ValueError(f"Unknown subcon: {subcon}")
     elif IS_TEST_DEBUG_MODE:
         if subcon == "GREATEK TAIWAN":
             #NAS_MAP_DIR = os.path.join(EXE_DIR, "GTK_raw_wafer_map")  # TEST Environment
@@ -148,47 +255,9 @@ PRODUCT_CSV = os.path.join(BASE_DIR, "product_config.csv")
 
 
 
-if PRODUCT_TO_CHECK:
-    # Normalize PRODUCT_TO_CHECK to a set
-    if isinstance(PRODUCT_TO_CHECK, str):
-        PRODUCTS_TO_LOAD = {PRODUCT_TO_CHECK}
-    else:
-        PRODUCTS_TO_LOAD = set(PRODUCT_TO_CHECK)
-
-else:
-    # PRODUCT_TO_CHECK not defined yet — first GUI run
-    PRODUCTS_TO_LOAD = set()
-
-PRODUCT_CONFIG = {"_device_to_product": {}}
-
-# Load CSV only if PRODUCTS_TO_LOAD is not empty
-if PRODUCTS_TO_LOAD:
-    with open(PRODUCT_CSV, newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f, delimiter=",")
-
-        for row in reader:
-            product = row["PRODUCT"].strip()
-
-
-            #  Skip products not requested
-            if product not in PRODUCTS_TO_LOAD:
-                continue
-
-            device_names = row["DEVICE_NAME"].split("|")
-            for device in device_names:
-                device = device.strip()
-
-            #device = row["DEVICE_NAME"].strip()
-                if device:
-                    PRODUCT_CONFIG["_device_to_product"][device] = product
-
-            PRODUCT_CONFIG[product] = {
-                "subcon": row["SUBCON"].strip(),
-                "tester": row["TESTER"].strip(),
-                "test_program": row["TEST_PROGRAM"].strip(),
-                "load_board": row["LOAD_BOARD"].strip(),
-                "probe_card": row["PROBE_CARD"].strip(),
-                "soft_bins": parse_soft_bins(row["SOFT_BINS"]),
-            }
+#Every product of the CSV, loaded once and refreshed in place (PRODUCT_CATALOG.refresh()) when the file changes;
+#wafer map device names are matched through PRODUCT_CATALOG.device_product (exact, prefix*, ~suffix)
+PRODUCT_CATALOG = CatalogCache(PRODUCT_CSV)
+PRODUCT_CONFIG = PRODUCT_CATALOG.products
 
-    print(f"[CONFIG] Loaded products from CSV: {list(PRODUCTS_TO_LOAD)}")
+print(f"[CONFIG] Loaded products from CSV: {list(PRODUCT_CONFIG)}")
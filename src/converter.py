@@ -0,0 +1,169 @@
+# converter.py
+import io
+import itertools
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from configs import CONVERT_WORKERS, CONVERT_CHUNK, CONVERT_AHEAD_CHUNKS, PRODUCT_CATALOG
+from umc_writer import convert_GTK, convert_ASE, iter_text_lines, iter_umc
+
+log = logging.getLogger(__name__)
+
+# ============================================================
+# UMC conversion off the main interpreter
+# convert_bytes is the pure conversion: wafer map bytes in, UMC bytes out,
+# decoded / encoded exactly like process_wafer_GTK / process_wafer_ASE
+# (GTK: locale encoding, ASE: UTF-8; universal newlines in, os.linesep out).
+# ConversionPool runs it in CONVERT_WORKERS spawned processes, CONVERT_CHUNK
+# wafers per task; Lookahead keeps the next wafers of a product converting
+# while the current one is uploaded. The entry scripts (gui.py, main.py)
+# call multiprocessing.freeze_support() so this also works in the EXE.
+# A spawned worker re-imports the entry script: nothing it imports may
+# touch the DB at import time (db.py connects on first use).
+# Service and worker mode keep one pool for the whole session.
+# ============================================================
+ENCODINGS = {"GTK": None, "ASE": "utf-8"}     # None = locale encoding, as open() without encoding
+CONVERTERS = {"GTK": convert_GTK, "ASE": convert_ASE}
+
+
+def convert_bytes(subcon, raw, lot, wafer, product, stage, zip_timestamp=None, factory_info=None):
+    """
+    Wafer map bytes (or mmap) -> (lot_prefix, umc_name, umc_bytes).
+    Lines are decoded one at a time from the buffer and the UMC text is
+    encoded piece by piece, so neither side exists as one big str.
+    """
+    encoding = ENCODINGS[subcon]
+    lot_prefix, umc_name, pieces = CONVERTERS[subcon](
+        iter_text_lines(raw, encoding), lot, wafer, product, stage, zip_timestamp, factory_info, render=iter_umc
+    )
+    out = io.BytesIO()
+    writer = io.TextIOWrapper(out, encoding=encoding)
+    for piece in pieces:
+        writer.write(piece)
+    writer.flush()
+    umc_bytes = out.getvalue()
+    writer.detach()
+    return lot_prefix, umc_name, umc_bytes
+
+
+# -------------------------
+# Worker process side
+# -------------------------
+def _init_worker(log_level):
+    """Once per worker: configs (product_config.csv) and the converters are loaded by importing this module."""
+    logging.basicConfig(level=log_level, format="[convert worker] %(message)s")
+
+
+def _convert_chunk(jobs):
+    """[(key, convert_bytes kwargs)] -> [(key, result or None, error text or None)]."""
+    PRODUCT_CATALOG.refresh()   # the pool can outlive a run (service mode): pick up CSV edits
+    results = []
+    for key, job in jobs:
+        try:
+            results.append((key, convert_bytes(**job), None))
+        except Exception as e:
+            results.append((key, None, f"{type(e).__name__}: {e}"))
+    return results
+
+
+# -------------------------
+# Parent side
+# -------------------------
+class ConversionPool:
+    """Process pool shared by the subcon threads of a run (or a whole session); workers start on first use."""
+
+    def __init__(self, workers=CONVERT_WORKERS):
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()   # first use can come from several threads at once
+
+    def submit(self, jobs):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(logging.getLogger().getEffectiveLevel(),),
+                )
+                log.info(f"[CONVERT] Started {self.workers} conversion worker processes")
+        return self._executor.submit(_convert_chunk, jobs)
+
+    def convert(self, **job):
+        """convert_bytes(**job) in a worker process; blocks the calling thread (asyncio runner)."""
+        [(_, result, error)] = self.submit([(None, job)]).result()
+        if error:
+            raise RuntimeError(error)
+        return result
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+
+class Lookahead:
+    """
+    Keeps the wafers at the head of a product's queue converting in the pool.
+        ahead.fill(pending)  -> submit the next not yet submitted wafers, in chunks
+        ahead.take(key)      -> (lot_prefix, umc_name, umc_bytes), or None if the
+                                wafer was not submitted (retries convert inline)
+    key_of(item)   -> the wafer's key
+    make_job(item) -> convert_bytes kwargs, or None if the wafer needs no conversion;
+                      runs in the calling thread (extract, factory info).
+                      Wafers it raises for are left to the inline path.
+    """
+
+    def __init__(self, pool, key_of, make_job, chunk=CONVERT_CHUNK, depth=CONVERT_AHEAD_CHUNKS):
+        self.pool = pool
+        self.key_of = key_of
+        self.make_job = make_job
+        self.chunk = chunk
+        self.depth = depth
+        self._futures = {}      # key -> future of its chunk
+        self._in_flight = set()
+        self._submitted = set()
+
+    def fill(self, pending):
+        self._in_flight = {f for f in self._in_flight if not f.done()}
+        window = itertools.islice(pending, self.chunk * self.depth)
+        jobs = []
+        for item in window:
+            if len(self._in_flight) >= self.depth:
+                break
+            key = self.key_of(item)
+            if key in self._submitted:
+                continue
+            self._submitted.add(key)
+            try:
+                job = self.make_job(item)
+            except Exception as e:
+                log.debug(f"[CONVERT] {key} not prefetched, converting inline: {e}")
+                continue
+            if job is None:
+                continue
+            jobs.append((key, job))
+            if len(jobs) == self.chunk:
+                self._submit(jobs)
+                jobs = []
+        if jobs:
+            self._submit(jobs)
+
+    def _submit(self, jobs):
+        future = self.pool.submit(jobs)
+        self._in_flight.add(future)
+        for key, _ in jobs:
+            self._futures[key] = future
+
+    def take(self, key):
+        future = self._futures.pop(key, None)
+        if future is None:
+            return None
+        for result_key, result, error in future.result():
+            if result_key == key:
+                if error:
+                    raise RuntimeError(error)
+                return result
+        return None
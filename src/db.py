@@ -1,68 +1,288 @@
 # db.py
+import os
+import logging
+import threading
+import time
 import sqlalchemy
-from sqlalchemy import Table, MetaData, select, update, insert, and_
+from sqlalchemy import Table, MetaData, Column, String, Integer, DateTime, select, update, insert, and_, event
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 from datetime import datetime
-from configs import DB_URI, DB_UPLOAD_TABLE, DB_FACT_REPORT_TABLE
-import sys
+from configs import DB_URI, DB_UPLOAD_TABLE, DB_FACT_REPORT_TABLE, DB_SLOW_QUERY_MS
 import configs
+import metrics
+
+log = logging.getLogger(__name__)
+slow_log = logging.getLogger("db.slow")
+
+# ============================================================
+# SQL instrumentation
+# Every cursor execute is timed by the engine events below and recorded
+# as the "sql_<label>" metric (count, p50 / p95, latency histogram). The
+# label is the wmu_label execution option the helpers in this module set
+# ("status_lookup", "upsert_insert", ...), else the statement verb.
+# Statements slower than DB_SLOW_QUERY_MS are logged as [SLOW SQL]; the
+# wait for a pooled connection is recorded as "db_pool_checkout".
+# sql_summary_lines() is written to the run log at the end of each run.
+# ============================================================
+SQL_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)   # seconds
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited (including opening a new connection)."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            metrics.observe("db_pool_checkout", time.perf_counter() - start, buckets=SQL_BUCKETS)
+
+
+def labelled(name):
+    """Execution options that name a statement in the SQL metrics."""
+    return {"wmu_label": name}
+
 
 # ============================================================
 # Engine (shared, safe pool settings)
+# Created on first use, not at import: conversion worker processes
+# (converter.py, spawn) re-import main.py and must not open the DB.
 # ============================================================
-engine = sqlalchemy.create_engine(
-    DB_URI,
-    pool_size=5,
-    max_overflow=10,
-    pool_timeout=30,
-    pool_pre_ping=True,
-)
+_engine = None
+_engine_lock = threading.Lock()
+SessionFactory = sessionmaker()
+
+
+def get_engine():
+    """The process-wide engine; the first call creates it and binds SessionFactory."""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            engine = sqlalchemy.create_engine(
+                DB_URI,
+                poolclass=TimedQueuePool,
+                pool_size=5,
+                max_overflow=10,
+                pool_timeout=30,
+                pool_pre_ping=True,
+            )
+            event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+            event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+            event.listen(engine, "handle_error", _handle_error)
+            if engine.dialect.name == "sqlite":
+                event.listen(engine, "connect", _attach_sqlite_schemas)
+            SessionFactory.configure(bind=engine)
+            _engine = engine
+        return _engine
+
+
+def statement_label(context, statement):
+    label = context.execution_options.get("wmu_label") if context is not None else None
+    return label or statement.lstrip().split(None, 1)[0].lower()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("wmu_query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["wmu_query_start"].pop()
+    label = statement_label(context, statement)
+    metrics.observe(f"sql_{label}", elapsed, buckets=SQL_BUCKETS)
+    if elapsed * 1000 >= DB_SLOW_QUERY_MS:
+        metrics.incr("sql_slow")
+        slow_log.warning(f"[SLOW SQL] {elapsed * 1000:.0f} ms {label}: {' '.join(statement.split())[:300]} "
+                         f"params={parameters!r:.200}")
+
+
+def _handle_error(exception_context):
+    """A failed statement never reaches after_cursor_execute: drop its start time, count it."""
+    conn = exception_context.connection
+    if exception_context.statement is not None and conn is not None and conn.info.get("wmu_query_start"):
+        conn.info["wmu_query_start"].pop()
+        metrics.incr("sql_errors")
+
 
-SessionFactory = sessionmaker(bind=engine)
+def sql_summary_lines():
+    """Run log summary: latency per statement label and pool checkout wait, slowest total first."""
+    data = metrics.summary()
+    rows = [(name, s) for name, s in data["spans"].items() if name.startswith("sql_") or name == "db_pool_checkout"]
+    if not rows:
+        return []
+    lines = [
+        "[SQL] Statement latency this run:",
+        f"    {'statement':<26}{'count':>7}{'total s':>10}{'p50 ms':>9}{'p95 ms':>9}{'max ms':>9}",
+    ]
+    for name, s in sorted(rows, key=lambda row: -row[1]["total_s"]):
+        lines.append(f"    {name:<26}{s['count']:>7}{s['total_s']:>10.3f}{s['p50_s'] * 1000:>9.1f}"
+                     f"{s['p95_s'] * 1000:>9.1f}{s['max_s'] * 1000:>9.1f}")
+    counters = data["counters"]
+    lines.append(f"    slow (>= {DB_SLOW_QUERY_MS} ms): {counters.get('sql_slow', 0)}, "
+                 f"failed: {counters.get('sql_errors', 0)}, pool: {get_engine().pool.status()}")
+    return lines
 
 # ============================================================
 # Metadata
 # ============================================================
 metadata = MetaData()
 
-# ============================================================
-# Upload Status Table (WRITE)
-# ============================================================
 if "." in DB_UPLOAD_TABLE:
     UPLOAD_SCHEMA, UPLOAD_TABLE = DB_UPLOAD_TABLE.split(".")
 else:
     UPLOAD_SCHEMA, UPLOAD_TABLE = None, DB_UPLOAD_TABLE
 
-upload_table = Table(
-    UPLOAD_TABLE,
+FACT_SCHEMA, FACT_TABLE = DB_FACT_REPORT_TABLE.split(".")
+
+# ============================================================
+# SQLite stand-in (benchmarks / local runs)
+# Each MySQL schema becomes "<schema>.db" next to the main DB file
+# ============================================================
+def _attach_sqlite_schemas(dbapi_connection, connection_record):
+    db_dir = os.path.dirname(os.path.abspath(sqlalchemy.engine.make_url(DB_URI).database or ""))
+    for schema in sorted({UPLOAD_SCHEMA, FACT_SCHEMA} - {None}):
+        dbapi_connection.execute(
+            f"ATTACH DATABASE ? AS {schema}",
+            (os.path.join(db_dir, f"{schema}.db"),),
+        )
+
+# ============================================================
+# Upload Status Table (WRITE) / Factory Report Table (READ ONLY)
+# Reflected from the DB on first use (get_upload_table / get_factory_table)
+# ============================================================
+_reflected = {}    # table name -> reflected Table
+_reflect_lock = threading.Lock()
+
+
+def _reflect(name, schema):
+    engine = get_engine()
+    with _reflect_lock:
+        if name not in _reflected:
+            _reflected[name] = Table(name, metadata, schema=schema, autoload_with=engine)
+        return _reflected[name]
+
+
+def get_upload_table():
+    return _reflect(UPLOAD_TABLE, UPLOAD_SCHEMA)
+
+
+def get_factory_table():
+    return _reflect(FACT_TABLE, FACT_SCHEMA)
+
+# ============================================================
+# Upload Ledger (side table, same schema as the upload table)
+# SHA-256 + remote name of every verified FTP upload, so a byte-identical
+# .umc is never transferred twice. Created on first use (ensure_side_table);
+# if the DB user cannot create it the ledger is simply disabled.
+# ============================================================
+LEDGER_TABLE = "wafers_upload_ledger"
+
+ledger_table = Table(
+    LEDGER_TABLE,
     metadata,
+    Column("remote_name", String(255), primary_key=True),
+    Column("sha256", String(64), nullable=False),
+    Column("size", Integer),
+    Column("Product", String(64)),
+    Column("Lot_Number", String(64)),
+    Column("Wafer_Id", Integer),
+    Column("stage", String(16)),
+    Column("uploaded_at", DateTime),
     schema=UPLOAD_SCHEMA,
-    autoload_with=engine,
 )
 
+
+def create_side_table(table):
+    """CREATE TABLE if missing; another instance creating it at the same moment is fine."""
+    try:
+        table.create(get_engine(), checkfirst=True)
+    except SQLAlchemyError:
+        if not sqlalchemy.inspect(get_engine()).has_table(table.name, schema=table.schema):
+            raise
+
+
+_side_tables = {}    # table name -> True (ready) / False (cannot be created)
+_side_tables_lock = threading.Lock()
+
+
+def ensure_side_table(table, unavailable):
+    """
+    Create a side table the first time it is needed in this process.
+    Returns False (warning logged once) if the DB user cannot create it.
+    """
+    with _side_tables_lock:
+        if table.name not in _side_tables:
+            try:
+                create_side_table(table)
+                _side_tables[table.name] = True
+            except SQLAlchemyError as e:
+                log.warning(f"[DB] {unavailable}, cannot create {table.name}: {e}")
+                _side_tables[table.name] = False
+        return _side_tables[table.name]
+
+
+def ledger_enabled():
+    return ensure_side_table(ledger_table, "Upload ledger disabled")
+
 # ============================================================
-# Factory Report Table (READ ONLY)
+# Work Leases (side table, worker mode only, see leases.py)
+# One row per lot/stage group of NAS ZIPs: which worker holds it until
+# when, and the delivery signature it last finished. Created when a
+# worker starts (leases_enabled), never by the GUI / CLI / service runs.
 # ============================================================
-FACT_SCHEMA, FACT_TABLE = DB_FACT_REPORT_TABLE.split(".")
+LEASE_TABLE = "wafers_work_leases"
 
-factory_table = Table(
-    FACT_TABLE,
+lease_table = Table(
+    LEASE_TABLE,
     metadata,
-    schema=FACT_SCHEMA,
-    autoload_with=engine,
+    Column("lease_key", String(255), primary_key=True),
+    Column("owner", String(128)),
+    Column("expires_at", DateTime),
+    Column("done_sig", String(64)),
+    Column("updated_at", DateTime),
+    schema=UPLOAD_SCHEMA,
 )
 
+
+def leases_enabled():
+    return ensure_side_table(lease_table, "Worker mode unavailable")
+
+
 # ============================================================
 # Session helper
 # ============================================================
 def create_upload_session():
     """Session for upload status table (read/write)."""
+    get_engine()
     return SessionFactory()
 
 def create_factory_session():
     """Session for factory report table (read-only)."""
+    get_engine()
     return SessionFactory()
 
+# ============================================================
+# Upload Status Lookup
+# ============================================================
+def is_wafer_uploaded(session, product, lot, wafer, stage):
+    """
+    True if (product, lot, wafer, stage) already has a row in the upload table.
+    """
+    lot_prefix = lot.split(".")[0]
+    upload_table = get_upload_table()
+    where_clause = and_(
+        upload_table.c.Product == product,
+        upload_table.c.Lot_Number == lot_prefix,
+        upload_table.c.Wafer_Id == int(wafer),
+        upload_table.c.stage == stage,
+    )
+    with metrics.span("db_status_lookup"):
+        record = session.execute(
+            select(1).where(where_clause), execution_options=labelled("status_lookup")
+        ).first()
+    return record is not None
+
 # ============================================================
 # Factory Report Lookup (READ ONLY)
 # ============================================================
@@ -72,12 +292,14 @@ def get_factory_info(session, lot, wafer, product):
     """
     lot_prefix = lot.split(".")[0]
     product_wildcard = product.split("-")[0]
+    factory_table = get_factory_table()
 
-    row = session.query(factory_table).filter(
-        factory_table.c.Lot_No.like(f"{lot_prefix}%"),
-        factory_table.c.ID == wafer,
-        factory_table.c.Product.like(f"{product_wildcard}%")
-    ).one_or_none()
+    with metrics.span("db_factory_info"):
+        row = session.query(factory_table).filter(
+            factory_table.c.Lot_No.like(f"{lot_prefix}%"),
+            factory_table.c.ID == wafer,
+            factory_table.c.Product.like(f"{product_wildcard}%")
+        ).execution_options(**labelled("factory_info")).one_or_none()
 
     if row:
        machine = getattr(row, "Machine", "")
@@ -106,6 +328,7 @@ def upsert_upload(session, upload_table, product, lot, wafer, stage,
     """
     Insert or update upload status.
     Works even if created_at / updated_at columns do NOT exist.
+    Returns False (after rollback) if the DB rejected it.
     """
     lot_prefix = lot.split(".")[0]
     now = datetime.now()
@@ -137,32 +360,90 @@ def upsert_upload(session, upload_table, product, lot, wafer, stage,
     )
 
     try:
-        existing=session.execute(
-            select(1).where(where_clause)
-        ).first()
+        with metrics.span("db_upsert"):
+            existing=session.execute(
+                select(1).where(where_clause), execution_options=labelled("upsert_select")
+            ).first()
 
-        if existing:
-            session.execute(
-                update(upload_table)
-                .where(where_clause)
-                .values(**update_values)
-            )
+            if existing:
+                session.execute(
+                    update(upload_table)
+                    .where(where_clause)
+                    .values(**update_values),
+                    execution_options=labelled("upsert_update"),
+                )
 
-            print(f"[DB] Updated: Lot={lot_prefix}, Wafer={wafer}, Stage={stage}")
-        else:
-            session.execute(
-                insert(upload_table).values(**insert_values)
-            )
-            print(f"[DB] Inserted: Lot={lot_prefix}, Wafer={wafer}, Stage={stage}")
+                log.debug(f"[DB] Updated: Lot={lot_prefix}, Wafer={wafer}, Stage={stage}")
+            else:
+                session.execute(
+                    insert(upload_table).values(**insert_values), execution_options=labelled("upsert_insert")
+                )
+                log.debug(f"[DB] Inserted: Lot={lot_prefix}, Wafer={wafer}, Stage={stage}")
 
-        session.commit()
+            with metrics.span("sql_upsert_commit"):   # COMMIT is not a cursor execute
+                session.commit()
         return True
 
     except Exception as e:
         session.rollback()
-        print(
+        log.error(
             f"[DB] ERROR: UPSERT failed for Lot={lot_prefix}, "
             f"Wafer={wafer}, Stage={stage}: {e}"
         )
-        sys.exit(1)  # stop script immediately
+        return False
+
+
+# ============================================================
+# Upload Ledger lookup / record
+# ============================================================
+def load_upload_ledger(session, product):
+    """
+    Bulk-load {remote_name: sha256} of every verified upload for a product
+    (one query per product and run). None if the ledger is disabled.
+    """
+    if not ledger_enabled():
+        return None
+    try:
+        with metrics.span("db_ledger_load"):
+            rows = session.execute(
+                select(ledger_table.c.remote_name, ledger_table.c.sha256)
+                .where(ledger_table.c.Product == product),
+                execution_options=labelled("ledger_load"),
+            ).all()
+        return {name: sha for name, sha in rows}
+    except SQLAlchemyError as e:
+        session.rollback()
+        log.warning(f"[DB] Upload ledger lookup failed, uploading without it: {e}")
+        return None
 
+
+def record_upload(session, remote_name, sha256, size, product, lot, wafer, stage):
+    """Insert or update the ledger row of a verified upload. Returns False on failure."""
+    if not ledger_enabled():
+        return False
+    values = {
+        "sha256": sha256,
+        "size": size,
+        "Product": product,
+        "Lot_Number": lot.split(".")[0],
+        "Wafer_Id": int(wafer),
+        "stage": stage,
+        "uploaded_at": datetime.now(),
+    }
+    where_clause = ledger_table.c.remote_name == remote_name
+    try:
+        with metrics.span("db_ledger_record"):
+            existing = session.execute(select(1).where(where_clause), execution_options=labelled("ledger_select")).first()
+            if existing:
+                session.execute(update(ledger_table).where(where_clause).values(**values),
+                                execution_options=labelled("ledger_update"))
+            else:
+                session.execute(insert(ledger_table).values(remote_name=remote_name, **values),
+                                execution_options=labelled("ledger_insert"))
+            with metrics.span("sql_ledger_commit"):
+                session.commit()
+        return True
+    except SQLAlchemyError as e:
+        session.rollback()
+        log.warning(f"[DB] Upload ledger not updated for {remote_name}: {e}")
+        return False
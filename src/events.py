@@ -0,0 +1,152 @@
+# events.py
+import queue
+import threading
+import time
+from collections import deque
+from typing import NamedTuple
+
+# ============================================================
+# Pipeline progress events
+# main.py emits an Event at every step of a run; each subscriber (the GUI)
+# gets its own unbounded queue, so emitting never blocks a worker thread
+# and costs nothing when nobody listens. The GUI drains its queue from the
+# Tk main loop (root.after) into a ProgressTracker.
+#   run_start  products of the run (message = comma separated)
+#   total      count = units of work of a stage for one product
+#   advance    count units of a stage done (+ nbytes moved)
+#   error      a step failed (count = 1 when the wafer / ZIP gave up)
+#   run_end    message = comma separated failed products
+# ============================================================
+STAGES = ["scan", "stage", "convert", "upload", "db"]   # scan/stage count ZIPs, the rest wafers
+WAFER_STAGE = "db"                                       # a wafer is finished once its DB row is written
+
+
+class Event(NamedTuple):
+    kind: str
+    product: str = ""
+    stage: str = ""
+    count: int = 0
+    nbytes: int = 0
+    message: str = ""
+    t: float = 0.0
+
+
+_lock = threading.Lock()
+_subscribers = []
+
+
+def subscribe():
+    """New queue receiving every event from now on."""
+    q = queue.SimpleQueue()
+    with _lock:
+        _subscribers.append(q)
+    return q
+
+
+def unsubscribe(q):
+    with _lock:
+        if q in _subscribers:
+            _subscribers.remove(q)
+
+
+def emit(kind, product="", stage="", count=0, nbytes=0, message=""):
+    if not _subscribers:
+        return
+    event = Event(kind, product, stage, count, nbytes, message, time.monotonic())
+    with _lock:
+        subscribers = list(_subscribers)
+    for q in subscribers:
+        q.put(event)
+
+
+def run_start(products):
+    emit("run_start", message=", ".join(products))
+
+
+def run_end(failed):
+    emit("run_end", message=", ".join(failed))
+
+
+def total(product, stage, count):
+    emit("total", product, stage, count)
+
+
+def advance(product, stage, count=1, nbytes=0):
+    emit("advance", product, stage, count, nbytes)
+
+
+def error(product, stage, message, gave_up=False):
+    emit("error", product, stage, 1 if gave_up else 0, message=message)
+
+
+# -------------------------
+# Consumer side
+# -------------------------
+class ProgressTracker:
+    """
+    Folds events into per-stage progress (summed over the products of the
+    run), wafers/min over the last `window` seconds and an ETA.
+    Not thread-safe: feed it from one thread (the Tk main loop).
+    """
+
+    def __init__(self, window=300):
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        self.totals = {}      # (product, stage) -> units
+        self.done = {}        # (product, stage) -> units
+        self.nbytes = {}      # stage -> bytes
+        self.errors = 0
+        self.gave_up = 0      # wafers / ZIPs that will not finish this run
+        self.last = None      # Event of the latest activity
+        self.last_error = ""
+        self.started = None
+        self.finished = False
+        self._finished_at = deque()   # monotonic times of finished wafers (rate window)
+
+    def apply(self, event):
+        if event.kind == "run_start":
+            self.reset()
+            self.started = event.t
+        elif event.kind == "total":
+            self.totals[(event.product, event.stage)] = event.count
+        elif event.kind == "advance":
+            key = (event.product, event.stage)
+            self.done[key] = self.done.get(key, 0) + event.count
+            self.nbytes[event.stage] = self.nbytes.get(event.stage, 0) + event.nbytes
+            if event.stage == WAFER_STAGE:
+                self._finished_at.extend([event.t] * event.count)
+        elif event.kind == "error":
+            self.errors += 1
+            self.gave_up += event.count
+            self.last_error = f"{event.product} {event.stage}: {event.message}"
+        elif event.kind == "run_end":
+            self.finished = True
+        self.last = event
+
+    def stage(self, stage):
+        """(done, total, bytes) of a stage over all products."""
+        done = sum(n for (_, s), n in self.done.items() if s == stage)
+        total = sum(n for (_, s), n in self.totals.items() if s == stage)
+        return done, total, self.nbytes.get(stage, 0)
+
+    def wafers_per_minute(self, now=None):
+        now = time.monotonic() if now is None else now
+        while self._finished_at and now - self._finished_at[0] > self.window:
+            self._finished_at.popleft()
+        if not self._finished_at or self.started is None:
+            return 0.0
+        span = min(self.window, now - self.started)
+        return len(self._finished_at) / span * 60 if span > 0 else 0.0
+
+    def eta_seconds(self, now=None):
+        """Seconds until the wafers known so far are done; None while no rate is known."""
+        done, total, _ = self.stage(WAFER_STAGE)
+        remaining = total - done - self.gave_up
+        if remaining <= 0:
+            return 0.0
+        rate = self.wafers_per_minute(now)
+        if not rate:
+            return None
+        return remaining / rate * 60
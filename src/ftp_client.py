@@ -1,10 +1,13 @@
 # ftp_client.py
 import os
+import logging
 import time
 import pycurl
 from utils import sha256_file
-from configs import FTP_USERPWD
-import sys
+from configs import FTP_USERPWD, LEDGER_REVERIFY
+import metrics
+
+log = logging.getLogger(__name__)
 
 MAX_FTP_RETRIES = 3
 
@@ -31,36 +34,62 @@ class FTPClient:
         self.curl_download.setopt(pycurl.USERPWD, FTP_USERPWD)
         self.curl_download.setopt(pycurl.VERBOSE, 0)
 
-    def upload_and_verify(self, local_file, max_retries=MAX_FTP_RETRIES):
+    def skip_by_ledger(self, local_file, ledger, max_retries=MAX_FTP_RETRIES):
         """
-        Uploads a file, downloads it back, and verifies SHA256.
-        Returns True if successful.
+        True if the ledger already has this remote name with the same SHA256
+        (and, with LEDGER_REVERIFY, the server copy still matches).
+        """
+        if not ledger:
+            return False
+        basename = os.path.basename(local_file)
+        if ledger.get(basename) != sha256_file(local_file):
+            return False
+        if LEDGER_REVERIFY and not self.verify(local_file, max_retries):
+            return False
+        log.info(f"[FTP] Identical file already uploaded, transfer skipped: {basename}")
+        metrics.incr("ftp_ledger_skips")
+        return True
+
+    def upload(self, local_file, max_retries=MAX_FTP_RETRIES):
+        """Upload only. Returns True if the transfer completed."""
+        basename = os.path.basename(local_file)
+        remote_url = f"{self.ftp_base_url}/{basename}"
+
+        with metrics.span("ftp_upload", nbytes=os.path.getsize(local_file)):
+            uploaded = self._upload_with_retry(local_file, remote_url, max_retries)
+        if not uploaded:
+            log.error(f"[FTP] Upload failed for {basename}")
+        return uploaded
+
+    def verify(self, local_file, max_retries=MAX_FTP_RETRIES):
+        """
+        Download the remote copy back and compare SHA256 with local_file.
+        Returns True if identical (also used to check an upload from an
+        interrupted run without transferring it again).
         """
         basename = os.path.basename(local_file)
         remote_url = f"{self.ftp_base_url}/{basename}"
         temp_dir = os.path.dirname(local_file) or "."
         local_verify = os.path.join(temp_dir, f"verify_{basename}")
 
-        # Upload
-        if not self._upload_with_retry(local_file, remote_url, max_retries):
-            print(f"[FTP] Upload failed for {basename}")
-            sys.exit(1)  # stop script immediately
-            return False
-
         # Download-back for verification
-        if not self._download_with_retry(remote_url, local_verify, max_retries):
-            print(f"[FTP] Download-back failed for {basename}")
-            sys.exit(1)  # stop script immediately
+        with metrics.span("ftp_verify") as verify_span:
+            downloaded = self._download_with_retry(remote_url, local_verify, max_retries)
+            if downloaded:
+                verify_span["bytes"] = os.path.getsize(local_verify)
+        if not downloaded:
+            log.error(f"[FTP] Download-back failed for {basename}")
+            if os.path.exists(local_verify):
+                os.remove(local_verify)
             return False
 
         # Verify hash
         if sha256_file(local_file) != sha256_file(local_verify):
-            print(f"[FTP] File mismatch after upload: {basename}")
+            log.error(f"[FTP] File mismatch after upload: {basename}")
             os.remove(local_verify)
-            sys.exit(1)  # stop script immediately
             return False
 
-        print(f"[FTP] Verified OK: {basename}")
+        log.debug(f"[FTP] Verified OK: {basename}")
         os.remove(local_verify)
         return True
 
@@ -70,7 +99,7 @@ class FTPClient:
     def _upload_with_retry(self, local_file, remote_url, retries):
         for attempt in range(1, retries + 1):
             try:
-                print(f"[FTP] Upload attempt {attempt}: {os.path.basename(local_file)}")
+                log.debug(f"[FTP] Upload attempt {attempt}: {os.path.basename(local_file)}")
                 with open(local_file, "rb") as f:
                     self.curl_upload.setopt(pycurl.URL, remote_url)
                     self.curl_upload.setopt(pycurl.UPLOAD, 1)
@@ -78,7 +107,7 @@ class FTPClient:
                     self.curl_upload.perform()
                 return True
             except pycurl.error as e:
-                print(f"[FTP] Upload error (attempt {attempt}): {e}")
+                log.warning(f"[FTP] Upload error (attempt {attempt}): {e}")
                 time.sleep(2)
                 # Reset handle for retry
                 self._reset_upload_handle()
@@ -87,14 +116,14 @@ class FTPClient:
     def _download_with_retry(self, remote_url, local_file, retries):
         for attempt in range(1, retries + 1):
             try:
-                print(f"[FTP] Download attempt {attempt}: {os.path.basename(local_file)}")
+                log.debug(f"[FTP] Download attempt {attempt}: {os.path.basename(local_file)}")
                 with open(local_file, "wb") as f:
                     self.curl_download.setopt(pycurl.URL, remote_url)
                     self.curl_download.setopt(pycurl.WRITEFUNCTION, f.write)
                     self.curl_download.perform()
                 return True
             except pycurl.error as e:
-                print(f"[FTP] Download error (attempt {attempt}): {e}")
+                log.warning(f"[FTP] Download error (attempt {attempt}): {e}")
                 time.sleep(2)
                 # Reset handle for retry
                 self._reset_download_handle()
@@ -118,4 +147,4 @@ class FTPClient:
         """Cleanup curl objects"""
         self.curl_upload.close()
         self.curl_download.close()
-        print("[FTP] Curl sessions closed")
+        log.info("[FTP] Curl sessions closed")
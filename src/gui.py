@@ -1,64 +1,31 @@
 # gui.py
 import tkinter as tk
-from tkinter import messagebox
-import csv
+from tkinter import messagebox, ttk
+import multiprocessing
 import os
+import queue
 import threading
 import webbrowser
+import time
 import main
 import configs
+import events
 import sys
-from configs import PRODUCT_CSV, IS_PRODUCTION_MODE, IS_TEST_DEBUG_MODE
-from utils import EXE_DIR
-
-# -------------------------
-# Logging (console + file)
-# -------------------------
 from datetime import datetime
-
-log_filename = f"log_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
-log_path = os.path.join(EXE_DIR, log_filename)
-
-class Tee:
-    def __init__(self, *files):
-        self.files = files
-
-    def write(self, obj):
-        for f in self.files:
-            f.write(obj)
-            f.flush()
-
-    def flush(self):
-        for f in self.files:
-            f.flush()
-
-# Open log file
-log_file = open(log_path, "w", encoding="utf-8")
-
-# Redirect stdout & stderr
-sys.stdout = Tee(sys.stdout, log_file)
-sys.stderr = Tee(sys.stderr, log_file)
-
-print(f"[LOG] Logging to: {log_path}")
-
-if IS_PRODUCTION_MODE == IS_TEST_DEBUG_MODE:
-    print("Wrong Debug Mode")
-    sys.exit(1)
+from configs import PRODUCT_CSV, PRODUCT_CATALOG, PRODUCT_CONFIG, IS_PRODUCTION_MODE, IS_TEST_DEBUG_MODE, LOG_LEVEL, GUI_POLL_MS, PROGRESS_RATE_WINDOW, RUNNER
+from utils import EXE_DIR
+from log_setup import setup_logging, set_level
 
 
 # -------------------------
 # CSV Loader
 # -------------------------
 def load_products_from_csv():
-    products = []
-    try:
-        with open(PRODUCT_CSV, newline="", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                products.append(row["PRODUCT"].strip())
-    except FileNotFoundError:
+    """Products of product_config.csv, from the cached catalog (re-read only if the file changed)."""
+    PRODUCT_CATALOG.refresh()
+    if not PRODUCT_CONFIG:
         print(f"[WARN] {PRODUCT_CSV} not found. No products loaded.")
-    return sorted(set(products))
+    return sorted(PRODUCT_CONFIG)
 
 # -------------------------
 # Config Editor
@@ -69,154 +36,288 @@ def open_config():
     else:
         messagebox.showerror("Error", f"{PRODUCT_CSV} not found!")
 
-# =========================
-# GUI
-# =========================
-root = tk.Tk()
-if IS_PRODUCTION_MODE:
-    root.title(f"Wafermap_Uploader v{configs.script_ver}")
-if IS_TEST_DEBUG_MODE:
-    root.title(f"Wafermap_Uploader (TEST) v{configs.script_ver}")
-root.geometry("350x400")
-
-# Load products
-products = load_products_from_csv()
-selected_products = []
-
-# -------------------------
-# Product dropdown
-# -------------------------
-tk.Label(root, text="Select Product:").pack(anchor="w", padx=10)
-var_product = tk.StringVar(value="")
-dropdown = tk.OptionMenu(root, var_product, *products)
-dropdown.pack(fill="x", padx=10, pady=(0, 10))
-
 # -------------------------
-# Listbox to show selected products
+# Progress display helpers
 # -------------------------
-mid_frame = tk.Frame(root)
-mid_frame.pack(padx=10, pady=10, fill="both", expand=True)
+STAGE_LABELS = {"scan": "Scan ZIPs", "stage": "Copy ZIPs", "convert": "Convert", "upload": "FTP upload", "db": "DB update"}
+
+
+def format_bytes(n):
+    return f"{n / 2**20:.0f} MiB" if n >= 2**20 else f"{n / 1024:.0f} KiB"
+
+
+def format_eta(seconds):
+    if seconds is None:
+        return "--"
+    minutes, secs = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m" if hours else f"{minutes}m{secs:02d}s"
+
+
+def run_gui():
+    # -------------------------
+    # Logging (console + file)
+    # Records go through a queue to a background writer; print() and
+    # tracebacks are redirected into the same log file.
+    # -------------------------
+    log_filename = f"log_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
+    log_path = os.path.join(EXE_DIR, log_filename)
+
+    setup_logging(log_path, level=LOG_LEVEL, redirect_std=True)
+
+    print(f"[LOG] Logging to: {log_path}")
+
+    if IS_PRODUCTION_MODE == IS_TEST_DEBUG_MODE:
+        print("Wrong Debug Mode")
+        sys.exit(1)
+
+
+    # =========================
+    # GUI
+    # =========================
+    root = tk.Tk()
+    if IS_PRODUCTION_MODE:
+        root.title(f"Wafermap_Uploader v{configs.script_ver}")
+    if IS_TEST_DEBUG_MODE:
+        root.title(f"Wafermap_Uploader (TEST) v{configs.script_ver}")
+    root.geometry("350x600")
+
+    # -------------------------
+    # Options menu
+    # -------------------------
+    profile_var = tk.BooleanVar(value=False)
+    profile_memory_var = tk.BooleanVar(value=False)
+    verbose_log_var = tk.BooleanVar(value=LOG_LEVEL.upper() == "DEBUG")
+    async_runner_var = tk.BooleanVar(value=RUNNER == "async")
+
+    menubar = tk.Menu(root)
+    options_menu = tk.Menu(menubar, tearoff=0)
+    options_menu.add_checkbutton(label="Profile run (cProfile)", variable=profile_var)
+    options_menu.add_checkbutton(label="Profile memory (tracemalloc)", variable=profile_memory_var)
+    options_menu.add_separator()
+    options_menu.add_checkbutton(label="Async runner (asyncio)", variable=async_runner_var)
+    options_menu.add_checkbutton(
+        label="Verbose log (per-wafer)",
+        variable=verbose_log_var,
+        command=lambda: set_level("DEBUG" if verbose_log_var.get() else "INFO"),
+    )
+    menubar.add_cascade(label="Options", menu=options_menu)
+    root.config(menu=menubar)
+
+    # Load products
+    products = load_products_from_csv()
+    selected_products = []
+
+    # -------------------------
+    # Product dropdown
+    # -------------------------
+    tk.Label(root, text="Select Product:").pack(anchor="w", padx=10)
+    var_product = tk.StringVar(value="")
+    dropdown = tk.OptionMenu(root, var_product, *products)
+    dropdown.pack(fill="x", padx=10, pady=(0, 10))
+
+    # -------------------------
+    # Listbox to show selected products
+    # -------------------------
+    mid_frame = tk.Frame(root)
+    mid_frame.pack(padx=10, pady=10, fill="both", expand=True)
+
+    # Buttons + / -
+    btn_frame = tk.Frame(mid_frame)
+    btn_frame.pack(side=tk.LEFT, padx=(0, 8))
+
+    def add_product():
+        p = var_product.get()
+        if not p:
+            return
+        if p not in selected_products:
+            selected_products.append(p)
+            listbox.insert(tk.END, p)
+
+    def remove_selected():
+        for i in reversed(listbox.curselection()):
+            selected_products.pop(i)
+            listbox.delete(i)
+
+    tk.Button(btn_frame, text="➕", width=4, command=add_product).pack(pady=5)
+    tk.Button(btn_frame, text="➖", width=4, command=remove_selected).pack(pady=5)
+
+    # White listbox
+    listbox = tk.Listbox(mid_frame, selectmode=tk.MULTIPLE, height=8, bg="white")
+    listbox.pack(side=tk.LEFT, fill="both", expand=True)
+
+    # -------------------------
+    # Status bar
+    # -------------------------
+    status_var = tk.StringVar(value="Idle")
+    status_label = tk.Label(root, textvariable=status_var, anchor="w", fg="blue")
+    status_label.pack(fill="x", padx=10, pady=(0, 5))
+
+    # -------------------------
+    # Progress (fed by events.py, drained every GUI_POLL_MS)
+    # -------------------------
+
+
+    progress_frame = tk.Frame(root)
+    progress_frame.pack(fill="x", padx=10)
+    progress_frame.columnconfigure(1, weight=1)
+    stage_bars = {}
+    for row, stage in enumerate(events.STAGES):
+        tk.Label(progress_frame, text=STAGE_LABELS[stage], anchor="w").grid(row=row, column=0, sticky="w")
+        bar = ttk.Progressbar(progress_frame, mode="determinate", maximum=1)
+        bar.grid(row=row, column=1, sticky="ew", padx=5, pady=1)
+        count_var = tk.StringVar(value="")
+        tk.Label(progress_frame, textvariable=count_var, width=12, anchor="e").grid(row=row, column=2, sticky="e")
+        stage_bars[stage] = (bar, count_var)
+
+    rate_var = tk.StringVar(value="")
+    tk.Label(root, textvariable=rate_var, anchor="w").pack(fill="x", padx=10)
+    activity_var = tk.StringVar(value="")
+    tk.Label(root, textvariable=activity_var, anchor="w", fg="gray").pack(fill="x", padx=10)
+
+    tracker = events.ProgressTracker(window=PROGRESS_RATE_WINDOW)
+    event_queue = events.subscribe()
+
+
+    def poll_events():
+        """Apply the queued pipeline events, refresh the bars, reschedule (never waits on the worker)."""
+        drained = 0
+        while drained < 5000:
+            try:
+                tracker.apply(event_queue.get_nowait())
+            except queue.Empty:
+                break
+            drained += 1
+
+        if tracker.started is not None:
+            for stage, (bar, count_var) in stage_bars.items():
+                done, total, nbytes = tracker.stage(stage)
+                bar.config(maximum=max(total, 1), value=min(done, total))
+                text = f"{done}/{total}"
+                if nbytes and stage in ("stage", "upload"):
+                    text += f" {format_bytes(nbytes)}"
+                count_var.set(text)
+            if not tracker.finished:
+                rate_var.set(f"{tracker.wafers_per_minute():.1f} wafers/min   ETA {format_eta(tracker.eta_seconds())}")
+            last = tracker.last
+            if last is not None:
+                activity = f"Last: {last.product} {STAGE_LABELS.get(last.stage, last.kind)} " \
+                           f"{time.monotonic() - last.t:.0f}s ago"
+                if tracker.errors:
+                    activity += f" | {tracker.errors} error(s), last: {tracker.last_error}"
+                activity_var.set(activity)
+
+        root.after(GUI_POLL_MS, poll_events)
+
+    # -------------------------
+    # Run main.py in thread
+    # -------------------------
+    def start_run():
+        if not selected_products:
+            messagebox.showerror("Error", "No product selected!")
+            return
+
+        run_btn.config(state="disabled")
+        status_var.set("Running...")
+        status_label.config(fg="orange")
+
+        # Tk variables are read here, not from the worker thread
+        profile = profile_var.get()
+        profile_memory = profile_memory_var.get()
+        runner = "async" if async_runner_var.get() else "sync"
+
+        def target():
+            import pythoncom
+            try:
+                pythoncom.CoInitialize()  # init COM
+                # One call: GTK and ASE products run concurrently inside run_main
+                failed = main.run_main(list(selected_products), profile=profile, profile_memory=profile_memory,
+                                       runner=runner)
+                root.after(0, lambda failed=list(failed or []): on_run_complete(failed))
+            except Exception as e:
+                err_msg = str(e)
+                root.after(0, lambda msg=err_msg: on_run_error(msg))
+            finally:
+                pythoncom.CoUninitialize()  # cleanup
+
+        threading.Thread(target=target, daemon=True).start()
+
+    def on_run_complete(failed):
+        """failed: products run_main reports as failed or with wafers deferred by the schedule."""
+        run_btn.config(state="normal")
+        if failed:
+            status_var.set(f"Completed with failures: {', '.join(failed)}")
+            status_label.config(fg="darkorange")
+            products = "\n".join(failed)
+            messagebox.showwarning("Done", f"Run completed. Failed or with wafers left (see the log):\n{products}")
+            return
+        status_var.set("Completed")
+        status_label.config(fg="green")
+        messagebox.showinfo("Done", "Run completed.")
+
+    def on_run_error(msg):
+        run_btn.config(state="normal")
+        status_var.set("Error")
+        status_label.config(fg="red")
+        messagebox.showerror("Run Failed", msg)
+
+    # -------------------------
+    # Buttons
+    # -------------------------
+    #tk.Button(root, text="Edit Config (CSV)", command=open_config).pack(pady=5)
+
+    run_btn = tk.Button(
+        root,
+        text="RUN",
+        bg="green",
+        fg="white",
+        width=25,
+        command=start_run,
+    )
+    run_btn.pack(pady=10)
 
-# Buttons + / -
-btn_frame = tk.Frame(mid_frame)
-btn_frame.pack(side=tk.LEFT, padx=(0, 8))
+    # -------------------------
+    # About Button
+    # -------------------------
+    def show_about():
+        author = getattr(configs, "author", "Unknown")
+        version = getattr(configs, "script_ver", "N/A")
+        github_url = "https://github.com/juneth098/wafermap_uploader"
 
-def add_product():
-    p = var_product.get()
-    if not p:
-        return
-    if p not in selected_products:
-        selected_products.append(p)
-        listbox.insert(tk.END, p)
+        about_win = tk.Toplevel(root)
+        about_win.title("About wafermap_uploader")
+        about_win.resizable(False, False)
+        about_win.geometry("400x200")
 
-def remove_selected():
-    for i in reversed(listbox.curselection()):
-        selected_products.pop(i)
-        listbox.delete(i)
+        info_text = (
+            f"wafermap_uploader\n"
+            f"Version: {version}\n\n"
+            f"Copyright (c) 2026 {author}\n"
+            f"All rights reserved"
+        )
+        tk.Label(about_win, text=info_text, justify="left").pack(pady=(10,5), padx=10, anchor="w")
 
-tk.Button(btn_frame, text="➕", width=4, command=add_product).pack(pady=5)
-tk.Button(btn_frame, text="➖", width=4, command=remove_selected).pack(pady=5)
+        def open_github(event):
+            webbrowser.open_new(github_url)
 
-# White listbox
-listbox = tk.Listbox(mid_frame, selectmode=tk.MULTIPLE, height=8, bg="white")
-listbox.pack(side=tk.LEFT, fill="both", expand=True)
+        link = tk.Label(about_win, text=github_url, fg="blue", cursor="hand2")
+        link.pack(pady=(5,10), padx=10, anchor="w")
+        link.bind("<Button-1>", open_github)
 
-# -------------------------
-# Status bar
-# -------------------------
-status_var = tk.StringVar(value="Idle")
-status_label = tk.Label(root, textvariable=status_var, anchor="w", fg="blue")
-status_label.pack(fill="x", padx=10, pady=(0, 5))
+        tk.Button(about_win, text="Close", command=about_win.destroy).pack(pady=10)
 
-# -------------------------
-# Run main.py in thread
-# -------------------------
-def start_run():
-    if not selected_products:
-        messagebox.showerror("Error", "No product selected!")
-        return
-
-    run_btn.config(state="disabled")
-    status_var.set("Running...")
-    status_label.config(fg="orange")
-
-    def target():
-        import pythoncom
-        try:
-            pythoncom.CoInitialize()  # init COM
-            for product in selected_products:
-                main.run_main(product)  # <- call function directly
-            root.after(0, on_run_complete)
-        except Exception as e:
-            err_msg = str(e)
-            root.after(0, lambda msg=err_msg: on_run_error(msg))
-        finally:
-            pythoncom.CoUninitialize()  # cleanup
-
-    threading.Thread(target=target, daemon=True).start()
-
-def on_run_complete():
-    run_btn.config(state="normal")
-    status_var.set("Completed")
-    status_label.config(fg="green")
-    messagebox.showinfo("Done", "Run completed.")
-
-def on_run_error(msg):
-    run_btn.config(state="normal")
-    status_var.set("Error")
-    status_label.config(fg="red")
-    messagebox.showerror("Run Failed", msg)
 
-# -------------------------
-# Buttons
-# -------------------------
-#tk.Button(root, text="Edit Config (CSV)", command=open_config).pack(pady=5)
-
-run_btn = tk.Button(
-    root,
-    text="RUN",
-    bg="green",
-    fg="white",
-    width=25,
-    command=start_run,
-)
-run_btn.pack(pady=10)
+    about_btn = tk.Button(root, text="About", command=show_about)
+    about_btn.pack(pady=5)
 
-# -------------------------
-# About Button
-# -------------------------
-def show_about():
-    author = getattr(configs, "author", "Unknown")
-    version = getattr(configs, "script_ver", "N/A")
-    github_url = "https://github.com/juneth098/wafermap_uploader"
-
-    about_win = tk.Toplevel(root)
-    about_win.title("About wafermap_uploader")
-    about_win.resizable(False, False)
-    about_win.geometry("400x200")
-
-    info_text = (
-        f"wafermap_uploader\n"
-        f"Version: {version}\n\n"
-        f"Copyright (c) 2026 {author}\n"
-        f"All rights reserved"
-    )
-    tk.Label(about_win, text=info_text, justify="left").pack(pady=(10,5), padx=10, anchor="w")
-
-    def open_github(event):
-        webbrowser.open_new(github_url)
-
-    link = tk.Label(about_win, text=github_url, fg="blue", cursor="hand2")
-    link.pack(pady=(5,10), padx=10, anchor="w")
-    link.bind("<Button-1>", open_github)
+    # -------------------------
+    # Start GUI loop
+    # -------------------------
+    root.after(GUI_POLL_MS, poll_events)
+    root.mainloop()
 
-    tk.Button(about_win, text="Close", command=about_win.destroy).pack(pady=10)
 
-
-about_btn = tk.Button(root, text="About", command=show_about)
-about_btn.pack(pady=5)
-
-# -------------------------
-# Start GUI loop
-# -------------------------
-root.mainloop()
+if __name__ == "__main__":
+    # Frozen EXE: a conversion worker process (converter.py) starts here instead of the GUI
+    multiprocessing.freeze_support()
+    run_gui()
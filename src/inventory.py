@@ -0,0 +1,79 @@
+# inventory.py
+import logging
+import os
+import threading
+import time
+from typing import NamedTuple
+
+from utils import wait_until_stable
+import metrics
+
+log = logging.getLogger(__name__)
+
+# ============================================================
+# NAS inventory
+# One os.scandir pass per NAS MAP directory per run (name, size, mtime;
+# scandir returns them with the listing on Windows, no extra SMB round
+# trip per file). Scan, staging and the second scan read the snapshot;
+# only the stability check before a copy goes back to the share, and it
+# updates the snapshot with what it saw.
+# ============================================================
+
+
+class NasEntry(NamedTuple):
+    size: int
+    mtime_ns: int
+    seen: float     # time.monotonic() of the observation
+
+
+def scan_zips(nas_dir):
+    """{zip name: NasEntry} for the ZIP files in nas_dir, from one os.scandir pass."""
+    entries = {}
+    seen = time.monotonic()
+    with os.scandir(nas_dir) as it:
+        for entry in it:
+            if not entry.name.lower().endswith(".zip") or not entry.is_file():
+                continue
+            st = entry.stat()
+            entries[entry.name] = NasEntry(st.st_size, st.st_mtime_ns, seen)
+    return entries
+
+
+class NasInventory:
+    """Per-run cache of NAS directory snapshots, shared by the subcon threads."""
+
+    def __init__(self):
+        self._dirs = {}     # nas_dir -> {zip name: NasEntry}
+        self._lock = threading.Lock()
+
+    def entries(self, nas_dir, refresh=False):
+        with self._lock:
+            snapshot = self._dirs.get(nas_dir)
+        if snapshot is None or refresh:
+            with metrics.span("nas_list"):
+                snapshot = scan_zips(nas_dir)
+            with self._lock:
+                self._dirs[nas_dir] = snapshot
+        return snapshot
+
+    def zip_names(self, nas_dir, refresh=False):
+        return sorted(self.entries(nas_dir, refresh))
+
+    def get(self, nas_dir, zip_file):
+        return self.entries(nas_dir).get(zip_file)
+
+    def wait_stable(self, nas_dir, zip_file, checks=3, delay=1):
+        """
+        Freshness check before a copy: the snapshot counts as the first
+        sample, so a ZIP unchanged since the listing needs one os.stat.
+        Returns the fresh os.stat_result, or None if missing / still changing.
+        """
+        entry = self.get(nas_dir, zip_file)
+        if entry is None:
+            return None
+        st = wait_until_stable(os.path.join(nas_dir, zip_file), checks, delay, last=entry)
+        with self._lock:
+            snapshot = self._dirs[nas_dir]
+            if st is not None:
+                snapshot[zip_file] = NasEntry(st.st_size, st.st_mtime_ns, time.monotonic())
+        return st
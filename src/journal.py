@@ -0,0 +1,97 @@
+# journal.py
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+
+log = logging.getLogger(__name__)
+
+# -------------------------
+# Run journal (append-only JSON lines next to the run log)
+#   {"ts": ..., "run": ..., "step": "convert"|"upload"|"verify"|"db",
+#    "key": "<product>|<lot>|<wafer>|<stage>", ...}
+# A restarted run skips the steps already recorded for a wafer:
+#   verify done -> only the DB row is missing (repair without re-transfer)
+#   upload done -> download-back check first, re-upload only if it fails
+#   convert done and the .umc is still on disk -> no extract / convert
+# Wafers whose "db" step is done are dropped when the journal is compacted.
+# -------------------------
+JOURNAL_FILENAME = "run_journal.jsonl"
+WAFER_STEPS = ("convert", "upload", "verify", "db")
+SYNC_STEPS = {"upload", "verify", "db"}   # side effects on FTP / DB: fsync before moving on
+
+
+def wafer_key(product, lot, wafer, stage):
+    return f"{product}|{lot.split('.')[0]}|{int(wafer)}|{stage}"
+
+
+class RunJournal:
+    def __init__(self, path, run_id=""):
+        self.path = path
+        self.run_id = run_id
+        self._lock = threading.Lock()
+        self.wafers = {}   # key -> {step: record}
+        self._load()
+        self._compact()
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    # -------------------------
+    # Load / compact
+    # -------------------------
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        skipped = 0
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    skipped += 1   # torn last line after a crash
+                    continue
+                if rec.get("key"):   # "copy" records of older versions are dropped
+                    self.wafers.setdefault(rec["key"], {})[rec["step"]] = rec
+        if skipped:
+            log.warning(f"[JOURNAL] Ignored {skipped} unreadable line(s) in {self.path}")
+
+    def _compact(self):
+        """Rewrite the journal with unfinished wafers only (atomic replace)."""
+        self.wafers = {k: steps for k, steps in self.wafers.items() if "db" not in steps}
+
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for steps in self.wafers.values():
+                for step in WAFER_STEPS:
+                    if step in steps:
+                        f.write(json.dumps(steps[step]) + "\n")
+        os.replace(tmp_path, self.path)
+        if self.wafers:
+            log.info(f"[JOURNAL] {len(self.wafers)} unfinished wafer(s) from earlier runs")
+
+    # -------------------------
+    # Append
+    # -------------------------
+    def _append(self, rec, sync=False):
+        rec = {"ts": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "run": self.run_id, **rec}
+        with self._lock:
+            self._file.write(json.dumps(rec) + "\n")
+            self._file.flush()
+            if sync:
+                os.fsync(self._file.fileno())
+        return rec
+
+    def record(self, key, step, **info):
+        rec = self._append({"step": step, "key": key, **info}, sync=step in SYNC_STEPS)
+        with self._lock:
+            self.wafers.setdefault(key, {})[step] = rec
+
+    # -------------------------
+    # Lookup
+    # -------------------------
+    def get(self, key, step):
+        return self.wafers.get(key, {}).get(step)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
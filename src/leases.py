@@ -0,0 +1,290 @@
+# leases.py
+import hashlib
+import logging
+import socket
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import insert, update, select, or_
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+from configs import CONVERT_WORKERS, LEASE_SECONDS, LEASE_BATCH, LEASE_DB_RETRIES, LEASE_RETRY_WAIT
+from converter import ConversionPool
+from db import create_upload_session, lease_table, leases_enabled, LEASE_TABLE
+from retry import backoff_delay
+from scanner import extract_lot_from_zip, extract_stage_from_zip
+from service import snapshot_dir, products_by_nas_dir
+
+log = logging.getLogger(__name__)
+
+# ============================================================
+# Work leases (worker mode: python main.py --worker)
+# Several instances split the NAS backlog by leasing (lot, stage) groups
+# in db.lease_table, next to the upload table. A lease covers every
+# delivery ZIP of that lot/stage, so the newest-delivery dedupe still
+# sees them all.
+#   owner / expires_at : held until expiry; a crashed worker's lease is
+#                        taken over once it expires
+#   done_sig           : set on a clean release, a group is not claimed
+#                        again until its ZIPs (name/size/mtime) change
+# Expiry uses the workers' UTC clocks (keep hosts NTP-synced).
+# ============================================================
+
+
+class LeaseDbError(Exception):
+    """The lease table could not be read / written (DB locked, deadlock, lost connection)."""
+
+
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def lease_groups(snapshot):
+    """{zip name: (size, mtime)} -> {"<lot>|<stage>": {zip name: (size, mtime)}}"""
+    groups = {}
+    for name, sig in snapshot.items():
+        key = f"{extract_lot_from_zip(name)}|{extract_stage_from_zip(name)}"
+        groups.setdefault(key, {})[name] = sig
+    return groups
+
+
+def group_signature(zips):
+    """Short hash of the ZIP names/sizes/mtimes in a lease group."""
+    h = hashlib.sha1()
+    for name in sorted(zips):
+        size, mtime = zips[name]
+        h.update(f"{name}:{size}:{mtime};".encode())
+    return h.hexdigest()
+
+
+class LeaseManager:
+    """
+    Claims, renews and releases leases for one worker. A heartbeat thread
+    renews everything held every LEASE_SECONDS / 3.
+    """
+
+    def __init__(self, worker_id, lease_seconds=LEASE_SECONDS):
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.held = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._heartbeat = threading.Thread(target=self._renew_loop, name="lease-heartbeat", daemon=True)
+
+    def start(self):
+        self._heartbeat.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._heartbeat.is_alive():
+            self._heartbeat.join(timeout=5)
+        for key in list(self.held):
+            self.release(key)
+
+    # -------------------------
+    # Claim / release
+    # -------------------------
+    def claim(self, key, sig):
+        """
+        Atomically take a free, expired or changed lease. True if this worker
+        now holds it, False if another worker holds it or it is finished.
+        DB errors are retried LEASE_DB_RETRIES times, then raise LeaseDbError.
+        """
+        for attempt in range(1, LEASE_DB_RETRIES + 1):
+            try:
+                claimed = self._claim_once(key, sig)
+                break
+            except SQLAlchemyError as e:
+                if attempt == LEASE_DB_RETRIES:
+                    raise LeaseDbError(f"claim of {key} failed {attempt} times: {e}") from e
+                delay = backoff_delay(attempt, base=1, cap=10)
+                log.warning(f"[LEASE] Claim of {key} failed ({e}), retry in {delay:.1f}s")
+                time.sleep(delay)
+
+        if claimed:
+            with self._lock:
+                self.held.add(key)
+        return claimed
+
+    def _claim_once(self, key, sig):
+        now = utcnow()
+        expires = now + timedelta(seconds=self.lease_seconds)
+        session = create_upload_session()
+        try:
+            try:
+                session.execute(insert(lease_table).values(
+                    lease_key=key, owner=self.worker_id, expires_at=expires, updated_at=now))
+                session.commit()
+                return True
+            except IntegrityError:
+                session.rollback()   # the row exists: take it only if free, expired or changed
+            previous = session.execute(
+                select(lease_table.c.owner, lease_table.c.expires_at)
+                .where(lease_table.c.lease_key == key)
+            ).first()
+            result = session.execute(
+                update(lease_table)
+                .where(
+                    lease_table.c.lease_key == key,
+                    or_(lease_table.c.owner.is_(None),
+                        lease_table.c.owner == self.worker_id,
+                        lease_table.c.expires_at < now),
+                    or_(lease_table.c.done_sig.is_(None), lease_table.c.done_sig != sig),
+                )
+                .values(owner=self.worker_id, expires_at=expires, done_sig=None, updated_at=now)
+            )
+            session.commit()
+            claimed = result.rowcount == 1
+            if claimed and previous and previous.owner not in (None, self.worker_id):
+                log.warning(f"[LEASE] Took over expired lease {key} from {previous.owner}")
+            return claimed
+        except SQLAlchemyError:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def release(self, key, done_sig=None):
+        """Give a lease back; done_sig marks the group finished for this delivery state."""
+        session = create_upload_session()
+        try:
+            session.execute(
+                update(lease_table)
+                .where(lease_table.c.lease_key == key, lease_table.c.owner == self.worker_id)
+                .values(owner=None, expires_at=None, done_sig=done_sig, updated_at=utcnow())
+            )
+            session.commit()
+        except SQLAlchemyError as e:
+            session.rollback()
+            log.warning(f"[LEASE] Release of {key} failed (expires on its own): {e}")
+        finally:
+            session.close()
+            with self._lock:
+                self.held.discard(key)
+
+    def _renew_loop(self):
+        while not self._stop.wait(self.lease_seconds / 3):
+            with self._lock:
+                keys = list(self.held)
+            if not keys:
+                continue
+            session = create_upload_session()
+            try:
+                session.execute(
+                    update(lease_table)
+                    .where(lease_table.c.lease_key.in_(keys), lease_table.c.owner == self.worker_id)
+                    .values(expires_at=utcnow() + timedelta(seconds=self.lease_seconds))
+                )
+                session.commit()
+            except SQLAlchemyError as e:
+                session.rollback()
+                log.warning(f"[LEASE] Heartbeat failed: {e}")
+            finally:
+                session.close()
+
+
+# ============================================================
+# Worker loop
+# ============================================================
+def default_worker_id():
+    return socket.gethostname()
+
+
+def run_worker(products, run_main, worker_id=None, batch=LEASE_BATCH, lease_seconds=LEASE_SECONDS):
+    """
+    Lease up to `batch` lot/stage groups at a time, run them (scan only the
+    leased ZIPs), release, and repeat until nothing is left to claim.
+    A group that fails is not claimed again by this worker until its ZIPs
+    change, so the worker exits once only failed groups are left. If the
+    lease table cannot be reached, the pass is retried after LEASE_RETRY_WAIT.
+    run_main: main.run_main (passed in, main.py is usually __main__)
+    Returns the number of lease groups this worker processed.
+    """
+    if not leases_enabled():
+        raise RuntimeError(f"Worker mode needs the {LEASE_TABLE} table (see log)")
+    worker_id = worker_id or default_worker_id()
+    groups = products_by_nas_dir(products)
+    leases = LeaseManager(worker_id, lease_seconds)
+    ftp_clients = {}   # one FTPClient per subcon for the whole session (filled by run_main)
+    converter = ConversionPool() if CONVERT_WORKERS > 1 else None
+    journal_name = f"run_journal_{worker_id}.jsonl"
+    failed_groups = {}     # lease key -> signature that failed this session
+    processed = 0
+    log.info(f"[WORKER] {worker_id} started for: {', '.join(products)}")
+
+    def run_batch(dir_products, zips, notify=True):
+        """True if run_main reported no failed product for these ZIPs."""
+        try:
+            failed = run_main(dir_products, ftp_clients=ftp_clients, zip_filters={p: zips for p in dir_products},
+                              journal_name=journal_name, notify=notify, converter=converter)
+        except Exception as e:
+            log.exception(f"[WORKER] Batch failed: {e!r}")
+            return False
+        return not set(failed).intersection(dir_products)
+
+    leases.start()
+    try:
+        while True:
+            claimed_any = db_down = False
+            for nas_dir, dir_products in groups.items():
+                work = lease_groups(snapshot_dir(nas_dir))
+                claimed = {}
+                for key in sorted(work):
+                    sig = group_signature(work[key])
+                    if failed_groups.get(key) == sig:
+                        continue   # failed earlier this session and unchanged since
+                    try:
+                        got = leases.claim(key, sig)
+                    except LeaseDbError as e:
+                        log.warning(f"[WORKER] Lease table unavailable ({e}), retrying the pass in {LEASE_RETRY_WAIT}s")
+                        db_down = True
+                        break
+                    if got:
+                        claimed[key] = sig
+                        if len(claimed) >= batch:
+                            break
+                if not claimed:
+                    if db_down:
+                        break
+                    continue
+
+                claimed_any = True
+                zips = {name for key in claimed for name in work[key]}
+                log.info(f"[WORKER] {worker_id} leased {len(claimed)} lot(s), {len(zips)} ZIP(s) in {nas_dir}")
+                if run_batch(dir_products, zips):
+                    done = set(claimed)
+                elif len(claimed) == 1:
+                    done = set()
+                else:
+                    # failures are reported per product: run each group alone to find the bad ones
+                    # (wafers the batch already uploaded are skipped by the status lookup;
+                    # the batch run already mailed its digest, the re-runs do not)
+                    log.warning(f"[WORKER] Batch had failures, re-running its {len(claimed)} lot(s) one by one")
+                    done = {key for key in claimed if run_batch(dir_products, set(work[key]), notify=False)}
+                for key, sig in claimed.items():
+                    if key in done:
+                        leases.release(key, done_sig=sig)
+                    else:
+                        failed_groups[key] = sig
+                        log.warning(f"[WORKER] {key} failed, not claimed again this session")
+                        leases.release(key)
+                processed += len(claimed)
+                if db_down:
+                    break
+            if db_down:
+                time.sleep(LEASE_RETRY_WAIT)
+            elif not claimed_any:
+                break
+    except KeyboardInterrupt:
+        log.info("[WORKER] Stopped by user")
+    finally:
+        leases.stop()
+        for ftp in ftp_clients.values():
+            ftp.close()
+        if converter is not None:
+            converter.close()
+    if failed_groups:
+        log.warning(f"[WORKER] {len(failed_groups)} lease group(s) failed: {', '.join(sorted(failed_groups))}")
+    log.info(f"[WORKER] {worker_id} finished, {processed} lease group(s) processed")
+    return processed
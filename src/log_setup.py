@@ -0,0 +1,200 @@
+# log_setup.py
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+
+# -------------------------
+# Logging pipeline
+#   logger -> QueueHandler -> queue -> BackgroundLogWriter thread -> console / log file
+# Callers never wait on disk or console I/O; the writer flushes every
+# FLUSH_INTERVAL seconds, every FLUSH_BYTES bytes, or at once for errors.
+# -------------------------
+FILE_FORMAT = "%(asctime)s %(levelname)-7s %(threadName)s %(message)s"
+CONSOLE_FORMAT = "%(tag)s%(message)s"   # tag: "[GTK] " etc. while subcon groups run concurrently
+FLUSH_INTERVAL = 1.0        # seconds
+FLUSH_BYTES = 64 * 1024
+
+_STOP = object()
+_writer = None
+_thread_tag = threading.local()
+
+
+def set_thread_tag(tag):
+    """Prefix console lines logged from the current thread with "[tag] " (None to clear)."""
+    _thread_tag.value = f"[{tag}] " if tag else ""
+
+
+def get_thread_tag():
+    """Tag of the current thread (None if untagged), to hand on to helper threads."""
+    value = getattr(_thread_tag, "value", "")
+    return value[1:-2] if value else None
+
+
+class ThreadTagFilter(logging.Filter):
+    """Runs in the thread that logs (before the queue) and stamps record.tag."""
+
+    def filter(self, record):
+        record.tag = getattr(_thread_tag, "value", "")
+        return True
+
+
+class BufferedStreamHandler(logging.StreamHandler):
+    """
+    StreamHandler that flushes on a size threshold (or for ERROR and above)
+    instead of after every record. Time-based flushes come from the writer.
+    """
+
+    def __init__(self, stream, flush_bytes=FLUSH_BYTES):
+        super().__init__(stream)
+        self.flush_bytes = flush_bytes
+        self.pending = 0
+
+    def emit(self, record):
+        try:
+            msg = self.format(record) + self.terminator
+            self.stream.write(msg)
+            self.pending += len(msg)
+            if self.pending >= self.flush_bytes or record.levelno >= logging.ERROR:
+                self.flush()
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        super().flush()
+        self.pending = 0
+
+
+class BackgroundLogWriter(threading.Thread):
+    """Drains the log queue into the handlers and flushes them on an interval."""
+
+    def __init__(self, log_queue, handlers, flush_interval=FLUSH_INTERVAL):
+        super().__init__(name="log-writer", daemon=True)
+        self.log_queue = log_queue
+        self.handlers = handlers
+        self.flush_interval = flush_interval
+
+    def run(self):
+        last_flush = time.monotonic()
+        while True:
+            try:
+                record = self.log_queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                record = None
+            if record is _STOP:
+                break
+            if record is not None:
+                for handler in self.handlers:
+                    if record.levelno >= handler.level:
+                        handler.handle(record)
+            if time.monotonic() - last_flush >= self.flush_interval:
+                self.flush()
+                last_flush = time.monotonic()
+        self.flush()
+
+    def flush(self):
+        for handler in self.handlers:
+            handler.flush()
+
+    def stop(self):
+        self.log_queue.put(_STOP)
+        self.join(timeout=5)
+        for handler in self.handlers:
+            handler.close()
+
+
+class StreamToLogger:
+    """
+    File-like object for sys.stdout / sys.stderr: each complete line that is
+    printed becomes one log record (partial lines are kept per thread).
+    """
+
+    def __init__(self, logger, level):
+        self.logger = logger
+        self.level = level
+        self._local = threading.local()
+
+    def write(self, text):
+        buf = getattr(self._local, "buf", "") + text
+        *lines, buf = buf.split("\n")
+        self._local.buf = buf
+        for line in lines:
+            if line.strip():
+                self.logger.log(self.level, line.rstrip())
+        return len(text)
+
+    def flush(self):
+        buf = getattr(self._local, "buf", "")
+        if buf.strip():
+            self.logger.log(self.level, buf.rstrip())
+        self._local.buf = ""
+
+    def isatty(self):
+        return False
+
+
+def setup_logging(log_path=None, level="INFO", console=True, redirect_std=False):
+    """
+    Configure the root logger once per process.
+    log_path     : log file (None = console only)
+    level        : "DEBUG" shows per-wafer chatter, "INFO" is the production default
+    redirect_std : route print() / tracebacks into the same pipeline
+    """
+    global _writer
+    if _writer is not None:
+        set_level(level)
+        return _writer
+
+    handlers = []
+    console_stream = sys.__stdout__
+    if console and console_stream is not None:
+        console_handler = BufferedStreamHandler(console_stream)
+        console_handler.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+        handlers.append(console_handler)
+    if log_path:
+        log_file = open(log_path, "w", encoding="utf-8", buffering=FLUSH_BYTES)
+        file_handler = BufferedStreamHandler(log_file)
+        file_handler.setFormatter(logging.Formatter(FILE_FORMAT))
+        handlers.append(file_handler)
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(ThreadTagFilter())
+    root.addHandler(queue_handler)
+    set_level(level)
+
+    _writer = BackgroundLogWriter(log_queue, handlers)
+    _writer.start()
+    atexit.register(shutdown_logging)
+
+    if redirect_std:
+        sys.stdout = StreamToLogger(logging.getLogger("stdout"), logging.INFO)
+        sys.stderr = StreamToLogger(logging.getLogger("stderr"), logging.ERROR)
+
+    return _writer
+
+
+def set_level(level):
+    """Change verbosity at runtime, e.g. "DEBUG" for per-wafer detail."""
+    logging.getLogger().setLevel(level.upper() if isinstance(level, str) else level)
+
+
+def shutdown_logging():
+    """Flush and close the log file (also registered with atexit)."""
+    global _writer
+    if _writer is None:
+        return
+    if isinstance(sys.stdout, StreamToLogger):
+        sys.stdout.flush()
+        sys.stdout = sys.__stdout__
+    if isinstance(sys.stderr, StreamToLogger):
+        sys.stderr.flush()
+        sys.stderr = sys.__stderr__
+    _writer.stop()
+    _writer = None
@@ -0,0 +1,95 @@
+# lot_index.py
+import json
+import logging
+import os
+import threading
+from datetime import date, timedelta
+
+from configs import LOT_PREFILTER_RECHECK_DAYS
+from scanner import extract_lot_from_zip
+
+log = logging.getLogger(__name__)
+
+# -------------------------
+# Lot -> product index (JSON next to the run log)
+#   {"GTK|DKJR5": {"product": "FT233H-B", "seen": "2026-10-19"}, ...}
+# A lot's device never changes, so once a scan has opened one of its ZIPs
+# the product is remembered and later scans of other products skip the
+# lot's ZIPs without opening them. Entries are refreshed whenever a scan
+# reads the lot again; one not confirmed for LOT_PREFILTER_RECHECK_DAYS is
+# ignored (the ZIP is opened again), and a member that names a different
+# product replaces the entry.
+# -------------------------
+LOT_INDEX_FILENAME = "lot_products.json"
+
+
+def lot_key(subcon, lot):
+    return f"{subcon}|{lot.split('.')[0]}"
+
+
+class LotIndex:
+    """Shared by the subcon threads of a run; saved once at the end of the run."""
+
+    def __init__(self, path, recheck_days=LOT_PREFILTER_RECHECK_DAYS):
+        self.path = path
+        self.recheck_days = recheck_days
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.lots = {}      # lot_key -> {"product": ..., "seen": "YYYY-MM-DD"}
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.lots = json.load(f)
+        except (OSError, ValueError) as e:
+            log.warning(f"[PREFILTER] Ignoring unreadable {self.path}: {e}")
+            self.lots = {}
+
+    # -------------------------
+    # Lookup
+    # -------------------------
+    def product(self, subcon, lot):
+        """Known product of the lot, None if unknown or not confirmed recently."""
+        entry = self.lots.get(lot_key(subcon, lot))
+        if not entry:
+            return None
+        cutoff = (date.today() - timedelta(days=self.recheck_days)).isoformat()
+        if entry.get("seen", "") < cutoff:
+            return None
+        return entry.get("product")
+
+    def other_product(self, subcon, zip_file, product):
+        """Product the ZIP's lot belongs to if it is not `product` (the ZIP can be skipped), else None."""
+        known = self.product(subcon, extract_lot_from_zip(zip_file))
+        return known if known and known != product else None
+
+    # -------------------------
+    # Learn
+    # -------------------------
+    def learn(self, subcon, lot, product):
+        """Record the product a scanned member of the lot belongs to."""
+        key = lot_key(subcon, lot)
+        today = date.today().isoformat()
+        with self._lock:
+            entry = self.lots.get(key)
+            if entry and entry.get("product") == product and entry.get("seen") == today:
+                return
+            if entry and entry.get("product") != product:
+                log.warning(f"[PREFILTER] Lot {key} was mapped to {entry.get('product')}, "
+                            f"a member says {product}; remapped")
+            self.lots[key] = {"product": product, "seen": today}
+            self._dirty = True
+
+    def save(self):
+        """Atomic replace; other instances writing the same file only lose learned entries."""
+        with self._lock:
+            if not self._dirty:
+                return
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.lots, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
@@ -1,29 +1,31 @@
 # mailer.py
-import win32com.client
-import os
+import logging
 from datetime import datetime
-import sys
-from configs import script_ver, IS_TEST_DEBUG_MODE, IS_PRODUCTION_MODE
-
-def send_completion_mail(
-    product,
-    lots,
-    total_wafers,
-    uploaded_wafers,
-    db_update_count,
-    ftp_dir,
-    recipient_list=[],
-    cc_list=[],
-    attachments=[],
-    error=0,
-    has_attach=False,
-):
-
-    #default recipient list
+from html import escape
+from configs import script_ver, FTP_BASE_URL, IS_PRODUCTION_MODE
+from notifier import Mail
+
+log = logging.getLogger(__name__)
+
+STATUS_OK = "Completed"
+STATUS_FAIL = "FAIL"
+STATUS_NOTHING = "Nothing to upload"
+
+
+def product_status(result):
+    if result["errors"] != 0 or result["uploaded_wafers"] != result["db_update_count"]:
+        return STATUS_FAIL
+    if result["total_wafers"] == 0 or result["uploaded_wafers"] == 0:
+        return STATUS_NOTHING
+    return STATUS_OK
+
+
+def recipients(ok):
+    """(to, cc): the full list for a clean production run with wafers, otherwise the maintainer only."""
     recipient_list = []
     cc_list = []
 
-    if IS_PRODUCTION_MODE and error == 0 and total_wafers != 0: # no error and wafer to upload is not 0
+    if IS_PRODUCTION_MODE and ok: # no error and wafer to upload is not 0
         recipient_list.append("roger_tuan@umc.com")  # For test environment
         recipient_list.append("julia_lee@umc.com")  # replace with actual recipients
         cc_list.append("derrick.lau@ftdichip.com")
@@ -34,107 +36,91 @@ def send_completion_mail(
     else: #if has error and blank wafer
         # For test environment
         recipient_list.append("juneth.viktor@ftdichip.com")
-    #remove duplicates
-    unique_lot = list(dict.fromkeys(lots))
+    return recipient_list, cc_list
+
 
+def build_digest_mails(digest, failed_products=(), failed_wafers=()):
     """
-    Send completion notification via Outlook
+    The run's digest mails. Products that uploaded cleanly go to the full
+    recipient list; the others (failed, not finished, nothing uploaded) go
+    to the maintainer, with the wafers that gave up (ErrorBudget.failed_wafers).
+    A run with only one kind sends one mail.
     """
-
-    outlook = win32com.client.Dispatch("Outlook.Application")
-    mail = outlook.CreateItem(0)  # MailItem
-
-
-    if error == 0:
-        mail.Subject = f"UMC Wafermap Upload Completed | {product}"
-        mail.HTMLBody = f"""
-        <html>
-        <body style="font-family:Calibri; font-size:11pt;">
-        <h3>UMC Wafermap processing completed successfully</h3>
-    
-        <table cellpadding="4">
-        <tr><td><b>Product</b></td><td>:</td><td>{product}</td></tr>
-        <tr><td><b>Lot ID</b></td><td>:</td><td>{", ".join(unique_lot)}</td></tr>
-        <tr><td><b>Total wafers</b></td><td>:</td><td>{total_wafers}</td></tr>
-        <tr><td><b>FTP: Uploaded Map</b></td><td>:</td><td>{uploaded_wafers}</td></tr>
-        <tr><td><b>DB: Updated Rows</b></td><td>:</td><td>{db_update_count}</td></tr>
-        <tr><td><b>FTP Directory</b></td><td>:</td><td>{ftp_dir}</td></tr>
-        <tr><td><b>Upload Agent</b></td><td>:</td><td>wmu_v{script_ver}</td></tr>
-        <tr><td><b>Timestamp</b></td><td>:</td><td>{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</td></tr>
-        </table>
-    
-        <p>This is an automated message.</p>
-        </body>
-        </html>
-        """
-
-    if error !=0 or uploaded_wafers !=db_update_count: #error found
-        mail.Subject = f"UMC Wafermap Upload FAIL | {product}"
-        mail.HTMLBody = f"""
+    failed = set(failed_products)
+    reported = {r["product"] for r in digest.results}
+    failed_products = [p for p in failed_products if p not in reported]
+    clean = [r for r in digest.results if product_status(r) == STATUS_OK and r["product"] not in failed]
+    rest = [r for r in digest.results if r not in clean]
+    mails = []
+    if clean:
+        mails.append(digest_mail(digest.run_id, clean))
+    if rest or failed_products or failed_wafers or not clean:
+        mails.append(digest_mail(digest.run_id, rest, failed_products, failed_wafers))
+    return mails
+
+
+def digest_mail(run_id, results, failed_products=(), failed_wafers=()):
+    """One mail: a row per product result, plus the products that did not finish and the wafers that gave up."""
+    statuses = [product_status(r) for r in results]
+    has_error = STATUS_FAIL in statuses or failed_products or failed_wafers
+    products = ", ".join([r["product"] for r in results] + list(failed_products))
+
+    if has_error:
+        subject = f"UMC Wafermap Upload FAIL | {products}"
+        heading = "<h3 style=\"color:red;\">UMC Wafermap encountered error/s</h3>"
+    elif STATUS_OK in statuses:
+        subject = f"UMC Wafermap Upload Completed | {products}"
+        heading = "<h3>UMC Wafermap processing completed successfully</h3>"
+    else:
+        subject = f"UMC Wafermap: Nothing to upload | {products}"
+        heading = "<h3 style=\"color:gray;\">Nothing to upload</h3>"
+
+    rows = []
+    for result, status in zip(results, statuses):
+        color = {STATUS_FAIL: "red", STATUS_NOTHING: "gray"}.get(status, "black")
+        rows.append(
+            f"<tr><td>{escape(result['product'])}</td>"
+            f"<td style=\"color:{color};\">{status}</td>"
+            f"<td>{escape(', '.join(result['lots']))}</td>"
+            f"<td>{result['total_wafers']}</td><td>{result['uploaded_wafers']}</td>"
+            f"<td>{result['db_update_count']}</td><td>{result['errors']}</td></tr>"
+        )
+    for product in failed_products:
+        rows.append(f"<tr><td>{escape(product)}</td><td style=\"color:red;\">Not finished</td>"
+                    f"<td></td><td></td><td></td><td></td><td></td></tr>")
+
+    failed_html = ""
+    if failed_wafers:
+        items = "".join(
+            f"<li>{escape(f['product'])} | {escape(f['wafer'])} | {escape(f['step'])} after "
+            f"{f['attempts']} attempt(s): {escape(f['error'])}</li>"
+            for f in failed_wafers
+        )
+        failed_html = f"<p><b>{len(failed_wafers)} wafer(s) not uploaded this run:</b></p><ul>{items}</ul>"
+
+    html = f"""
         <html>
         <body style="font-family:Calibri; font-size:11pt;">
-         <h3 style="color:red;">UMC Wafermap encountered {error} error/s</h3>
+        {heading}
 
-        <table cellpadding="4">
-        <tr><td><b>Product</b></td><td>:</td><td>{product}</td></tr>
-        <tr><td><b>Lot ID</b></td><td>:</td><td>{", ".join(unique_lot)}</td></tr>
-        <tr><td><b>Total wafers</b></td><td>:</td><td>{total_wafers}</td></tr>
-        <tr><td><b>FTP: Uploaded Map</b></td><td>:</td><td>{uploaded_wafers}</td></tr>
-        <tr><td><b>DB: Updated Rows</b></td><td>:</td><td>{db_update_count}</td></tr>
-        <tr><td><b>FTP Directory</b></td><td>:</td><td>{ftp_dir}</td></tr>
-        <tr><td><b>Upload Agent</b></td><td>:</td><td>wmu_v{script_ver}</td></tr>
-        <tr><td><b>Timestamp</b></td><td>:</td><td>{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</td></tr>
+        <table cellpadding="4" border="1" style="border-collapse:collapse;">
+        <tr><th>Product</th><th>Status</th><th>Lot ID</th><th>Total wafers</th><th>FTP: Uploaded Map</th>
+            <th>DB: Updated Rows</th><th>Errors</th></tr>
+        {"".join(rows)}
         </table>
-        <p>Might be problem in FTP or DB upload.</p>
-        <p>This is an automated message.</p>
-        </body>
-        </html>
-        """
-
-    if total_wafers ==0 or uploaded_wafers==0: #0 wafers
-        mail.Subject = f"UMC Wafermap: Nothing to upload | {product}"
-        mail.HTMLBody = f"""
-        <html>
-        <body style="font-family:Calibri; font-size:11pt;">
-         <h3 style="color:gray;">Nothing to upload</h3>
-
+        {failed_html}
         <table cellpadding="4">
-        <tr><td><b>Product</b></td><td>:</td><td>{product}</td></tr>
-        <tr><td><b>Lot ID</b></td><td>:</td><td>{", ".join(unique_lot)}</td></tr>
-        <tr><td><b>Total wafers</b></td><td>:</td><td>{total_wafers}</td></tr>
-        <tr><td><b>FTP: Uploaded Map</b></td><td>:</td><td>{uploaded_wafers}</td></tr>
-        <tr><td><b>DB: Updated Rows</b></td><td>:</td><td>{db_update_count}</td></tr>
-        <tr><td><b>FTP Directory</b></td><td>:</td><td>{ftp_dir}</td></tr>
+        <tr><td><b>FTP Directory</b></td><td>:</td><td>{FTP_BASE_URL}</td></tr>
         <tr><td><b>Upload Agent</b></td><td>:</td><td>wmu_v{script_ver}</td></tr>
+        <tr><td><b>Run</b></td><td>:</td><td>{run_id}</td></tr>
         <tr><td><b>Timestamp</b></td><td>:</td><td>{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</td></tr>
         </table>
-        <p>No wafer found or all maps are already uploaded.</p>
+        {"<p>Might be problem in FTP or DB upload.</p>" if has_error else ""}
         <p>This is an automated message.</p>
         </body>
         </html>
         """
 
-    mail.To = ";".join(recipient_list)
-
-    if cc_list:
-        mail.CC = ";".join(cc_list)
-
-    if attachments and has_attach:
-        # Ensure attachments is always a list
-        if isinstance(attachments, str):
-            attachments = [attachments]
-
-        for file in attachments:
-            if file:
-                if os.path.exists(file):
-                    print(f"[MAIL] Attaching file: {file}")
-                    mail.Attachments.Add(file)
-                else:
-                    print(f"[MAIL] WARNING: Attachment not found or missing: {file}")
-                    sys.exit(1)  # stop script immediately
-
-    print(f"{mail.Body}")
-    mail.Send()
-    print("[MAIL] Outlook notification sent")
-
-
+    to, cc = recipients(ok=not has_error and any(r["total_wafers"] for r in results))
+    attachments = [path for r in results for path in r["attachments"]]
+    return Mail(subject, html, to, cc, attachments)
@@ -1,30 +1,56 @@
 # main.py
 import os
+import argparse
+import functools
+import logging
 import shutil, stat
 import zipfile
 import sys
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from sqlalchemy import select, and_
 
-from configs import PRODUCT_CONFIG, TEMP_DL_DIR, ROOT_DIR, FTP_BASE_URL, IS_TEST_DEBUG_MODE, IS_PRODUCTION_MODE, set_nas_dir
+from configs import PRODUCT_CONFIG, PRODUCT_CATALOG, ENABLED_PRODUCTS, TEMP_DL_DIR, ROOT_DIR, FTP_BASE_URL, IS_TEST_DEBUG_MODE, IS_PRODUCTION_MODE, LOG_LEVEL, SERVICE_POLL_INTERVAL, STAGE_WORKERS, DIFF_CHANGES_ONLY, CONVERT_WORKERS, LOT_PREFILTER, RUN_TIME_BUDGET, HOT_LOTS, SCHEDULE_ORDER, RUNNER, set_nas_dir
 from db import (
     get_factory_info,
+    is_wafer_uploaded,
     upsert_upload,
+    load_upload_ledger,
+    record_upload,
     create_upload_session,
     create_factory_session,
-    upload_table
+    sql_summary_lines,
+    get_upload_table
 )
-from scanner import scan_maps
-from umc_writer import process_wafer_GTK, process_wafer_ASE
+from scanner import scan_maps, extract_timestamp_from_zip, latest_deliveries
+from umc_writer import write_umc_bytes, map_file
+from converter import convert_bytes, ConversionPool, Lookahead
 from ftp_client import FTPClient, MAX_FTP_RETRIES
-from utils import html_diff, EXE_DIR, cleanup_duplicate, safe_copy, wait_until_stable
-from mailer import send_completion_mail
+from utils import html_diff, EXE_DIR, cleanup_duplicate, sha256_file
+from staging import stage_zip, is_staged, StagingError
+from mailer import build_digest_mails
+from notifier import RunDigest, get_notifier
+import metrics
+import events
+from profiler import profile_section
+from log_setup import setup_logging, set_thread_tag
+from journal import RunJournal, JOURNAL_FILENAME, wafer_key
+from workspace import ScratchWorkspace
+from inventory import NasInventory
+from lot_index import LotIndex, LOT_INDEX_FILENAME
+from scheduler import RunSchedule, ORDERS
+from aio_runner import AsyncRunner, WaferSteps
+from retry import WaferFailed, ErrorBudget, ErrorBudgetExceeded, RetryQueue
+
+log = logging.getLogger(__name__)
 
 enable_email = True #True in Production
 enable_ftp  = True #True in Production
 
 if IS_PRODUCTION_MODE == IS_TEST_DEBUG_MODE:
-    print("Wrong Debug Mode")
+    log.error("Wrong Debug Mode")
     sys.exit(1)
 
 def remove_readonly_or_retry(func, path, _):
@@ -36,27 +62,425 @@ def remove_readonly_or_retry(func, path, _):
         raise
 
 
-def run_main_for_product(PRODUCT_TO_CHECK, ftp, db_session, fr_session, unsupported_log_path):
-    timestamp = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
+# ============================================================
+# Per-wafer pipeline (extract -> convert -> upload -> verify -> DB)
+# ============================================================
+def journal_step(journal, item, product, step):
+    """Journal record of step for this wafer, only if it came from the same ZIP delivery."""
+    rec = journal.get(wafer_key(product, item["lot"], item["wafer"], item["stage"]), step)
+    if rec and rec.get("zip") == item["zip_file"]:
+        return rec
+    return None
 
-    """Run wafermap upload process for a given product."""
-    if not PRODUCT_TO_CHECK:
-        print("[ERROR] No product specified")
-        return
 
-    # ============================================================
-    # Step 1: Clean working directories
-    # ============================================================
+def resumable_umc_file(journal, product, item):
+    """
+    .umc file an interrupted run already produced for this wafer (None if the
+    wafer has to be extracted and converted again).
+    """
+    verified = journal_step(journal, item, product, "verify")
+    if verified:
+        return verified["file"]
+    rec = journal_step(journal, item, product, "convert")
+    if rec and os.path.exists(rec["file"]) and os.path.getsize(rec["file"]) == rec["size"]:
+        return rec["file"]
+    return None
 
+
+def copy_zip(zip_file, nas_dir, inventory, journal, workspace):
+    """
+    Stage one NAS ZIP into the scratch workspace once it is stable (staging.py:
+    hashed copy, central directory checked, reused while size/mtime match).
+    Size / mtime come from the run's NAS inventory snapshot; only the
+    stability check goes back to the share.
+    Returns False if it is not ready or could not be staged.
+    """
+    src = os.path.join(nas_dir, zip_file)
+    dst = workspace.zip_path(zip_file)
+
+    # Skip files that do not exist (not in this run's listing)
+    entry = inventory.get(nas_dir, zip_file)
+    if entry is None:
+        log.warning(f"[SKIP] Source file not found: {zip_file}")
+        return False
+
+    # Same NAS file already staged by this or an earlier run
+    if is_staged(entry.size, entry.mtime_ns, dst):
+        log.debug(f"[STAGE] {zip_file} already staged")
+        metrics.incr("stage_reused")
+        return True
+
+    # Wait until size / mtime are stable (the snapshot counts as the first check)
+    src_stat = inventory.wait_stable(nas_dir, zip_file, checks=3, delay=1)
+    if src_stat is None:
+        log.warning(f"[WAIT] File still copying, skipping for now: {zip_file}")
+        return False
+
+    try:
+        stage_zip(src, dst, src_stat)
+    except (StagingError, zipfile.BadZipFile, OSError) as e:
+        log.error(f"[STAGE] {zip_file} not staged: {e}")
+        return False
+    workspace.add_copy(zip_file)
+    log.debug(f"[STAGE] {zip_file} staged and verified")
+    return True
+
+
+def wafer_source(item, PRODUCT_TO_CHECK, subcon, nas_dir, inventory, fr_session, journal, workspace):
+    """
+    Extract the wafer map from the copied ZIP.
+    Returns (map path, converter.convert_bytes arguments except raw).
+    """
+    zip_file = item["zip_file"]
+    txt_name = os.path.basename(item["txt_file"])
+    lot = item["lot"]
+    wafer = item["wafer"]
+    stage = item["stage"]
+    zip_path = workspace.zip_path(zip_file)
+    delivered = extract_timestamp_from_zip(zip_file)
+    zip_timestamp = delivered.strftime("%Y-%m-%d %H:%M:%S") if delivered else ""
+    extract_dir = workspace.extract_dir(zip_file)
+    with workspace.zip_lock(zip_file):   # other wafers of this ZIP may be prepared at the same time
+        # Not copied in Step 4 (still being written) or dropped after a bad extract
+        if not os.path.exists(zip_path) and not copy_zip(zip_file, nas_dir, inventory, journal, workspace):
+            raise WaferFailed("copy", f"{zip_file} is not ready on the NAS")
+
+        # One directory per ZIP, extracted once for all of its wafers
+        if not workspace.is_extracted(zip_file):
+            try:
+                with zipfile.ZipFile(zip_path, "r") as zf:
+                    os.makedirs(extract_dir, exist_ok=True)
+                    nbytes = sum(i.file_size for i in zf.infolist())
+                    with metrics.span("extract", nbytes=nbytes):
+                        zf.extractall(extract_dir)
+                workspace.add_extracted(zip_file, nbytes)
+            except zipfile.BadZipFile:
+                # Drop the local copy so the retry copies it from the NAS again
+                workspace.discard(zip_file)
+                raise WaferFailed("extract", f"bad ZIP file {zip_file}")
+
+    for root_dir, _, files in os.walk(extract_dir):
+        if txt_name not in files:
+            continue
+        return os.path.join(root_dir, txt_name), dict(
+            subcon=subcon,
+            lot=lot,
+            wafer=wafer,
+            product=PRODUCT_TO_CHECK,
+            stage=stage,
+            zip_timestamp=zip_timestamp,
+            factory_info=get_factory_info(fr_session, lot, wafer, PRODUCT_TO_CHECK),
+        )
+    raise WaferFailed("extract", f"{txt_name} not found in {zip_file}")
+
+
+def wafer_job(item, PRODUCT_TO_CHECK, subcon, nas_dir, inventory, fr_session, journal, workspace):
+    """convert_bytes arguments with the map read into bytes, for the conversion processes (pickled)."""
+    map_path, job = wafer_source(item, PRODUCT_TO_CHECK, subcon, nas_dir, inventory, fr_session, journal, workspace)
+    with open(map_path, "rb") as f:
+        job["raw"] = f.read()
+    return job
+
+
+def convert_wafer(item, PRODUCT_TO_CHECK, subcon, nas_dir, inventory, fr_session, journal, workspace, ahead=None,
+                  convert=convert_bytes):
+    """
+    Write the .umc file of one wafer.
+    ahead: converter.Lookahead; the wafer's UMC bytes come from the conversion
+    processes if it was submitted there, otherwise it is converted here.
+    convert: convert_bytes, or ConversionPool.convert to run it in a worker process
+    """
+    converted = None
+    if ahead is not None:
+        with metrics.span("convert_wait"):
+            try:
+                converted = ahead.take(wafer_key(PRODUCT_TO_CHECK, item["lot"], item["wafer"], item["stage"]))
+            except Exception as e:
+                raise WaferFailed("convert", str(e))
+    if converted is None and convert is convert_bytes:
+        # inline: convert straight from the mmap of the extracted map, no bytes copy
+        map_path, job = wafer_source(item, PRODUCT_TO_CHECK, subcon, nas_dir, inventory, fr_session, journal,
+                                     workspace)
+        with map_file(map_path) as raw, metrics.span("convert") as convert_span:
+            converted = convert(raw=raw, **job)
+            convert_span["bytes"] = len(converted[2])
+    elif converted is None:
+        job = wafer_job(item, PRODUCT_TO_CHECK, subcon, nas_dir, inventory, fr_session, journal, workspace)
+        with metrics.span("convert") as convert_span:
+            converted = convert(**job)
+            convert_span["bytes"] = len(converted[2])
+    lot_prefix, umc_name, umc_bytes = converted
+    return write_umc_bytes(lot_prefix, item["stage"], umc_name, umc_bytes)
+
+
+def wafer_convert_step(fr_session, item, PRODUCT_TO_CHECK, subcon, nas_dir, inventory, journal, workspace,
+                       ahead=None, convert=convert_bytes):
+    """
+    Convert step of one wafer, resuming from the journal.
+    Returns (umc_file, needs_upload); needs_upload is False when an earlier
+    run already uploaded and verified it (only the DB row is missing).
+    """
+    lot = item["lot"]
+    wafer = item["wafer"]
+    stage = item["stage"]
+
+    verified = journal_step(journal, item, PRODUCT_TO_CHECK, "verify")
+    if verified:
+        log.info(f"[RESUME] {lot} W{wafer} {stage} was uploaded by an earlier run, repairing DB row")
+        return verified["file"], False
+
+    umc_file = resumable_umc_file(journal, PRODUCT_TO_CHECK, item)
+    if umc_file:
+        log.info(f"[RESUME] {lot} W{wafer} {stage} reusing {os.path.basename(umc_file)}")
+    else:
+        umc_file = convert_wafer(item, PRODUCT_TO_CHECK, subcon, nas_dir, inventory, fr_session, journal, workspace,
+                                 ahead, convert)
+        journal.record(wafer_key(PRODUCT_TO_CHECK, lot, wafer, stage), "convert",
+                       zip=item["zip_file"], file=umc_file, size=os.path.getsize(umc_file))
+    events.advance(PRODUCT_TO_CHECK, "convert")
+    return umc_file, True
+
+
+def wafer_upload_step(ftp, db_session, item, umc_file, PRODUCT_TO_CHECK, journal, ledger):
+    """FTP upload + download-back verify (skipped by the ledger / a verified earlier upload)."""
+    zip_file = item["zip_file"]
+    lot = item["lot"]
+    wafer = item["wafer"]
+    stage = item["stage"]
+    key = wafer_key(PRODUCT_TO_CHECK, lot, wafer, stage)
+
+    # ============================
+    # FTP Upload using single connection
+    # ============================
+    if not ftp.skip_by_ledger(umc_file, ledger):
+        if (journal_step(journal, item, PRODUCT_TO_CHECK, "upload")
+                and ftp.verify(umc_file, max_retries=1)):
+            log.info(f"[RESUME] {lot} W{wafer} {stage} upload from an earlier run verified, not re-transferred")
+        else:
+            log.debug("[FTP] Starting FTP Upload...")
+            if not ftp.upload(umc_file, max_retries=MAX_FTP_RETRIES):
+                raise WaferFailed("upload", f"FTP upload failed for {os.path.basename(umc_file)}")
+            journal.record(key, "upload", zip=zip_file, file=umc_file)
+            if not ftp.verify(umc_file, max_retries=MAX_FTP_RETRIES):
+                raise WaferFailed("verify", f"FTP verify failed for {os.path.basename(umc_file)}")
+        if ledger is not None:
+            remote_name = os.path.basename(umc_file)
+            sha = sha256_file(umc_file)
+            if record_upload(db_session, remote_name, sha, os.path.getsize(umc_file),
+                             PRODUCT_TO_CHECK, lot, wafer, stage):
+                ledger[remote_name] = sha
+    journal.record(key, "verify", zip=zip_file, file=umc_file)
+    events.advance(PRODUCT_TO_CHECK, "upload", nbytes=os.path.getsize(umc_file))
+    log.debug("[FTP] Successful FTP Upload...")
+
+
+def wafer_db_step(db_session, item, PRODUCT_TO_CHECK, journal):
+    """Upload status row; only called once the map is on the FTP server."""
+    lot = item["lot"]
+    wafer = item["wafer"]
+    stage = item["stage"]
+    success = upsert_upload(db_session, get_upload_table(), PRODUCT_TO_CHECK, lot, wafer, stage)
+    if not success:
+        raise WaferFailed("db", f"DB update failed for {lot} W{wafer} {stage}")
+    journal.record(wafer_key(PRODUCT_TO_CHECK, lot, wafer, stage), "db", zip=item["zip_file"])
+    events.advance(PRODUCT_TO_CHECK, "db")
+    log.debug("[DB] Successful DB Upload...")
+
+
+def process_wafer(item, PRODUCT_TO_CHECK, subcon, nas_dir, inventory, ftp, db_session, fr_session, journal, ledger,
+                  workspace, ahead=None):
+    """
+    Run one NOT_UPLOADED wafer through convert -> upload -> verify -> DB,
+    resuming after the last step the journal recorded for it:
+      verify done  -> DB row only (no re-transfer)
+      upload done  -> download-back check, re-upload only if it fails
+      convert done -> reuse the .umc still on disk
+    ledger: {remote name: sha256} of verified uploads (None = disabled);
+    a byte-identical .umc already on the FTP server is not sent again.
+    workspace: ScratchWorkspace holding the run's ZIP copies
+    inventory: NasInventory, the run's NAS directory snapshot
+    ahead: converter.Lookahead converting the next wafers in worker processes (None = inline)
+    Returns (umc_file, uploaded, db_updated); raises WaferFailed on any failure.
+    The asyncio runner (aio_runner.py) runs the same three steps with its own resources.
+    """
+    umc_file, needs_upload = wafer_convert_step(fr_session, item, PRODUCT_TO_CHECK, subcon, nas_dir, inventory,
+                                                journal, workspace, ahead)
+    uploaded = False
+    if needs_upload:
+        if enable_ftp != True:
+            return umc_file, False, False
+        wafer_upload_step(ftp, db_session, item, umc_file, PRODUCT_TO_CHECK, journal, ledger)
+        uploaded = True
+
+    # -------------------------
+    # Update DB only if FTP succeeded
+    # -------------------------
+    wafer_db_step(db_session, item, PRODUCT_TO_CHECK, journal)
+    return umc_file, uploaded, True
+
+
+def subcon_of(product):
+    """"GTK" or "ASE" for a product in product_config.csv (None if unknown)."""
+    product_info = PRODUCT_CONFIG.get(product)
+    if not product_info:
+        return None
+    return "GTK" if product_info.get("subcon") == "GREATEK TAIWAN" else "ASE"
+
+
+def prepare_work_dirs():
+    """
+    Step 1: clean (test mode) or create the working directories, once per run.
+    In production TEMP_DL_DIR is kept bounded by the ScratchWorkspace instead.
+    """
     for dir_to_clean in [TEMP_DL_DIR, ROOT_DIR]:
         if os.path.exists(dir_to_clean):
             if IS_TEST_DEBUG_MODE:
-                print(f"[CLEANUP] Removing old files in {dir_to_clean}")
+                log.info(f"[CLEANUP] Removing old files in {dir_to_clean}")
                 shutil.rmtree(dir_to_clean, onerror=remove_readonly_or_retry)
+                os.makedirs(dir_to_clean, exist_ok=True)
         else:
-            print(f"Creating {dir_to_clean}")
+            log.info(f"Creating {dir_to_clean}")
             os.makedirs(dir_to_clean, exist_ok=True)
 
+
+class BacklogTally:
+    """
+    Outcome bookkeeping of one product's wafer backlog (Step 5), shared by
+    the sync loop and the asyncio runner so both count, log and charge the
+    error budget the same way.
+    """
+
+    def __init__(self, product, workspace, budget, upload_file_path):
+        self.product = product
+        self.workspace = workspace
+        self.budget = budget
+        self.upload_file_path = upload_file_path
+        self.upload_file = None       # upload_file_path once a wafer finished
+        self.lots = []
+        self.uploaded_wafers = 0
+        self.db_update_count = 0
+        self.error_count = 0
+        self.deferred_count = 0
+
+    def done(self, item, umc_file, uploaded, db_updated):
+        self.workspace.done(item["zip_file"])
+        #print("[MAIN] Generating files_upload_*.txt", upload_file_path)
+        with open(self.upload_file_path, "a", encoding="utf-8") as f:
+            f.write(os.path.basename(umc_file) + "\n")
+        self.upload_file = self.upload_file_path
+        self.lots.append(item["lot"])
+        if uploaded:
+            self.uploaded_wafers += 1
+            metrics.incr("wafers_uploaded")
+        if db_updated:
+            self.db_update_count += 1
+            metrics.incr("db_updates")
+
+    def failed(self, item, attempt, e, delay):
+        """Attempt `attempt` raised e; delay = seconds to the retry, None = gave up. May raise ErrorBudgetExceeded."""
+        wafer_desc = f"{item['lot']} W{item['wafer']} {item['stage']}"
+        error = e if isinstance(e, WaferFailed) else WaferFailed("unexpected", repr(e))
+        self.error_count += 1
+        metrics.incr("wafer_failures")
+        events.error(self.product, error.step, f"{wafer_desc}: {error}", gave_up=delay is None)
+        if delay is None:
+            log.error(f"[FAILED] {wafer_desc} gave up after {attempt} attempt(s): {error}")
+            self.budget.give_up(self.product, wafer_desc, error.step, error, attempt)
+            self.workspace.done(item["zip_file"], keep=True)
+        else:
+            log.warning(f"[RETRY] {wafer_desc} attempt {attempt} failed ({error}), retry in {delay:.1f}s")
+        self.budget.charge(wafer_desc)
+
+    def deferred(self, schedule, left, total):
+        """The time budget ran out with `left` wafers of `total` not done."""
+        log.warning(f"[SCHEDULE] Time budget used up, {len(left)} wafermap(s) deferred to the next run")
+        schedule.defer(self.product, len(left))
+        self.deferred_count += len(left)
+        metrics.incr("wafers_deferred", len(left))
+        for w in left:
+            self.workspace.done(w["zip_file"], keep=True)
+        for step in ("convert", "upload", "db"):
+            events.total(self.product, step, total - len(left))
+
+
+def process_backlog(wafermaps, tally, PRODUCT_TO_CHECK, subcon, nas_dir, inventory, ftp, db_session, fr_session,
+                    journal, ledger, workspace, converter=None, schedule=None):
+    """
+    Sync runner of Step 5: one wafer at a time, the next ones converting in the
+    ConversionPool meanwhile. A failed wafer goes to the retry queue (backoff +
+    jitter); retries that are due run between the remaining wafers.
+    """
+    pending = deque(wafermaps)
+    retries = RetryQueue()
+    item_count = 0
+
+    ahead = None
+    if converter is not None:
+        def conversion_job(w):
+            if (journal_step(journal, w, PRODUCT_TO_CHECK, "verify")
+                    or resumable_umc_file(journal, PRODUCT_TO_CHECK, w)):
+                return None   # converted by an earlier run
+            return wafer_job(w, PRODUCT_TO_CHECK, subcon, nas_dir, inventory, fr_session, journal, workspace)
+
+        ahead = Lookahead(
+            converter,
+            key_of=lambda w: wafer_key(PRODUCT_TO_CHECK, w["lot"], w["wafer"], w["stage"]),
+            make_job=conversion_job,
+        )
+
+    while pending or retries:
+        if schedule is not None and schedule.expired():
+            tally.deferred(schedule, list(pending) + retries.drain(), len(wafermaps))
+            break
+        if ahead is not None:
+            ahead.fill(pending)
+        due = retries.pop_due()
+        if due:
+            item, attempt = due
+        elif pending:
+            item, attempt = pending.popleft(), 1
+            item_count += 1
+        else:
+            item, attempt = retries.pop_next()
+        wafer_desc = f"{item['lot']} W{item['wafer']} {item['stage']}"
+        log.debug(f"----- {item_count}/{len(wafermaps)} {wafer_desc} (attempt {attempt}) -----")
+        try:
+            umc_file, uploaded, db_updated = process_wafer(
+                item, PRODUCT_TO_CHECK, subcon, nas_dir, inventory, ftp, db_session, fr_session, journal,
+                ledger, workspace, ahead
+            )
+        except Exception as e:
+            tally.failed(item, attempt, e, retries.push(item, attempt))
+            continue
+        tally.done(item, umc_file, uploaded, db_updated)
+
+
+def run_main_for_product(PRODUCT_TO_CHECK, ftp, db_session, fr_session, unsupported_log_path, journal, budget,
+                         workspace, inventory, digest, converter=None, zip_filter=None, lot_index=None,
+                         schedule=None, backend=None):
+    timestamp = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
+
+    """
+    Run wafermap upload process for a given product.
+    journal   : RunJournal, per-wafer progress for crash-safe resume
+    budget    : ErrorBudget shared by the run (raises ErrorBudgetExceeded)
+    workspace : ScratchWorkspace, ZIP copies are dropped once their wafers are done
+    inventory : NasInventory, one NAS listing (name/size/mtime) shared by all steps
+    converter : ConversionPool for the UMC conversion (None = convert in this thread)
+    zip_filter: only scan these ZIP names (service mode); None = full NAS sweep
+    lot_index : LotIndex, ZIPs of lots known to belong to another product are not opened (None = open all)
+    schedule  : RunSchedule, processing order, per-product quota and run time budget (None = scan order)
+    backend   : AsyncRunner for the wafer backlog (None = sync loop in this thread)
+    """
+    if not PRODUCT_TO_CHECK:
+        log.error("[ERROR] No product specified")
+        return
+
+    # ============================================================
+    # Step 1: Working directories are prepared once by run_main
+    # (subcon groups run concurrently and share them)
+    # ============================================================
+
     # ============================================================
     # Step 2: Scan NAS ZIPs
     # ============================================================
@@ -71,6 +495,7 @@ def run_main_for_product(PRODUCT_TO_CHECK, ftp, db_session, fr_session, unsuppor
     uploaded_wafers = 0
     db_update_count = 0
     error_count = 0
+    deferred_count = 0     # left NOT_UPLOADED on purpose by the quota / time budget
     diff_file_path = None
     upload_file_path = None
 
@@ -79,41 +504,40 @@ def run_main_for_product(PRODUCT_TO_CHECK, ftp, db_session, fr_session, unsuppor
     # -------------------------
     product_info = PRODUCT_CONFIG.get(PRODUCT_TO_CHECK)
     test_factory = product_info.get("subcon")
-    if test_factory == "GREATEK TAIWAN":
-        subcon = "GTK"
-    else:
-        subcon = "ASE"
+    subcon = subcon_of(PRODUCT_TO_CHECK)
 
     NAS_MAP_DIR = set_nas_dir(test_factory)
 
 
 
-    print(f"Checking ZIP Files from: {NAS_MAP_DIR}" )
-    for zip_file in os.listdir(NAS_MAP_DIR):    #Every ZIP
-        if not zip_file.lower().endswith(".zip"):
-            continue
+    log.info(f"Checking ZIP Files from: {NAS_MAP_DIR}" )
+    nas_zip_files = inventory.zip_names(NAS_MAP_DIR)   # one scandir per directory per run
+    if zip_filter is not None:
+        nas_zip_files = [z for z in nas_zip_files if z in zip_filter]
+    events.total(PRODUCT_TO_CHECK, "scan", len(nas_zip_files))
+    prefiltered = 0
+    for zip_file in nas_zip_files:    #Every ZIP
         zip_path = os.path.join(NAS_MAP_DIR, zip_file)
+        other = lot_index.other_product(subcon, zip_file, PRODUCT_TO_CHECK) if lot_index else None
+        if other:
+            log.debug(f"[PREFILTER] Skip {zip_file}: lot belongs to {other}")
+            prefiltered += 1
+            events.advance(PRODUCT_TO_CHECK, "scan")
+            continue
         try:
-            print("Scanning files from zip:", zip_file)
+            log.debug(f"Scanning files from zip: {zip_file}")
             for zip_path_inner, txt_file, lot, wafer, stage, product in scan_maps(zip_path, unsupported_log_path, subcon): #Every Wafer Map
                 if os.path.basename(zip_path_inner) != zip_file:
                     continue
+                if lot_index:
+                    lot_index.learn(subcon, lot, product)
                 if product != PRODUCT_TO_CHECK:
                     #print(f"Skip product {product}")
                     break
                 total_wafer += 1
                 lot_prefix = lot.split(".")[0]
-                where_clause = and_(
-                    upload_table.c.Product == product,
-                    upload_table.c.Lot_Number == lot_prefix,
-                    upload_table.c.Wafer_Id == int(wafer),
-                    upload_table.c.stage == stage,
-                )
                 #print("Checking Records from database")
-                record = db_session.execute(
-                    select(1).where(where_clause)
-                ).first()
-                if record:
+                if is_wafer_uploaded(db_session, product, lot_prefix, wafer, stage):
                     uploaded_count += 1
                     status = "UPLOADED"
                 else:
@@ -129,22 +553,52 @@ def run_main_for_product(PRODUCT_TO_CHECK, ftp, db_session, fr_session, unsuppor
                     })
                 wafer_results_tbl = f"{PRODUCT_TO_CHECK} | Lot={lot} | W{wafer} | {stage} | {status}"
                 first_scan_line.append(wafer_results_tbl)
-        except zipfile.BadZipFile:
+        except zipfile.BadZipFile as e:
                 error_count += 1
-                print("Bad ZIP file, skipping:", zip_file)
-                sys.exit(1)
+                log.error(f"Bad ZIP file, skipping: {zip_file}")
+                events.error(PRODUCT_TO_CHECK, "scan", f"bad ZIP {zip_file}")
+                budget.give_up(PRODUCT_TO_CHECK, zip_file, "scan", e, 1)
+                budget.charge(zip_file)
+        events.advance(PRODUCT_TO_CHECK, "scan")
+    if prefiltered:
+        log.info(f"[PREFILTER] {prefiltered} ZIP(s) of other products' lots skipped without opening")
+        metrics.incr("zips_prefiltered", prefiltered)
+    # ============================================================
+    # Step 3: Keep only the newest delivery per wafer
+    # (superseded re-test maps are never copied or extracted)
+    # ============================================================
+    not_uploaded_wafermaps, superseded = latest_deliveries(not_uploaded_wafermaps)
+    if superseded:
+        log.info(f"[DEDUPE] {len(superseded)} wafermap(s) superseded by a newer delivery, skipped")
+        for w in superseded:
+            log.debug(f"[DEDUPE] Skip {w['lot']} W{w['wafer']} {w['stage']} from {w['zip_file']}")
+        metrics.incr("wafers_superseded", len(superseded))
+
+    # ============================================================
+    # Step 3b: Order the backlog (hot lots, oldest delivery) and apply the quota
+    # ============================================================
+    if schedule is not None and not_uploaded_wafermaps:
+        not_uploaded_wafermaps, deferred = schedule.plan(PRODUCT_TO_CHECK, not_uploaded_wafermaps)
+        deferred_count = len(deferred)
+        if deferred:
+            log.info(f"[SCHEDULE] Quota: {len(not_uploaded_wafermaps)} wafermap(s) this run, "
+                     f"{len(deferred)} deferred to the next run")
+            metrics.incr("wafers_deferred", len(deferred))
+
     # ============================================================
     # Summary
     # ============================================================
     for line in first_scan_line:
-        print(line)
+        log.debug(line)
     wafer_summary = f"""
     Upload status summary for {PRODUCT_TO_CHECK}
     Total wafers scanned: {total_wafer}
     Uploaded: {uploaded_count}
     Not uploaded: {not_uploaded_count}
     """
-    print(wafer_summary)
+    log.info(wafer_summary)
+    metrics.incr("wafers_scanned", total_wafer)
+    metrics.incr("wafers_not_uploaded", not_uploaded_count)
     # Append each line separately
     for line in wafer_summary.strip().split("\n"):
         first_scan_line.append(line)
@@ -153,30 +607,32 @@ def run_main_for_product(PRODUCT_TO_CHECK, ftp, db_session, fr_session, unsuppor
     # ============================================================
     zip_to_process = None
     if not not_uploaded_wafermaps:
-        print("\nAll wafermaps are already UPLOADED.")
+        log.info("All wafermaps are already UPLOADED.")
     else:
-        zip_to_process = {w["zip_file"] for w in not_uploaded_wafermaps}
+        # Wafers converted / uploaded by an interrupted run do not need their ZIP again
+        # (in schedule order, so the first wafers' ZIPs are staged first)
+        zip_to_process = list(dict.fromkeys(
+            w["zip_file"] for w in not_uploaded_wafermaps
+            if not resumable_umc_file(journal, PRODUCT_TO_CHECK, w)
+        ))
 
         # -----------------------------
-        # Copy loop using wait_until_stable
+        # Parallel staging (each ZIP waits until stable first)
         # -----------------------------
-        for zip_file in zip_to_process:
-            src = os.path.join(NAS_MAP_DIR, zip_file)
-            dst = os.path.join(TEMP_DL_DIR, zip_file)
-
-            # Skip files that do not exist yet
-            if not os.path.exists(src):
-                print(f"[SKIP] Source file not found: {zip_file}")
-                continue
+        for w in not_uploaded_wafermaps:
+            workspace.need(w["zip_file"], 1)
+        for step in ("convert", "upload", "db"):
+            events.total(PRODUCT_TO_CHECK, step, len(not_uploaded_wafermaps))
+        events.total(PRODUCT_TO_CHECK, "stage", len(zip_to_process))
 
-            # Wait until file size is stable
-            if not wait_until_stable(src, checks=3, delay=1):
-                print(f"[WAIT] File still copying, skipping for now: {zip_file}")
-                continue
+        def stage_one(zip_file):
+            if copy_zip(zip_file, NAS_MAP_DIR, inventory, journal, workspace):
+                events.advance(PRODUCT_TO_CHECK, "stage", nbytes=inventory.get(NAS_MAP_DIR, zip_file).size)
+            else:
+                events.error(PRODUCT_TO_CHECK, "stage", f"{zip_file} not staged")
 
-            # Copy safely
-            safe_copy(src, dst)
-            print(f"[COPY] {zip_file} copied successfully")
+        with ThreadPoolExecutor(max_workers=STAGE_WORKERS, thread_name_prefix=f"stage-{subcon}") as pool:
+            list(pool.map(stage_one, zip_to_process))
 
         #for zip_file in zip_to_process:
         #    shutil.copy2(
@@ -184,92 +640,38 @@ def run_main_for_product(PRODUCT_TO_CHECK, ftp, db_session, fr_session, unsuppor
         #        os.path.join(TEMP_DL_DIR, zip_file),
         #    )
 
-        print(f"\nProcessing {len(zip_to_process)} ZIPs containing {len(not_uploaded_wafermaps)} NOT_UPLOADED wafermaps...")
+        log.info(f"Processing {len(zip_to_process)} ZIPs containing {len(not_uploaded_wafermaps)} NOT_UPLOADED wafermaps...")
        # ========================================================
        # Step 5: Process only NOT_UPLOADED wafermaps
+       # sync runner: process_backlog, one wafer at a time;
+       # async runner: the run's AsyncRunner (aio_runner.py) runs the
+       # same steps as concurrent tasks
        # ========================================================
-        for item_count, item in enumerate(not_uploaded_wafermaps, start=1):
-            zip_file = item["zip_file"]
-            txt_name = os.path.basename(item["txt_file"])
-            lot = item["lot"]
-            wafer = item["wafer"]
-            stage = item["stage"]
-            print(f"\n----- {item_count}/{len(not_uploaded_wafermaps)} -----")
-            zip_path = os.path.join(TEMP_DL_DIR, zip_file)
-            parts = zip_file.replace(".map.zip", "").split("_")
-            zip_timestamp = (
-                datetime.strptime("_".join(parts[2:8]), "%Y_%m_%d_%H_%M_%S")
-                .strftime("%Y-%m-%d %H:%M:%S")
-                if len(parts) >= 8
-                else ""
+        ledger = load_upload_ledger(db_session, PRODUCT_TO_CHECK)   # one query, dict lookups per wafer
+        tally = BacklogTally(PRODUCT_TO_CHECK, workspace, budget,
+                             os.path.join(EXE_DIR, f"files_uploaded_{PRODUCT_TO_CHECK}_{timestamp}.txt"))
+        if backend is not None:
+            backend.run_backlog(
+                not_uploaded_wafermaps, tally, schedule,
+                WaferSteps(
+                    convert=functools.partial(wafer_convert_step, PRODUCT_TO_CHECK=PRODUCT_TO_CHECK, subcon=subcon,
+                                              nas_dir=NAS_MAP_DIR, inventory=inventory, journal=journal,
+                                              workspace=workspace,
+                                              convert=converter.convert if converter is not None else convert_bytes),
+                    upload=functools.partial(wafer_upload_step, PRODUCT_TO_CHECK=PRODUCT_TO_CHECK, journal=journal,
+                                             ledger=ledger) if enable_ftp == True else None,
+                    db=functools.partial(wafer_db_step, PRODUCT_TO_CHECK=PRODUCT_TO_CHECK, journal=journal),
+                ),
             )
-            try:
-                with zipfile.ZipFile(zip_path, "r") as zf:
-                    extract_dir = os.path.join(TEMP_DL_DIR, "extracted", lot, stage)
-                    os.makedirs(extract_dir, exist_ok=True)
-                    zf.extractall(extract_dir)
-                    for root_dir, _, files in os.walk(extract_dir):
-                        if txt_name not in files:
-                            continue
-                        txt_path = os.path.join(root_dir, txt_name)
-                        factory_info = get_factory_info(fr_session, lot, wafer, PRODUCT_TO_CHECK)
-                        if subcon == "GTK":
-                            umc_file = process_wafer_GTK(
-                                lot=lot,
-                                wafer=wafer,
-                                filename=txt_path,
-                                product=PRODUCT_TO_CHECK,
-                                stage=stage,
-                                zip_timestamp=zip_timestamp,
-                                factory_info=factory_info,
-                            )
-                        else: #ASE
-                            umc_file = process_wafer_ASE(
-                                lot=lot,
-                                wafer=wafer,
-                                filename=txt_path,
-                                product=PRODUCT_TO_CHECK,
-                                stage=stage,
-                                zip_timestamp=zip_timestamp,
-                                factory_info=factory_info,
-                            )
-
-                        if umc_file:
-                            upload_file_path = os.path.join(EXE_DIR, f"files_uploaded_{timestamp}.txt")
-                            #print("[MAIN] Generating files_upload_*.txt", upload_file_path)
-                            with open(upload_file_path, "a", encoding="utf-8") as f:
-                                f.write(os.path.basename(umc_file) + "\n")
-                            #print(f"[MAIN] Done update {upload_file_path}")
-                        #lots = set()
-                        #lots.add(lot)
-                        lots.append(lot)
-                        if enable_ftp == True:
-                            # ============================
-                            # FTP Upload using single connection
-                            # ============================
-                            print("[FTP] Starting FTP Upload...")
-                            if ftp.upload_and_verify(umc_file, max_retries=MAX_FTP_RETRIES):
-                                uploaded_wafers += 1
-                                print("[FTP] Successful FTP Upload...")
-                               # -------------------------
-                               # Update DB only if FTP succeeded
-                               # -------------------------
-                                success = upsert_upload(db_session, upload_table, PRODUCT_TO_CHECK, lot, wafer, stage)
-                                if success:
-                                    db_update_count += 1
-                                    print("[DB] Successful DB Upload...")
-                                else:
-                                    print(f"[WARN] Failed DB update for {lot} W{wafer} {stage}")
-                                    error_count += 1
-                                    sys.exit(1)
-                            else:
-                                print(f"[WARN] FTP upload failed for wafer {wafer}")
-                                error_count += 1
-                                sys.exit(1)
-            except zipfile.BadZipFile:
-                error_count += 1
-                print("Bad ZIP file, skipping:", zip_file)
-                sys.exit(1)
+        else:
+            process_backlog(not_uploaded_wafermaps, tally, PRODUCT_TO_CHECK, subcon, NAS_MAP_DIR, inventory, ftp,
+                            db_session, fr_session, journal, ledger, workspace, converter, schedule)
+        lots = tally.lots
+        uploaded_wafers = tally.uploaded_wafers
+        db_update_count = tally.db_update_count
+        error_count += tally.error_count
+        deferred_count += tally.deferred_count
+        upload_file_path = tally.upload_file
 
 
     #===============================
@@ -282,9 +684,12 @@ def run_main_for_product(PRODUCT_TO_CHECK, ftp, db_session, fr_session, unsuppor
         second_scan_line=[]
 
 
-        print("[SCAN] Scanning the 2nd time...")
-        for zip_file in os.listdir(NAS_MAP_DIR):
-            if not zip_file.lower().endswith(".zip"):
+        log.info("[SCAN] Scanning the 2nd time...")
+        nas_zip_files = inventory.zip_names(NAS_MAP_DIR)   # same ZIPs as the first scan
+        for zip_file in nas_zip_files:
+            if zip_filter is not None and zip_file not in zip_filter:
+                continue
+            if lot_index and lot_index.other_product(subcon, zip_file, PRODUCT_TO_CHECK):
                 continue
 
             zip_path = os.path.join(NAS_MAP_DIR, zip_file)
@@ -298,17 +703,7 @@ def run_main_for_product(PRODUCT_TO_CHECK, ftp, db_session, fr_session, unsuppor
                     total_wafer += 1
                     lot_prefix = lot.split(".")[0]
 
-                    where_clause = and_(
-                        upload_table.c.Product == product,
-                        upload_table.c.Lot_Number == lot_prefix,
-                        upload_table.c.Wafer_Id == int(wafer),
-                        upload_table.c.stage == stage,
-                    )
-
-                    record = db_session.execute(
-                        select(1).where(where_clause)
-                    ).first()
-                    if record:
+                    if is_wafer_uploaded(db_session, product, lot_prefix, wafer, stage):
                         uploaded_count += 1
                         status = "UPLOADED"
                     else:
@@ -326,22 +721,22 @@ def run_main_for_product(PRODUCT_TO_CHECK, ftp, db_session, fr_session, unsuppor
                     second_scan_line.append(wafer_results_tbl)
             except zipfile.BadZipFile:
                 error_count += 1
-                print("Bad ZIP file, skipping:", zip_file)
-                sys.exit(1)  # stop script immediately
+                log.error(f"Bad ZIP file, skipping: {zip_file}")
         # ============================================================
         # Summary
         # ============================================================
         for line in second_scan_line:
-            print(line)
+            log.debug(line)
         wafer_summary = f"""
         Upload status summary for {PRODUCT_TO_CHECK}
         Total wafers scanned: {total_wafer}
         Uploaded: {uploaded_count}
         Not uploaded: {not_uploaded_count}
         """
-        if total_wafer != uploaded_count:
+        # wafers deferred by the schedule are still NOT_UPLOADED, that is not an error
+        if total_wafer != uploaded_count + deferred_count:
             error_count += 1
-            print("Mismatch found in total_wafer and uploaded_count")
+            log.warning("Mismatch found in total_wafer and uploaded_count")
         # Append each line separately
         for line in wafer_summary.strip().split("\n"):
             second_scan_line.append(line)
@@ -349,27 +744,26 @@ def run_main_for_product(PRODUCT_TO_CHECK, ftp, db_session, fr_session, unsuppor
         # ============================================================
         # Step 12: HTML Diff (Highlight newly uploaded wafers)
         # ============================================================
-        diff_file_path = html_diff(first_scan_line, second_scan_line)
-        print("[HTML DIFF] generating diff...", diff_file_path)
+        diff_file_path = html_diff(first_scan_line, second_scan_line, PRODUCT_TO_CHECK,
+                                   changes_only=DIFF_CHANGES_ONLY)
+        log.info(f"[HTML DIFF] generating diff... {diff_file_path}")
         first_scan_line.clear()
         second_scan_line.clear()
 
-    if enable_email == True:
-        # ============================================================
-        # Step 4: Send email
-        # ============================================================
-        print("[MAIL] Sending mail...")
-        send_completion_mail(
-            product=PRODUCT_TO_CHECK,
-            lots=lots,
-            total_wafers=total_wafer,
-            uploaded_wafers=uploaded_wafers,
-            db_update_count=db_update_count,
-            ftp_dir=FTP_BASE_URL,
-            error=error_count,
-            has_attach=len(not_uploaded_wafermaps) != 0,
-            attachments = [diff_file_path,upload_file_path],
-        )
+    metrics.incr("errors", error_count)
+
+    # ============================================================
+    # Step 4: Add to the run digest (one mail per run, see run_main)
+    # ============================================================
+    digest.add(
+        product=PRODUCT_TO_CHECK,
+        lots=lots,
+        total_wafers=total_wafer,
+        uploaded_wafers=uploaded_wafers,
+        db_update_count=db_update_count,
+        errors=error_count,
+        attachments=[diff_file_path, upload_file_path] if not_uploaded_wafermaps else (),
+    )
 
     not_uploaded_wafermaps.clear()
     lots.clear()
@@ -378,39 +772,233 @@ def run_main_for_product(PRODUCT_TO_CHECK, ftp, db_session, fr_session, unsuppor
 # ============================================================
 # CLI entry
 # ============================================================
-def run_main(selected_products):
+def group_by_subcon(products):
+    """{"GTK": [...], "ASE": [...]} in selection order; each subcon reads its own NAS share."""
+    groups = {}
+    for product in products:
+        groups.setdefault(subcon_of(product) or product, []).append(product)
+    return groups
+
+
+def run_product_group(products, ftp, unsupported_log_path, journal, budget, workspace, inventory, digest,
+                      converter, lot_index, schedule, backend, zip_filters, profile, profile_memory, run_id):
+    """
+    Run the products of one subcon one after another (one worker thread per subcon).
+    Own DB sessions and FTP handle (pycurl handles and sessions are not thread-safe);
+    the DB engine pool, journal, budget, scratch workspace, NAS inventory, run digest, conversion pool,
+    lot index, schedule, async runner and metrics are shared.
+    Returns the products that failed.
+    """
+    db_session = create_upload_session()
+    fr_session = create_factory_session()
+    owns_ftp = ftp is None
+    if owns_ftp:
+        ftp = FTPClient(FTP_BASE_URL)
+    failed = []
+    try:
+        for index, product in enumerate(products):
+            if budget.exhausted():
+                failed.extend(products[index:])
+                log.error(f"[ABORT] Error budget exceeded, skipped: {', '.join(products[index:])}")
+                break
+            if schedule.expired():
+                for product in products[index:]:
+                    schedule.skip_product(product)
+                break
+            zip_filter = zip_filters.get(product)
+            try:
+                log.info(f"[INFO] Processing product: {product}")
+                if profile or profile_memory:
+                    with profile_section(product, EXE_DIR, run_id, trace_memory=profile_memory):
+                        run_main_for_product(product, ftp, db_session, fr_session, unsupported_log_path, journal,
+                                             budget, workspace, inventory, digest, converter, zip_filter,
+                                             lot_index, schedule, backend)
+                else:
+                    run_main_for_product(product, ftp, db_session, fr_session, unsupported_log_path, journal,
+                                         budget, workspace, inventory, digest, converter, zip_filter, lot_index,
+                                         schedule, backend)
+            except ErrorBudgetExceeded as e:
+                failed.extend(products[index:])
+                log.error(f"[ABORT] Error budget exceeded, remaining products skipped: {e}")
+                break
+            except Exception as e:
+                failed.append(product)
+                log.exception(f"[ERROR] Failed processing {product}: {e}")
+    finally:
+        if owns_ftp:
+            ftp.close()
+        db_session.close()
+        fr_session.close()
+    return failed
+
+
+def queue_digest_mail(digest, failed, budget):
+    """Hand the run's digest mails to the background notifier; never fails the run."""
+    try:
+        for mail in build_digest_mails(digest, failed, budget.failed_wafers):
+            get_notifier().submit(mail)
+    except Exception as e:
+        log.exception(f"[MAIL] Could not queue the run digest: {e}")
+
+
+def run_main(selected_products, profile=False, profile_memory=False, ftp_clients=None, zip_filters=None,
+             journal_name=JOURNAL_FILENAME, schedule=None, runner=RUNNER, notify=True, converter=None):
+    """
+    Process the selected products.
+    GTK and ASE products run concurrently, one worker thread per subcon
+    (products of the same subcon stay sequential).
+    profile / profile_memory: cProfile (+ tracemalloc) each product and
+    write profile_<run>_<product>.pstats/.txt next to the run log;
+    subcon groups then run one after another so the profiles stay clean.
+    ftp_clients : {subcon: FTPClient} kept open by the caller across runs (service / worker mode);
+                  a subcon without one gets a new client that is added to the dict,
+                  the caller closes them all. None = each group opens and closes its own
+    zip_filters : {product: set of ZIP names} to limit the scan; missing = full sweep
+    journal_name: run journal file in EXE_DIR (one per worker in worker mode)
+    schedule    : RunSchedule (order, quotas, time budget); None = the configs defaults
+    runner      : "sync" or "async" (Step 5 of every product on the asyncio runner, aio_runner.py)
+    notify      : queue the digest mail (worker mode re-runs of a failed batch pass False)
+    converter   : ConversionPool kept by the caller across runs (service / worker mode, the caller
+                  closes it); None = this run starts its own when CONVERT_WORKERS > 1
+    Returns the products that failed or still have wafers deferred by the schedule
+    (callers such as service / worker mode retry those).
+    """
     if not selected_products:
-        print("[ERROR] No products specified")
-        return
+        log.error("[ERROR] No products specified")
+        return []
 
     if isinstance(selected_products, str):
         selected_products = [selected_products]
+    if runner not in ("sync", "async"):
+        raise ValueError(f"Unknown runner {runner!r} (expected sync or async)")
 
-    # Shared sessions
-    db_session = create_upload_session()
-    fr_session = create_factory_session()
-    ftp = FTPClient(FTP_BASE_URL)  # ONE FTP connection
+    run_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+    metrics.reset()
+    PRODUCT_CATALOG.refresh()   # product_config.csv edited since the last run
+
+    zip_filters = zip_filters or {}
+    failed = []
+    journal = RunJournal(os.path.join(EXE_DIR, journal_name), run_id)
+    budget = ErrorBudget()
+    digest = RunDigest(run_id)
+    groups = group_by_subcon(selected_products)
+    concurrent = len(groups) > 1 and not (profile or profile_memory)
 
     unsupported_log_path = os.path.join(EXE_DIR, "unsupported_device.log")
     if os.path.exists(unsupported_log_path):
         os.remove(unsupported_log_path)
 
+    workspace = None
+    backend = None
+    owns_converter = converter is None and CONVERT_WORKERS > 1
+    if owns_converter:
+        converter = ConversionPool()
+    lot_index = LotIndex(os.path.join(EXE_DIR, LOT_INDEX_FILENAME)) if LOT_PREFILTER else None
+    schedule = schedule or RunSchedule()
+    schedule.start()
+    events.run_start(selected_products)
     try:
-        for product in selected_products:
-            try:
-                print(f"\n[INFO] Processing product: {product}")
-                run_main_for_product(product, ftp, db_session, fr_session, unsupported_log_path)
-            except Exception as e:
-                print(f"[ERROR] Failed processing {product}: {e}")
+        prepare_work_dirs()
+        workspace = ScratchWorkspace(TEMP_DL_DIR, run_id)
+        inventory = NasInventory()
+        if runner == "async":
+            backend = AsyncRunner()
+        jobs = []
+        for tag, products in groups.items():
+            if ftp_clients is not None and tag not in ftp_clients:
+                ftp_clients[tag] = FTPClient(FTP_BASE_URL)
+            ftp = ftp_clients[tag] if ftp_clients is not None else None
+            args = (products, ftp, unsupported_log_path, journal, budget, workspace,
+                    inventory, digest, converter, lot_index, schedule, backend, zip_filters, profile, profile_memory,
+                    run_id)
+            jobs.append((tag, args))
+
+        if concurrent:
+            log.info(f"[INFO] Running {', '.join(groups)} concurrently")
+            results = {}
+
+            def worker(tag, args):
+                set_thread_tag(tag)   # console lines: "[GTK] ..." / "[ASE] ..."
+                results[tag] = run_product_group(*args)
+
+            threads = [threading.Thread(target=worker, args=job, name=job[0]) for job in jobs]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            for tag, products in groups.items():
+                # a group thread that died before returning counts as failed
+                failed.extend(results.get(tag, products))
+        else:
+            for tag, args in jobs:
+                failed.extend(run_product_group(*args))
+
+        failed.extend(p for p in budget.failed_products() if p not in failed)
+        if budget.failed_wafers:
+            for line in budget.summary_lines():
+                log.error(line)
+        for line in schedule.summary_lines():
+            log.warning(line)
     finally:
-        ftp.close()
-        db_session.close()
-        fr_session.close()
-        print("[ALL DONE] All products processed")
+        if backend is not None:
+            backend.close()
+        journal.close()
+        if workspace is not None:
+            workspace.close()
+        if owns_converter:
+            converter.close()
+        if lot_index is not None:
+            lot_index.save()
+        if enable_email and notify:
+            queue_digest_mail(digest, failed + schedule.not_started, budget)
+        events.run_end(failed)
+        log.info("[ALL DONE] All products processed")
         cleanup_duplicate(unsupported_log_path)
+        for line in sql_summary_lines():
+            log.info(line)
+        metrics.write_run_metrics(EXE_DIR, run_id)
+    return failed + [p for p in schedule.deferred_products() if p not in failed]
 
 
 
 if __name__ == "__main__":
-    product_arg = sys.argv[1] if len(sys.argv) > 1 else ""
-    run_main(product_arg)
+    multiprocessing.freeze_support()   # frozen EXE: conversion worker processes start here
+    parser = argparse.ArgumentParser(description="Convert and upload wafer maps to UMC")
+    parser.add_argument("products", nargs="*", help="products to process, e.g. FT233H-B FT4232HA")
+    parser.add_argument("--profile", action="store_true",
+                        help="cProfile each product; .pstats + summary next to the run log")
+    parser.add_argument("--profile-memory", action="store_true",
+                        help="also trace allocations with tracemalloc (slower)")
+    parser.add_argument("--log-level", default=LOG_LEVEL, help="DEBUG shows per-wafer detail")
+    parser.add_argument("--service", action="store_true",
+                        help="stay resident and poll the NAS for new or changed ZIPs")
+    parser.add_argument("--interval", type=int, default=SERVICE_POLL_INTERVAL,
+                        help="service mode: seconds between NAS polls")
+    parser.add_argument("--worker", action="store_true",
+                        help="lease lot/stage groups from the DB and share the backlog with other instances")
+    parser.add_argument("--worker-id", default=None,
+                        help="worker mode: lease owner name (default: host name; unique per instance)")
+    parser.add_argument("--time-budget", type=int, default=RUN_TIME_BUDGET, metavar="MINUTES",
+                        help="stop at the next wafer once the run has taken this long (0 = no limit)")
+    parser.add_argument("--hot-lots", default=",".join(HOT_LOTS),
+                        help="comma separated lots to process before anything else")
+    parser.add_argument("--order", default=SCHEDULE_ORDER, choices=ORDERS,
+                        help="backlog order after the hot lots: oldest delivery first or NAS scan order")
+    parser.add_argument("--runner", default=RUNNER, choices=("sync", "async"),
+                        help="async: run each product's wafers as asyncio tasks (convert / FTP / DB overlap)")
+    args = parser.parse_args()
+
+    log_path = os.path.join(EXE_DIR, f"log_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt")
+    setup_logging(log_path, level=args.log_level, redirect_std=True)
+    log.info(f"[LOG] Logging to: {log_path}")
+    if args.service:
+        from service import run_service
+        run_service(args.products or ENABLED_PRODUCTS, run_main, interval=args.interval)
+    elif args.worker:
+        from leases import run_worker
+        run_worker(args.products or ENABLED_PRODUCTS, run_main, worker_id=args.worker_id)
+    else:
+        schedule = RunSchedule(order=args.order, time_budget=args.time_budget,
+                               hot_lots=[lot.strip() for lot in args.hot_lots.split(",") if lot.strip()])
+        run_main(args.products, profile=args.profile, profile_memory=args.profile_memory, schedule=schedule,
+                 runner=args.runner)
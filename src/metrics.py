@@ -0,0 +1,173 @@
+# metrics.py
+import bisect
+import json
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# -------------------------
+# Run-level timing spans and counters
+# -------------------------
+_lock = threading.Lock()
+_spans = {}        # name -> {"durations": [...], "bytes": int, "buckets": upper bounds or None}
+_counters = {}     # name -> int
+_run_started = time.time()
+
+PROM_FILENAME = "wafermap_uploader.prom"
+
+log = logging.getLogger(__name__)
+
+
+def reset():
+    """Start a new run: drop all spans and counters."""
+    global _run_started
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+        _run_started = time.time()
+
+
+def observe(name, seconds, nbytes=0, buckets=None):
+    """
+    Record one timed operation (and the bytes it moved).
+    buckets: upper bounds in seconds; the span is then also reported as a
+    latency histogram (the first observation of a run sets them).
+    """
+    with _lock:
+        entry = _spans.setdefault(name, {"durations": [], "bytes": 0, "buckets": buckets})
+        entry["durations"].append(seconds)
+        entry["bytes"] += nbytes or 0
+
+
+@contextmanager
+def span(name, nbytes=0):
+    """
+    Time a block:
+        with metrics.span("ftp_upload", nbytes=size): ...
+    Bytes known only afterwards can be set on the yielded record:
+        with metrics.span("convert") as s: ...; s["bytes"] = len(umc_bytes)
+    """
+    record = {"bytes": nbytes}
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        observe(name, time.perf_counter() - start, record["bytes"])
+
+
+def incr(name, n=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def _percentile(sorted_values, pct):
+    """Nearest-rank percentile."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summary():
+    """
+    {"spans": {name: {count, total_s, p50_s, p95_s, max_s, bytes[, histogram]}}, "counters": {...}}
+    histogram: {upper bound: observations <= bound, ..., "+Inf": count} (cumulative)
+    """
+    with _lock:
+        spans = {name: (list(e["durations"]), e["bytes"], e["buckets"]) for name, e in _spans.items()}
+        counters = dict(_counters)
+        started = _run_started
+
+    result = {}
+    for name, (durations, nbytes, buckets) in sorted(spans.items()):
+        durations.sort()
+        result[name] = {
+            "count": len(durations),
+            "total_s": round(sum(durations), 6),
+            "p50_s": round(_percentile(durations, 50), 6),
+            "p95_s": round(_percentile(durations, 95), 6),
+            "max_s": round(durations[-1], 6) if durations else 0.0,
+            "bytes": nbytes,
+        }
+        if buckets:
+            histogram = {str(b): bisect.bisect_right(durations, b) for b in buckets}
+            histogram["+Inf"] = len(durations)
+            result[name]["histogram"] = histogram
+    return {
+        "run_started": datetime.fromtimestamp(started).strftime("%Y-%m-%d %H:%M:%S"),
+        "run_duration_s": round(time.time() - started, 3),
+        "spans": result,
+        "counters": counters,
+    }
+
+
+def _prometheus_text(data):
+    lines = [
+        "# HELP wmu_stage_seconds Wall time per pipeline stage operation.",
+        "# TYPE wmu_stage_seconds summary",
+    ]
+    for name, s in data["spans"].items():
+        lines.append(f'wmu_stage_seconds{{stage="{name}",quantile="0.5"}} {s["p50_s"]}')
+        lines.append(f'wmu_stage_seconds{{stage="{name}",quantile="0.95"}} {s["p95_s"]}')
+        lines.append(f'wmu_stage_seconds_sum{{stage="{name}"}} {s["total_s"]}')
+        lines.append(f'wmu_stage_seconds_count{{stage="{name}"}} {s["count"]}')
+    lines += [
+        "# HELP wmu_stage_bytes_total Bytes moved per pipeline stage.",
+        "# TYPE wmu_stage_bytes_total counter",
+    ]
+    for name, s in data["spans"].items():
+        lines.append(f'wmu_stage_bytes_total{{stage="{name}"}} {s["bytes"]}')
+    histograms = {name: s for name, s in data["spans"].items() if "histogram" in s}
+    if histograms:
+        lines += [
+            "# HELP wmu_latency_seconds Latency histogram per operation (SQL statement types, ...).",
+            "# TYPE wmu_latency_seconds histogram",
+        ]
+        for name, s in histograms.items():
+            for bound, count in s["histogram"].items():
+                lines.append(f'wmu_latency_seconds_bucket{{op="{name}",le="{bound}"}} {count}')
+            lines.append(f'wmu_latency_seconds_sum{{op="{name}"}} {s["total_s"]}')
+            lines.append(f'wmu_latency_seconds_count{{op="{name}"}} {s["count"]}')
+    lines += [
+        "# HELP wmu_run_count Run-level counters (wafers, errors, ...).",
+        "# TYPE wmu_run_count gauge",
+    ]
+    for name, value in sorted(data["counters"].items()):
+        lines.append(f'wmu_run_count{{name="{name}"}} {value}')
+    lines += [
+        "# HELP wmu_run_duration_seconds Duration of the last run.",
+        "# TYPE wmu_run_duration_seconds gauge",
+        f'wmu_run_duration_seconds {data["run_duration_s"]}',
+        "# HELP wmu_run_last_timestamp_seconds End time of the last run.",
+        "# TYPE wmu_run_last_timestamp_seconds gauge",
+        f"wmu_run_last_timestamp_seconds {int(time.time())}",
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def write_run_metrics(out_dir, run_id):
+    """
+    Write metrics_<run_id>.json (one per run) and wafermap_uploader.prom
+    (Prometheus textfile format, replaced each run so the textfile
+    collector never sees stale duplicate series).
+    Returns the JSON path.
+    """
+    data = summary()
+    os.makedirs(out_dir, exist_ok=True)
+
+    json_path = os.path.join(out_dir, f"metrics_{run_id}.json")
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+
+    prom_path = os.path.join(out_dir, PROM_FILENAME)
+    tmp_path = prom_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8", newline="\n") as f:
+        f.write(_prometheus_text(data))
+    os.replace(tmp_path, prom_path)
+
+    log.info(f"[METRICS] Run metrics saved to {json_path}")
+    return json_path
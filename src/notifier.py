@@ -0,0 +1,230 @@
+# notifier.py
+import atexit
+import logging
+import mimetypes
+import os
+import queue
+import smtplib
+import threading
+import time
+from datetime import datetime
+from email.message import EmailMessage
+from typing import NamedTuple
+
+from configs import (
+    MAIL_TRANSPORT, MAIL_FROM, SMTP_HOST, SMTP_PORT, SMTP_USERPWD, SMTP_STARTTLS, MAIL_OUTBOX_DIR,
+    MAIL_RETRIES, MAIL_FLUSH_TIMEOUT,
+)
+
+log = logging.getLogger(__name__)
+
+# ============================================================
+# Run notifications
+# The product threads add their results to a RunDigest; at the end of the
+# run the digest mails (mailer.build_digest_mails) are queued on the Notifier,
+# whose background thread does the sending, so a slow or hung mail
+# transport never holds up the upload pipeline. Transports:
+#   outlook : Outlook COM on the notifier thread (Windows, production)
+#   smtp    : any SMTP relay (SMTP_HOST / SMTP_PORT)
+#   file    : .eml files in MAIL_OUTBOX_DIR (tests / dry runs)
+# ============================================================
+
+
+class Mail(NamedTuple):
+    subject: str
+    html: str
+    to: list
+    cc: list
+    attachments: list
+
+
+class RunDigest:
+    """Per-run product results, shared by the subcon threads."""
+
+    def __init__(self, run_id):
+        self.run_id = run_id
+        self.results = []   # {"product", "lots", "total_wafers", "uploaded_wafers", "db_update_count", "errors", "attachments"}
+        self._lock = threading.Lock()
+
+    def add(self, product, lots, total_wafers, uploaded_wafers, db_update_count, errors, attachments=()):
+        with self._lock:
+            self.results.append({
+                "product": product,
+                "lots": list(dict.fromkeys(lots)),
+                "total_wafers": total_wafers,
+                "uploaded_wafers": uploaded_wafers,
+                "db_update_count": db_update_count,
+                "errors": errors,
+                "attachments": [a for a in attachments if a],
+            })
+
+
+# -------------------------
+# Transports
+# -------------------------
+def to_email_message(mail, sender=MAIL_FROM):
+    msg = EmailMessage()
+    msg["Subject"] = mail.subject
+    msg["From"] = sender
+    msg["To"] = ", ".join(mail.to)
+    if mail.cc:
+        msg["Cc"] = ", ".join(mail.cc)
+    msg.set_content("This message is in HTML format.")
+    msg.add_alternative(mail.html, subtype="html")
+    for path in mail.attachments:
+        if not os.path.exists(path):
+            log.warning(f"[MAIL] WARNING: Attachment not found or missing: {path}")
+            continue
+        ctype, _ = mimetypes.guess_type(path)
+        maintype, subtype = (ctype or "application/octet-stream").split("/", 1)
+        with open(path, "rb") as f:
+            msg.add_attachment(f.read(), maintype=maintype, subtype=subtype, filename=os.path.basename(path))
+    return msg
+
+
+class OutlookTransport:
+    """Outlook COM; Dispatch once, on the notifier thread (COM is initialised per thread)."""
+
+    def __init__(self):
+        self._outlook = None
+
+    def send(self, mail):
+        if self._outlook is None:
+            import pythoncom  # Windows only; imported lazily so the pipeline loads elsewhere
+            import win32com.client
+            pythoncom.CoInitialize()
+            self._outlook = win32com.client.Dispatch("Outlook.Application")
+        item = self._outlook.CreateItem(0)  # MailItem
+        item.Subject = mail.subject
+        item.HTMLBody = mail.html
+        item.To = ";".join(mail.to)
+        if mail.cc:
+            item.CC = ";".join(mail.cc)
+        for path in mail.attachments:
+            if os.path.exists(path):
+                log.debug(f"[MAIL] Attaching file: {path}")
+                item.Attachments.Add(path)
+            else:
+                log.warning(f"[MAIL] WARNING: Attachment not found or missing: {path}")
+        item.Send()
+
+
+class SmtpTransport:
+    def __init__(self, host=SMTP_HOST, port=SMTP_PORT, userpwd=SMTP_USERPWD, starttls=SMTP_STARTTLS,
+                 sender=MAIL_FROM):
+        self.host = host
+        self.port = port
+        self.userpwd = userpwd
+        self.starttls = starttls
+        self.sender = sender
+
+    def send(self, mail):
+        msg = to_email_message(mail, self.sender)
+        with smtplib.SMTP(self.host, self.port, timeout=60) as smtp:
+            if self.starttls:
+                smtp.starttls()
+            if self.userpwd:
+                user, _, password = self.userpwd.partition(":")
+                smtp.login(user, password)
+            smtp.send_message(msg)
+
+
+class FileTransport:
+    """Writes each mail to <out_dir>/mail_<timestamp>_<n>.eml."""
+
+    def __init__(self, out_dir=MAIL_OUTBOX_DIR, sender=MAIL_FROM):
+        self.out_dir = out_dir
+        self.sender = sender
+        self.sent = 0
+
+    def send(self, mail):
+        os.makedirs(self.out_dir, exist_ok=True)
+        self.sent += 1
+        path = os.path.join(self.out_dir, f"mail_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{self.sent}.eml")
+        with open(path, "wb") as f:
+            f.write(bytes(to_email_message(mail, self.sender)))
+        log.debug(f"[MAIL] Written to {path}")
+
+
+TRANSPORTS = {"outlook": OutlookTransport, "smtp": SmtpTransport, "file": FileTransport}
+
+
+def make_transport(name=MAIL_TRANSPORT):
+    try:
+        return TRANSPORTS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown mail transport {name!r} (expected one of {', '.join(TRANSPORTS)})") from None
+
+
+# -------------------------
+# Background sender
+# -------------------------
+class Notifier:
+    """
+    Queue of mails sent one by one by a daemon thread.
+        notifier.submit(mail)     -> returns immediately
+        notifier.flush(timeout)   -> wait until the queue is empty (process exit)
+    A failed send is retried MAIL_RETRIES times, then logged and dropped.
+    """
+
+    def __init__(self, transport=None, retries=MAIL_RETRIES):
+        self.transport = transport or make_transport()
+        self.retries = retries
+        self.sent = 0
+        self.failed = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="notifier", daemon=True)
+        self._thread.start()
+
+    def submit(self, mail):
+        self._queue.put(mail)
+        log.info(f"[MAIL] Queued: {mail.subject}")
+
+    def flush(self, timeout=MAIL_FLUSH_TIMEOUT):
+        """True once every queued mail has been handled, False on timeout."""
+        deadline = time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    log.warning(f"[MAIL] {self._queue.unfinished_tasks} mail(s) still unsent after {timeout}s")
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def _run(self):
+        while True:
+            mail = self._queue.get()
+            try:
+                self._send(mail)
+            finally:
+                self._queue.task_done()
+
+    def _send(self, mail):
+        for attempt in range(1, self.retries + 1):
+            try:
+                self.transport.send(mail)
+                self.sent += 1
+                log.info(f"[MAIL] Sent ({type(self.transport).__name__}): {mail.subject}")
+                return
+            except Exception as e:
+                if attempt == self.retries:
+                    self.failed += 1
+                    log.error(f"[MAIL] Giving up on '{mail.subject}' after {attempt} attempt(s): {e}")
+                    return
+                log.warning(f"[MAIL] Send attempt {attempt} failed: {e}")
+                time.sleep(attempt * 5)  # simple backoff
+
+
+_notifier = None
+_notifier_lock = threading.Lock()
+
+
+def get_notifier():
+    """Process-wide Notifier, started on first use; pending mails are flushed at exit."""
+    global _notifier
+    with _notifier_lock:
+        if _notifier is None:
+            _notifier = Notifier()
+            atexit.register(_notifier.flush)
+        return _notifier
@@ -0,0 +1,113 @@
+# profiler.py
+import cProfile
+import io
+import logging
+import os
+import pstats
+import re
+import tracemalloc
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+TOP_N = 30
+
+# Pipeline entry points summarised at the top of every profile report.
+# cProfile only sees the product's own thread: NAS staging threads, the
+# conversion processes and the async runner's step threads are not in the
+# profile, so their work is listed by what the product thread waits on
+# (convert_wafer / take, run_backlog) instead of stage_zip / convert_bytes.
+NOT_PROFILED = "Not profiled: NAS staging threads, conversion worker processes, async runner step threads " \
+               "(their time shows up as waits in convert_wafer / take / run_backlog)"
+HOTSPOT_FUNCTIONS = [
+    ("main.py", "run_main_for_product"),
+    ("scanner.py", "scan_maps"),
+    ("db.py", "is_wafer_uploaded"),
+    ("db.py", "get_factory_info"),
+    ("utils.py", "wait_until_stable"),
+    ("main.py", "convert_wafer"),
+    ("converter.py", "take"),
+    ("aio_runner.py", "run_backlog"),
+    ("ftp_client.py", "upload"),
+    ("ftp_client.py", "verify"),
+    ("db.py", "upsert_upload"),
+    ("utils.py", "html_diff"),
+]
+
+
+def _hotspot_table(stats):
+    """Cumulative time of the pipeline entry points, largest first."""
+    rows = []
+    for (filename, _, funcname), (_, ncalls, _, cumtime, _) in stats.stats.items():
+        for module, name in HOTSPOT_FUNCTIONS:
+            if funcname == name and os.path.basename(filename) == module:
+                rows.append((cumtime, ncalls, f"{module}:{name}"))
+    rows.sort(reverse=True)
+
+    total = stats.total_tt or 1.0
+    lines = [f"{'function':<40}{'calls':>8}{'cum s':>12}{'% run':>8}"]
+    for cumtime, ncalls, label in rows:
+        lines.append(f"{label:<40}{ncalls:>8}{cumtime:>12.3f}{cumtime / total * 100:>7.1f}%")
+    return "\n".join(lines)
+
+
+@contextmanager
+def profile_section(tag, out_dir, run_id, trace_memory=False, top_n=TOP_N):
+    """
+    Profile a block with cProfile (and optionally tracemalloc).
+    Writes next to the run log:
+        profile_<run_id>_<tag>.pstats   (load with pstats / snakeviz)
+        profile_<run_id>_<tag>.txt      (hotspots + top-N by cumulative and own time)
+    """
+    safe_tag = re.sub(r"[^A-Za-z0-9_.-]", "_", tag)
+    base = os.path.join(out_dir, f"profile_{run_id}_{safe_tag}")
+    os.makedirs(out_dir, exist_ok=True)
+
+    started_tracemalloc = False
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start(10)
+        started_tracemalloc = True
+    if trace_memory:
+        tracemalloc.reset_peak()
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+
+        memory_report = ""
+        if trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            if started_tracemalloc:
+                tracemalloc.stop()
+            top = snapshot.statistics("lineno")[:top_n]
+            memory_report = "\n".join(
+                [f"Traced memory: current {current / 1024 / 1024:.1f} MB, peak {peak / 1024 / 1024:.1f} MB",
+                 f"Top {len(top)} allocation sites:"]
+                + [f"  {stat}" for stat in top]
+            )
+
+        profiler.dump_stats(base + ".pstats")
+
+        stream = io.StringIO()
+        stats = pstats.Stats(profiler, stream=stream)
+        stats.strip_dirs()
+        stream.write(f"Profile: {tag}  (run {run_id})\n")
+        stream.write(f"Total profiled time: {stats.total_tt:.3f}s\n\n")
+        stream.write("Pipeline hotspots (cumulative)\n")
+        stream.write(_hotspot_table(stats) + "\n")
+        stream.write(NOT_PROFILED + "\n\n")
+        stream.write(f"Top {top_n} by cumulative time\n")
+        stats.sort_stats("cumulative").print_stats(top_n)
+        stream.write(f"Top {top_n} by own time\n")
+        stats.sort_stats("tottime").print_stats(top_n)
+        if memory_report:
+            stream.write("\n" + memory_report + "\n")
+
+        with open(base + ".txt", "w", encoding="utf-8") as f:
+            f.write(stream.getvalue())
+
+        log.info(f"[PROFILE] {tag}: {base}.pstats / .txt")
@@ -0,0 +1,133 @@
+# retry.py
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+
+from configs import WAFER_MAX_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY, RUN_ERROR_BUDGET
+
+log = logging.getLogger(__name__)
+
+
+# -------------------------
+# Exceptions
+# -------------------------
+class WaferFailed(Exception):
+    """One wafer failed at a pipeline step; the run carries on with the others."""
+
+    def __init__(self, step, message):
+        super().__init__(f"{step}: {message}")
+        self.step = step
+
+
+class ErrorBudgetExceeded(Exception):
+    """Too many failures in one run: stop instead of hammering a broken FTP / DB."""
+
+
+# -------------------------
+# Backoff
+# -------------------------
+def backoff_delay(attempt, base=RETRY_BASE_DELAY, cap=RETRY_MAX_DELAY, rng=random):
+    """
+    Exponential backoff with "equal jitter": half of base * 2^(attempt-1)
+    is fixed, the other half random, so retries of wafers that failed
+    together (FTP blip) do not all hit the server at the same moment.
+    """
+    delay = min(cap, base * 2 ** (attempt - 1))
+    return delay / 2 + rng.uniform(0, delay / 2)
+
+
+class RetryQueue:
+    """
+    Wafers waiting for another attempt, ordered by due time.
+        delay = queue.push(item, attempt)   # None once max_attempts is used up
+        item, attempt = queue.pop_due()     # None if nothing is due yet
+    """
+
+    def __init__(self, max_attempts=WAFER_MAX_ATTEMPTS, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._heap = []
+        self._seq = itertools.count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, item, attempt):
+        """Schedule attempt + 1. Returns the delay in seconds, or None when giving up."""
+        if attempt >= self.max_attempts:
+            return None
+        delay = backoff_delay(attempt, self.base_delay, self.max_delay)
+        heapq.heappush(self._heap, (time.monotonic() + delay, next(self._seq), item, attempt + 1))
+        return delay
+
+    def pop_due(self):
+        if self._heap and self._heap[0][0] <= time.monotonic():
+            _, _, item, attempt = heapq.heappop(self._heap)
+            return item, attempt
+        return None
+
+    def pop_next(self):
+        """Wait for the earliest retry and return it."""
+        due, _, item, attempt = heapq.heappop(self._heap)
+        wait = due - time.monotonic()
+        if wait > 0:
+            log.info(f"[RETRY] Waiting {wait:.1f}s for the next retry ({len(self._heap) + 1} queued)")
+            time.sleep(wait)
+        return item, attempt
+
+    def drain(self):
+        """Remove and return the queued items (run stopped before their retry)."""
+        items = [item for _, _, item, _ in sorted(self._heap)]
+        self._heap.clear()
+        return items
+
+
+# -------------------------
+# Run error budget + failed wafer summary
+# -------------------------
+class ErrorBudget:
+    """
+    Shared by all products of one run. Every failed attempt is charged;
+    once more than `limit` have failed the run is aborted.
+    Wafers that used up all their attempts are kept for the summary.
+    """
+
+    def __init__(self, limit=RUN_ERROR_BUDGET):
+        self.limit = limit
+        self.used = 0
+        self.failed_wafers = []   # {"product", "wafer", "step", "error", "attempts"}
+        self._lock = threading.Lock()
+
+    def charge(self, what):
+        with self._lock:
+            self.used += 1
+            used = self.used
+        if used > self.limit:
+            raise ErrorBudgetExceeded(f"{used} failures this run (budget {self.limit}), last: {what}")
+
+    def exhausted(self):
+        """True once the run has been aborted (other subcon groups stop at the next product)."""
+        return self.used > self.limit
+
+    def give_up(self, product, wafer, step, error, attempts):
+        with self._lock:
+            self.failed_wafers.append({
+                "product": product,
+                "wafer": wafer,
+                "step": step,
+                "error": str(error),
+                "attempts": attempts,
+            })
+
+    def failed_products(self):
+        return {f["product"] for f in self.failed_wafers}
+
+    def summary_lines(self):
+        lines = [f"[FAILED] {len(self.failed_wafers)} wafer(s) not uploaded this run:"]
+        for f in self.failed_wafers:
+            lines.append(f"    {f['product']} | {f['wafer']} | {f['step']} after {f['attempts']} attempt(s): {f['error']}")
+        return lines
@@ -1,13 +1,15 @@
 # scanner.py
+import io
 import os
+import logging
+import time
 import zipfile
-from configs import PRODUCT_CONFIG
-import sys
+from datetime import datetime
+from configs import PRODUCT_CATALOG
+import metrics
+
+log = logging.getLogger(__name__)
 
-DEVICE_TO_PRODUCT = PRODUCT_CONFIG["_device_to_product"]
-# -------------------------
-# Map wafer DEVICE_NAME to product
-# -------------------------
 
 def extract_wafer_from_filename(filename: str, subcon):
     """
@@ -66,6 +68,45 @@ def extract_stage_from_zip(zip_name):
     return "UNKNOWN"
 
 
+def extract_timestamp_from_zip(zip_name):
+    """
+    Delivery timestamp in the ZIP name (None if missing or malformed).
+    zip filename = DKJR5.1_CP1_2021_08_23_08_34_47.map.zip #GTK
+                   QTGAQ_CP1_2025_7_9_10_10_00.map.zip     #ASE
+    returns datetime(2021, 8, 23, 8, 34, 47)
+    """
+    parts = os.path.basename(zip_name).replace(".map.zip", "").split("_")
+    if len(parts) < 8:
+        return None
+    try:
+        return datetime.strptime("_".join(parts[2:8]), "%Y_%m_%d_%H_%M_%S")
+    except ValueError:
+        return None
+
+
+def latest_deliveries(wafermaps):
+    """
+    OSATs re-deliver a lot/stage as a new ZIP with a newer timestamp.
+    Keep only the newest delivery per (product, lot, wafer, stage); ZIPs
+    without a timestamp count as oldest, ties go to the later ZIP name.
+    wafermaps: scan results with zip_file / product / lot / wafer / stage
+    returns (latest, superseded), latest in the original scan order
+    """
+    def delivery(w):
+        return (extract_timestamp_from_zip(w["zip_file"]) or datetime.min, w["zip_file"])
+
+    newest = {}
+    for w in wafermaps:
+        key = (w["product"], w["lot"], int(w["wafer"]), w["stage"])
+        if key not in newest or delivery(w) > delivery(newest[key]):
+            newest[key] = w
+
+    keep = {id(w) for w in newest.values()}
+    latest = [w for w in wafermaps if id(w) in keep]
+    superseded = [w for w in wafermaps if id(w) not in keep]
+    return latest, superseded
+
+
 def extract_wafer_from_txt(wafer_id):
     """
     Example:
@@ -81,6 +122,32 @@ def extract_wafer_from_txt(wafer_id):
     return wafer_part
 
 
+def read_header(f, subcon):
+    """
+    (device_name, wafer_id) from the top of a map member, read line by line
+    from the decompressing stream; stops as soon as both are known, so the
+    wafer map rows below the header are never decompressed or decoded.
+    GTK: DEVICE_NAME= / WAFER_ID= keys; ASE: the "Device Name" line (no wafer id).
+    """
+    device_name = None
+    wafer_id = None
+    for line in io.TextIOWrapper(f, encoding="utf-8", errors="ignore"):
+        if subcon == "GTK":
+            if "=" in line:
+                k, v = line.split("=", 1)
+                k = k.strip()
+                if k == "DEVICE_NAME":
+                    device_name = v.strip()
+                elif k == "WAFER_ID":
+                    wafer_id = v.strip()
+                if device_name is not None and wafer_id is not None:
+                    break
+        elif "Device Name" in line: #ASE
+            device_name = line.rstrip("\r\n").split(":")[-1].strip(" ")
+            break
+    return device_name, wafer_id
+
+
 def scan_maps(zip_path, unsupported_log = None, subcon =""):
     """
     Scan a single ZIP file.
@@ -92,8 +159,26 @@ def scan_maps(zip_path, unsupported_log = None, subcon =""):
         wafer,
         stage,
         product
-    """
 
+    Time spent inside the scan (not in the caller between yields) is
+    recorded as the "scan_zip" metric.
+    """
+    stats = {"bytes": 0}
+    busy = 0.0
+    start = time.perf_counter()
+    try:
+        for item in _scan_maps(zip_path, unsupported_log, subcon, stats):
+            busy += time.perf_counter() - start
+            start = None
+            yield item
+            start = time.perf_counter()
+    finally:
+        if start is not None:
+            busy += time.perf_counter() - start
+        metrics.observe("scan_zip", busy, stats["bytes"])
+
+
+def _scan_maps(zip_path, unsupported_log, subcon, stats):
     fname = os.path.basename(zip_path)
 
     # -------------------------
@@ -110,25 +195,15 @@ def scan_maps(zip_path, unsupported_log = None, subcon =""):
                 if not info.filename.lower().endswith(".txt"):
                     continue
                 with zf.open(info) as f:
-                    lines = f.read().decode("utf-8", errors="ignore").splitlines()
-                txt = {}
-                if subcon == "GTK":
-                    for line in lines:
-                        if "=" in line:
-                            k, v = line.split("=", 1)
-                            txt[k.strip()] = v.strip()
-                    device_name = txt.get("DEVICE_NAME")
-                    wafer_id = txt.get("WAFER_ID")
-                else: #ASE
-                    for line in lines:
-                        if "Device Name" in line:
-                            device_name = line.split(":")[-1].strip(" ")
+                    device_name, wafer_id = read_header(f, subcon)
+                stats["bytes"] += info.compress_size
                 # -------------------------
                 # Map device to product
                 # -------------------------
-                product = DEVICE_TO_PRODUCT.get(device_name)
+                product = PRODUCT_CATALOG.device_product(device_name)
                 if not product:
-                    unsupported_devices.add(device_name)
+                    if device_name:
+                        unsupported_devices.add(device_name)
                     #print(f"[SCAN] Product {device_name} not supported in product_config")
                     break
                 # -------------------------
@@ -149,8 +224,8 @@ def scan_maps(zip_path, unsupported_log = None, subcon =""):
                     product,
                 )
     except zipfile.BadZipFile:
-        print(f"[SCANNER] Warning: Bad ZIP skipped: {zip_path}")
-        sys.exit(1)  # stop script immediately
+        log.error(f"[SCANNER] Warning: Bad ZIP skipped: {zip_path}")
+        raise  # caller counts it and moves on to the next ZIP
 
     # -------------------------
     # Write unsupported devices
@@ -0,0 +1,96 @@
+# scheduler.py
+import logging
+import threading
+import time
+from datetime import datetime
+
+from configs import SCHEDULE_ORDER, HOT_LOTS, PRODUCT_QUOTAS, RUN_TIME_BUDGET
+from scanner import extract_timestamp_from_zip
+
+log = logging.getLogger(__name__)
+
+# ============================================================
+# Backlog scheduling
+# Sits between the scan and the per-wafer pipeline: each product's
+# NOT_UPLOADED wafers are ordered (hot lots first, then oldest delivery
+# or NAS order) and cut to the product's quota. The run's time budget is
+# checked before every wafer and before every product, so a constrained
+# run stops at a wafer boundary with the most important uploads done.
+# Whatever is deferred stays NOT_UPLOADED and is picked up by the next run.
+# ============================================================
+ORDERS = ("oldest", "scan")
+
+
+def delivery_time(wafermap):
+    """Delivery timestamp of the wafer's ZIP; ZIPs without one count as oldest."""
+    return extract_timestamp_from_zip(wafermap["zip_file"]) or datetime.min
+
+
+class RunSchedule:
+    """
+    Shared by the subcon threads of one run.
+        scheduled, deferred = schedule.plan(product, wafermaps)
+        schedule.expired()  -> True once the time budget is used up
+    """
+
+    def __init__(self, order=SCHEDULE_ORDER, hot_lots=HOT_LOTS, quotas=PRODUCT_QUOTAS, time_budget=RUN_TIME_BUDGET):
+        if order not in ORDERS:
+            raise ValueError(f"Unknown schedule order {order!r} (expected one of {', '.join(ORDERS)})")
+        self.order = order
+        self.hot_lots = {lot.split(".")[0]: index for index, lot in enumerate(hot_lots)}
+        self.quotas = dict(quotas)
+        self.time_budget = time_budget * 60     # minutes -> seconds, 0 = no limit
+        self.deferred = {}          # product -> wafers left for the next run
+        self.not_started = []       # products the time budget did not reach
+        self._deadline = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        self._deadline = time.monotonic() + self.time_budget if self.time_budget else None
+
+    def expired(self):
+        return self._deadline is not None and time.monotonic() >= self._deadline
+
+    # -------------------------
+    # Per product
+    # -------------------------
+    def sort_key(self, wafermap):
+        hot = self.hot_lots.get(wafermap["lot"].split(".")[0])
+        rank = (0, hot) if hot is not None else (1, 0)
+        if self.order == "oldest":
+            return rank, delivery_time(wafermap)
+        return rank, datetime.min      # stable sort keeps the scan order
+
+    def plan(self, product, wafermaps):
+        """(scheduled, deferred): wafermaps in processing order, cut to the product's quota."""
+        ordered = sorted(wafermaps, key=self.sort_key)
+        quota = self.quotas.get(product)
+        if quota is None or len(ordered) <= quota:
+            return ordered, []
+        self.defer(product, len(ordered) - quota)
+        return ordered[:quota], ordered[quota:]
+
+    def defer(self, product, count):
+        with self._lock:
+            self.deferred[product] = self.deferred.get(product, 0) + count
+
+    def skip_product(self, product):
+        with self._lock:
+            self.not_started.append(product)
+
+    # -------------------------
+    # Run summary
+    # -------------------------
+    def deferred_products(self):
+        """Products with wafers left for the next run (cut by quota / time budget, or not started)."""
+        return [p for p in self.deferred if self.deferred[p]] + \
+            [p for p in self.not_started if p not in self.deferred]
+
+    def summary_lines(self):
+        lines = []
+        for product, count in self.deferred.items():
+            if count:
+                lines.append(f"[SCHEDULE] {product}: {count} wafer(s) deferred to the next run")
+        if self.not_started:
+            lines.append(f"[SCHEDULE] Time budget used up, not started: {', '.join(self.not_started)}")
+        return lines
@@ -0,0 +1,151 @@
+# service.py
+import logging
+import threading
+import time
+
+from configs import PRODUCT_CONFIG, SERVICE_POLL_INTERVAL, SERVICE_FULL_SWEEP_EVERY, CONVERT_WORKERS, set_nas_dir
+from converter import ConversionPool
+from inventory import scan_zips
+
+log = logging.getLogger(__name__)
+
+# -------------------------
+# Service mode
+#   python main.py --service [--interval 300] [PRODUCT ...]
+# Stays resident: the DB engine pool and the FTP curl handles stay warm,
+# the NAS MAP directories are polled, and only new or changed ZIPs are
+# scanned. Every SERVICE_FULL_SWEEP_EVERY polls a full sweep picks up
+# anything left NOT_UPLOADED (skipped while copying, failed uploads).
+# -------------------------
+
+
+def snapshot_dir(nas_dir):
+    """{zip name: (size, mtime_ns)} for the ZIPs in a NAS MAP directory."""
+    return {name: (e.size, e.mtime_ns) for name, e in scan_zips(nas_dir).items()}
+
+
+class NasWatcher:
+    """
+    Tracks one NAS MAP directory between polls.
+    A ZIP is "ready" once it is new/changed compared to the last processed
+    state and has settled: same size/mtime as the previous poll, or not
+    modified for a full poll interval (OSAT copies still in progress wait).
+    """
+
+    def __init__(self, nas_dir, settle_seconds):
+        self.nas_dir = nas_dir
+        self.settle_seconds = settle_seconds
+        self.processed = {}   # name -> signature when last processed
+        self.last_poll = {}   # name -> signature at the previous poll
+
+    def poll(self, full=False):
+        """Return {name: signature} of ZIPs to process (full=True: every settled ZIP)."""
+        current = snapshot_dir(self.nas_dir)
+        now_ns = time.time_ns()
+        ready = {}
+        for name, sig in current.items():
+            if not full and self.processed.get(name) == sig:
+                continue
+            settled = (
+                self.last_poll.get(name) == sig
+                or now_ns - sig[1] >= self.settle_seconds * 1_000_000_000
+            )
+            if settled:
+                ready[name] = sig
+        self.last_poll = current
+        # Forget ZIPs that were removed from the NAS
+        self.processed = {n: s for n, s in self.processed.items() if n in current}
+        return ready
+
+    def mark_processed(self, ready):
+        self.processed.update(ready)
+
+
+def products_by_nas_dir(products):
+    """Group products by the NAS MAP directory of their subcon."""
+    groups = {}
+    for product in products:
+        cfg = PRODUCT_CONFIG.get(product)
+        if not cfg or "subcon" not in cfg:
+            log.warning(f"[SERVICE] Unknown product skipped: {product}")
+            continue
+        groups.setdefault(set_nas_dir(cfg["subcon"]), []).append(product)
+    return groups
+
+
+def run_service(products, run_main, interval=SERVICE_POLL_INTERVAL, full_sweep_every=SERVICE_FULL_SWEEP_EVERY,
+                stop_event=None, max_polls=None):
+    """
+    Poll and process until stop_event is set (or Ctrl+C).
+    run_main : main.run_main (passed in, main.py is usually __main__)
+    max_polls: stop after N polls (dry runs / benchmarks).
+    """
+    stop_event = stop_event or threading.Event()
+    groups = products_by_nas_dir(products)
+    if not groups:
+        log.error("[SERVICE] No products to watch")
+        return
+
+    watchers = {nas_dir: NasWatcher(nas_dir, interval) for nas_dir in groups}
+    ftp_clients = {}   # one FTPClient per subcon, kept open across polls (filled by run_main)
+    converter = ConversionPool() if CONVERT_WORKERS > 1 else None   # workers stay up between polls
+    log.info(f"[SERVICE] Watching {len(watchers)} NAS dir(s) every {interval}s for: {', '.join(products)}")
+
+    poll_no = 0
+    try:
+        while not stop_event.is_set():
+            full = poll_no % full_sweep_every == 0   # first poll is always a full sweep
+            poll_no += 1
+            poll_once(run_main, groups, watchers, ftp_clients, converter, full)
+            if max_polls and poll_no >= max_polls:
+                break
+            stop_event.wait(interval)
+    except KeyboardInterrupt:
+        log.info("[SERVICE] Stopped by user")
+    finally:
+        for ftp in ftp_clients.values():
+            ftp.close()
+        if converter is not None:
+            converter.close()
+        log.info("[SERVICE] Service stopped")
+
+
+def poll_once(run_main, groups, watchers, ftp_clients, converter, full):
+    """One poll: snapshot every NAS dir and run the affected products."""
+    run_products = []
+    zip_filters = {}
+    ready_by_dir = {}
+
+    for nas_dir, dir_products in groups.items():
+        try:
+            ready = watchers[nas_dir].poll(full=full)
+        except OSError as e:
+            log.error(f"[SERVICE] Cannot list {nas_dir}: {e}")
+            continue
+        if not ready:
+            continue
+        ready_by_dir[nas_dir] = ready
+        for product in dir_products:
+            run_products.append(product)
+            if not full:
+                zip_filters[product] = set(ready)
+
+    if not run_products:
+        log.debug("[SERVICE] No new or changed ZIPs")
+        return
+
+    changed = sum(len(r) for r in ready_by_dir.values())
+    log.info(f"[SERVICE] {'Full sweep' if full else 'Changed ZIPs'}: {changed}, products: {', '.join(run_products)}")
+
+    try:
+        failed = set(run_main(run_products, ftp_clients=ftp_clients, zip_filters=zip_filters, converter=converter))
+    except Exception as e:
+        # Keep the service alive; the ZIPs stay unprocessed and are retried next poll
+        log.exception(f"[SERVICE] Run aborted: {e!r}")
+        return
+
+    for nas_dir, ready in ready_by_dir.items():
+        if failed.intersection(groups[nas_dir]):
+            log.warning(f"[SERVICE] {nas_dir}: will retry {len(ready)} ZIP(s) next poll")
+            continue
+        watchers[nas_dir].mark_processed(ready)
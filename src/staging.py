@@ -0,0 +1,131 @@
+# staging.py
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import zipfile
+
+from configs import STAGE_BUFFER_BYTES, STAGE_RETRIES
+from utils import sha256_file
+import metrics
+
+log = logging.getLogger(__name__)
+
+# ============================================================
+# NAS -> local staging
+# A staged ZIP sits in the workspace stage directory with a sidecar
+#   <zip>.stage.json = {"size", "mtime_ns", "sha256"}   (of the NAS file)
+# and is reused, by this or a later run, while the NAS file still has the
+# same size and mtime. Copies go through a .part file with large buffers,
+# are hashed while copying, checked against the hash of what landed on
+# disk, and only renamed into place once the ZIP central directory reads.
+# ============================================================
+META_SUFFIX = ".stage.json"
+
+
+class StagingError(Exception):
+    """The staged copy could not be made or does not match the NAS file."""
+
+
+def meta_path(dst):
+    return dst + META_SUFFIX
+
+
+def read_meta(dst):
+    try:
+        with open(meta_path(dst), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_staged(size, mtime_ns, dst):
+    """True if dst is a finished staged copy of a NAS file with this size + mtime."""
+    meta = read_meta(dst)
+    if not meta or meta.get("size") != size or meta.get("mtime_ns") != mtime_ns:
+        return False
+    try:
+        return os.path.getsize(dst) == size
+    except OSError:
+        return False
+
+
+def copy_hashed(src, dst_part, buffer_size=STAGE_BUFFER_BYTES):
+    """Copy src to dst_part with one reusable buffer; returns the SHA256 of the bytes read."""
+    h = hashlib.sha256()
+    buf = bytearray(buffer_size)
+    view = memoryview(buf)
+    with open(src, "rb", buffering=0) as fin, open(dst_part, "wb", buffering=0) as fout:
+        while True:
+            n = fin.readinto(buf)
+            if not n:
+                break
+            chunk = view[:n]
+            h.update(chunk)
+            fout.write(chunk)
+    return h.hexdigest()
+
+
+def validate_zip(path):
+    """Read the central directory; raises zipfile.BadZipFile if it is missing or points past the end."""
+    size = os.path.getsize(path)
+    with zipfile.ZipFile(path, "r") as zf:
+        infos = zf.infolist()
+    if not infos:
+        raise zipfile.BadZipFile("no members")
+    for info in infos:
+        if info.header_offset + info.compress_size > size:
+            raise zipfile.BadZipFile(f"{info.filename} extends past the end of the file")
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def stage_zip(src, dst, src_stat=None, retries=STAGE_RETRIES):
+    """
+    Stage one NAS ZIP at dst. Returns True if a copy was made, False if a
+    matching staged copy was reused. Raises StagingError, or
+    zipfile.BadZipFile when the NAS file itself is not a readable ZIP.
+    src_stat: fresh os.stat of src (e.g. from the stability check)
+    """
+    before = src_stat or os.stat(src)
+    if is_staged(before.st_size, before.st_mtime_ns, dst):
+        metrics.incr("stage_reused")
+        return False
+
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    part = f"{dst}.{os.getpid()}.{threading.get_ident()}.part"
+    for attempt in range(1, retries + 1):
+        try:
+            with metrics.span("stage_copy", nbytes=before.st_size):
+                digest = copy_hashed(src, part)
+            after = os.stat(src)
+            if (after.st_size, after.st_mtime_ns) != (before.st_size, before.st_mtime_ns):
+                raise StagingError("NAS file changed while copying")
+            if os.path.getsize(part) != before.st_size or sha256_file(part) != digest:
+                raise StagingError("staged copy does not match the NAS file")
+            with metrics.span("stage_validate"):
+                validate_zip(part)
+
+            _remove(meta_path(dst))   # never leave a sidecar describing an older copy
+            os.replace(part, dst)
+            with open(meta_path(dst), "w", encoding="utf-8") as f:
+                json.dump({"size": before.st_size, "mtime_ns": before.st_mtime_ns, "sha256": digest}, f)
+            metrics.incr("stage_copied")
+            return True
+        except zipfile.BadZipFile:
+            _remove(part)
+            raise
+        except (OSError, StagingError) as e:
+            _remove(part)
+            if attempt == retries:
+                raise StagingError(f"{os.path.basename(src)}: {e}") from e
+            log.debug(f"[STAGE] Attempt {attempt} failed for {os.path.basename(src)}: {e}")
+            time.sleep(attempt)  # simple backoff
+            before = os.stat(src)
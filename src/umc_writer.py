@@ -1,6 +1,10 @@
 # umc_writer.py
 import os
+import locale
+import logging
+import mmap
 import re
+from contextlib import closing, contextmanager
 from string import Template, digits
 from configs import (
     ROOT_DIR, PRODUCT_CONFIG
@@ -12,6 +16,8 @@ from utils import (
     format_zip_timestamp_for_filename
 )
 
+log = logging.getLogger(__name__)
+
 
 # ------------------------
 # UMC wafer header template
@@ -57,111 +63,139 @@ def extract_notch(flat):
     return m.group(1) if m else flat
 
 
-def process_wafer_GTK(lot, wafer, filename, product, stage, zip_timestamp=None, factory_info=None):
-
+# ============================================================
+# Raw map input
+# A wafer map is read from one byte buffer (the mmap of the extracted
+# file, or the bytes a conversion worker received) and decoded one line
+# at a time from memoryview slices, so no full decoded copy of the map
+# is ever held; only the map rows the parsers keep stay in memory.
+# ============================================================
+@contextmanager
+def map_file(filename):
+    """Read-only mmap of filename (b"" for an empty file)."""
+    with open(filename, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            yield buf
+
+
+def iter_text_lines(buf, encoding=None):
     """
-    Convert wafer map TXT into UMC format.
+    Lines of buf (bytes / bytearray / mmap) as str, like iterating a file
+    opened with open(..., "r", encoding=encoding, errors="ignore"):
+    "\r\n" and "\r" become "\n", None = locale encoding.
     """
-    print(f"[UMC WRITER] Processing file: {filename}")
-    print(f"[UMC WRITER] Stage: {stage}")
-
-
-
-    # ------------------------
-    # Parse wafer TXT
-    # ------------------------
-    wafer_map_lines = []
-    txt = {}
-    with open(filename, "r", errors="ignore") as f:
-        for line in f:
-            if "=" in line:
-                k, v = line.strip().split("=", 1)
-                txt[k.strip()] = v.strip()
-            elif "." in line or "#" in line or "~" in line:
-                wafer_map_lines.append(line)
-    # Extract wafer ID
-    wafer_txt = txt.get("WAFER_ID", "")
-    wafer_part =wafer_txt.split("-")[0] if "-" in wafer_txt else wafer_txt
-    wafer_id =wafer_part[-2:]
-
-    # Extract YIELD from wafermap
-    yield_perc = txt.get("TEST_YIELD", "0%").strip()
-    if not yield_perc.endswith("%"):
-        yield_perc += "%"
+    encoding = encoding or locale.getpreferredencoding(False)
+    view = memoryview(buf)
+    try:
+        size = len(view)
+        pos = 0
+        while pos < size:
+            end = buf.find(b"\n", pos)
+            end = size if end < 0 else end + 1
+            line = str(view[pos:end], encoding, "ignore")
+            pos = end
+            if "\r" in line:
+                yield from line.replace("\r\n", "\n").replace("\r", "\n").splitlines(keepends=True)
+            else:
+                yield line
+    finally:
+        view.release()   # the mmap can only be closed once no view is left
+
+
+# ============================================================
+# Shared stages
+# ============================================================
+def iter_umc(header, soft_bin_lines, soft_bin_map_lines, bin_section_end="\n"):
+    """
+    UMC text in pieces: header, soft-bin section, soft-bin map
+    (written out piece by piece by converter.convert_bytes).
+    """
+    yield umc_wafer_header_data.safe_substitute(**header)
+    for ln in soft_bin_lines:
+        yield ln + "\n"
+    yield bin_section_end
+    for ln in soft_bin_map_lines:
+        yield ln + "\n"
 
 
-    total_test = int(txt.get("TOTAL_TEST", 0))
-    total_pass = int(txt.get("TOTAL_PASS", 0))
-    yield_pct = (total_pass * 100 / total_test) if total_test else 0
-    probing_notch = extract_notch(txt.get("FLAT", ""))
+def render_umc(header, soft_bin_lines, soft_bin_map_lines, bin_section_end="\n"):
+    """
+    Assemble UMC text: header, soft-bin section, soft-bin map.
+    """
+    return "".join(iter_umc(header, soft_bin_lines, soft_bin_map_lines, bin_section_end))
 
-    lot_prefix = lot.split(".")[0]
 
-    product_wildcard = product.split("-")[0]
-    factory_info = factory_info or {}
-    machine = factory_info.get("machine", "")
-    program = factory_info.get("program", "")
-    operator = factory_info.get("operator", "")
-    #operator_class = factory_info.get("Class", "")
-    operator_id = factory_info.get("operator_id", "")
+def umc_filename(lot_prefix, wafer, stage, zip_timestamp):
+    timestamp_filename = format_zip_timestamp_for_filename(zip_timestamp)
+    return f"{lot_prefix}{str(wafer).zfill(2)}_{timestamp_filename}.{stage}.umc"
 
-    cfg = PRODUCT_CONFIG.get(product)
-    if not cfg:
-        raise ValueError(f"Product {product} not found in PRODUCT_CONFIG")
 
-    # ------------------------
-    # Header fields
-    # ------------------------
-    subcon = cfg["subcon"]
-    tester_name = f"{cfg["tester"]} {machine}"
-    test_program = program or cfg["test_program"]
-    load_board = cfg["load_board"]
-    probe_card = cfg["probe_card"]
-    start_time = format_zip_timestamp(zip_timestamp)
-    # ------------------------
-    # Output path
-    # ------------------------
+def umc_output_path(lot_prefix, stage, umc_name):
+    """
+    ROOT_DIR/<lot>/<stage>/<umc_name> (directory created, any old file removed).
+    """
     out_dir = os.path.join(ROOT_DIR, lot_prefix, stage)
-
     mkdir(out_dir)
-    timestamp_filename = format_zip_timestamp_for_filename(zip_timestamp)
-    umc_name = f"{lot_prefix}{str(wafer).zfill(2)}_{timestamp_filename}.{stage}.umc"
     umc_path = os.path.join(out_dir, umc_name)
-    print(umc_path)
+    log.debug(umc_path)
     if os.path.exists(umc_path):
         os.remove(umc_path)
+    return umc_path
 
-    # ------------------------
-    # Generate soft-bin section
-    # ------------------------
-    soft_bins = cfg["soft_bins"]
-    soft_bin_lines = []
 
-    for b, desc in soft_bins:
-        if b > 9:
-            continue  # only convert bins 0-9
+def write_umc(lot_prefix, stage, umc_name, umc_text, encoding=None):
+    """
+    Write UMC text to ROOT_DIR/<lot>/<stage>/<umc_name>, replacing any old file.
+    """
+    umc_path = umc_output_path(lot_prefix, stage, umc_name)
+    with open(umc_path, "w", encoding=encoding) as f:
+        f.write(umc_text)
 
-        # Try to get count from TXT (BIN01(1), BIN02(2), ...)
-        txt_key = f"BIN{str(b).zfill(2)}({b if b <= 9 else chr(64 + b)})"
-        dienum = int(txt.get(txt_key, 0))
+    return umc_path
 
-        # Yield per bin = count / total_test
-        bin_yield = (dienum / total_test * 100) if total_test else 0.0
-        bin_yield_str = f"{bin_yield:.2f}%"
 
-        # Format line
-        line = f"    BIN,      {b}, {dienum:>6}, {bin_yield_str:>6}, {{{desc}}}"
-        soft_bin_lines.append(line)
+def write_umc_bytes(lot_prefix, stage, umc_name, umc_bytes):
+    """
+    Same as write_umc for text already encoded (converter.convert_bytes).
+    """
+    umc_path = umc_output_path(lot_prefix, stage, umc_name)
+    with open(umc_path, "wb") as f:
+        f.write(umc_bytes)
 
+    return umc_path
+
+
+# ============================================================
+# GTK converter stages
+# ============================================================
+def parse_GTK(lines):
+    """
+    Split GTK TXT lines into header fields and raw wafer map rows.
+    Map rows keep their line ending; the trim stage blanks it.
+    """
+    wafer_map_lines = []
+    txt = {}
+    for line in lines:
+        if "=" in line:
+            k, v = line.strip().split("=", 1)
+            txt[k.strip()] = v.strip()
+        elif "." in line or "#" in line or "~" in line:
+            wafer_map_lines.append(line)
+    return txt, wafer_map_lines
 
-    # ------------------------
-    # Convert wafer map to UMC soft bin map format
-    # ------------------------
 
+def trim_map_GTK(wafer_map_lines):
+    """
+    Convert wafer map to UMC soft bin map format and trim empty rows/columns.
+    Returns (map_lines, trimmed_width).
+    """
     map_lines = ["".join(c if c.isalnum() else " " for c in line) for line in wafer_map_lines]
 
     # ------------------------
-    # Step 3: Trim empty rows (rows without alphanum)
+    # Trim empty rows (rows without alphanum)
     # ------------------------
     # Find first and last row with at least one alphanumeric character
     first_row = next(i for i, line in enumerate(map_lines) if any(c.isalnum() for c in line))
@@ -170,7 +204,7 @@ def process_wafer_GTK(lot, wafer, filename, product, stage, zip_timestamp=None,
     map_lines = map_lines[first_row:last_row + 1]
 
     # ------------------------
-    # Step 4: Trim empty columns (columns without alphanum)
+    # Trim empty columns (columns without alphanum)
     # ------------------------
     num_cols = max(len(line) for line in map_lines)
     first_col = next(i for i in range(num_cols) if any((i < len(line) and line[i].isalnum()) for line in map_lines))
@@ -178,94 +212,140 @@ def process_wafer_GTK(lot, wafer, filename, product, stage, zip_timestamp=None,
                                    any((num_cols - 1 - i < len(line) and line[-1 - i].isalnum()) for line in map_lines))
     map_lines = [line[first_col:last_col + 1] for line in map_lines]
 
-    # ------------------------
-    # Step 5: Generate column header for trimmed width
-    # ------------------------
     trimmed_width = last_col - first_col + 1
+    return map_lines, trimmed_width
+
+
+def soft_bin_lines_GTK(soft_bins, txt, total_test):
+    """
+    Soft-bin section, bins 0-9, counts from BINxx(n) header keys.
+    """
+    soft_bin_lines = []
+
+    for b, desc in soft_bins:
+        if b > 9:
+            continue  # only convert bins 0-9
+
+        # Try to get count from TXT (BIN01(1), BIN02(2), ...)
+        txt_key = f"BIN{str(b).zfill(2)}({b if b <= 9 else chr(64 + b)})"
+        dienum = int(txt.get(txt_key, 0))
+
+        # Yield per bin = count / total_test
+        bin_yield = (dienum / total_test * 100) if total_test else 0.0
+        bin_yield_str = f"{bin_yield:.2f}%"
+
+        # Format line
+        line = f"    BIN,      {b}, {dienum:>6}, {bin_yield_str:>6}, {{{desc}}}"
+        soft_bin_lines.append(line)
+
+    return soft_bin_lines
+
+
+def soft_bin_map_GTK(map_lines, trimmed_width):
+    """
+    Column header for trimmed width, row numbers (001,002,...) and trailer.
+    Yields the lines (rows are formatted as they are written, not all at once).
+    """
     col_line0 = "    " + "0" * trimmed_width
     col_line1 = "    " + "".join(str(((i + 1) // 10) % 10) for i in range(trimmed_width))
     col_line2 = "    " + "".join(str((i+1) % 10) for i in range(trimmed_width))
 
-    # ------------------------
-    # Step 6: Add row numbers (001,002,...) and prepare final map
-    # ------------------------
-
-    soft_bin_map_lines = ["[SOFT BIN MAP]", col_line0, col_line1, col_line2]
-    soft_bin_map_lines.append(" ")
+    yield from ["[SOFT BIN MAP]", col_line0, col_line1, col_line2]
+    yield " "
     for row_idx, line in enumerate(map_lines):
         row_number = f"{row_idx + 1:03}"
-        soft_bin_map_lines.append(f"{row_number} {line}")
+        yield f"{row_number} {line}"
 
-    soft_bin_map_lines.append(" ")
-    soft_bin_map_lines.append("[EXTENSION]")
-    soft_bin_map_lines.append(" ")
-    soft_bin_map_lines.append("[EOF]")
-    soft_bin_map_lines.append(" ")
+    yield from [" ", "[EXTENSION]", " ", "[EOF]", " "]
 
-    # ------------------------
-    # Step 7: Save or print
-    # ------------------------
-    #umc_soft_bin_map = "\n".join(soft_bin_map_lines)
-    #print(umc_soft_bin_map)
 
-    # ------------------------
-    # Write UMC
-    # ------------------------
-    with open(umc_path, "w") as f:
-        f.write(
-            umc_wafer_header_data.safe_substitute(
-                product=product,
-                lot=lot_prefix,
-                wafer=wafer_id,
-                flow=stage,
-                start_time=start_time,
-                stop_time="",
-                subcon=subcon,
-                tester_name=tester_name,
-                test_program=test_program,
-                load_board=load_board,
-                probe_card=probe_card,
-                operator=operator_id,
-                gross_count=total_test,
-                pass_count=total_pass,
-                yield_perc=f"{yield_pct:.0f}%",
-                probing_notch=probing_notch,
-                site_num="",
-                dut="",
-                dut_diff_num="",
-                #map_row=last_row,
-                map_row=len(map_lines), #fixed for FT233H-B
-                map_col=trimmed_width,
-                map_bin_len="1",
-                ship=""
-            )
-        )
+def convert_GTK(lines, lot, wafer, product, stage, zip_timestamp=None, factory_info=None, render=render_umc):
+    """
+    Convert GTK wafer map lines into UMC text (no file I/O).
+    Returns (lot_prefix, umc_name, umc_text).
+    render=iter_umc returns the text as an iterator of pieces instead.
+    """
+    txt, wafer_map_lines = parse_GTK(lines)
 
-        for l in soft_bin_lines:
-            f.write(l + "\n")
-        f.write(" \n")
+    # Extract wafer ID
+    wafer_txt = txt.get("WAFER_ID", "")
+    wafer_part =wafer_txt.split("-")[0] if "-" in wafer_txt else wafer_txt
+    wafer_id =wafer_part[-2:]
 
-        # ------------------------
-        # Join lines into final string
-        # ------------------------
-        for l in soft_bin_map_lines:
-            f.write(l + "\n")
+    total_test = int(txt.get("TOTAL_TEST", 0))
+    total_pass = int(txt.get("TOTAL_PASS", 0))
+    yield_pct = (total_pass * 100 / total_test) if total_test else 0
+    probing_notch = extract_notch(txt.get("FLAT", ""))
 
-    return umc_path
+    lot_prefix = lot.split(".")[0]
+
+    factory_info = factory_info or {}
+    machine = factory_info.get("machine", "")
+    program = factory_info.get("program", "")
+    operator_id = factory_info.get("operator_id", "")
+
+    cfg = PRODUCT_CONFIG.get(product)
+    if not cfg:
+        raise ValueError(f"Product {product} not found in PRODUCT_CONFIG")
+
+    soft_bin_lines = soft_bin_lines_GTK(cfg["soft_bins"], txt, total_test)
+    map_lines, trimmed_width = trim_map_GTK(wafer_map_lines)
+    soft_bin_map_lines = soft_bin_map_GTK(map_lines, trimmed_width)
+
+    header = dict(
+        product=product,
+        lot=lot_prefix,
+        wafer=wafer_id,
+        flow=stage,
+        start_time=format_zip_timestamp(zip_timestamp),
+        stop_time="",
+        subcon=cfg["subcon"],
+        tester_name=f"{cfg['tester']} {machine}",
+        test_program=program or cfg["test_program"],
+        load_board=cfg["load_board"],
+        probe_card=cfg["probe_card"],
+        operator=operator_id,
+        gross_count=total_test,
+        pass_count=total_pass,
+        yield_perc=f"{yield_pct:.0f}%",
+        probing_notch=probing_notch,
+        site_num="",
+        dut="",
+        dut_diff_num="",
+        map_row=len(map_lines), #fixed for FT233H-B
+        map_col=trimmed_width,
+        map_bin_len="1",
+        ship=""
+    )
+
+    umc_name = umc_filename(lot_prefix, wafer, stage, zip_timestamp)
+    return lot_prefix, umc_name, render(header, soft_bin_lines, soft_bin_map_lines, " \n")
+
+
+def process_wafer_GTK(lot, wafer, filename, product, stage, zip_timestamp=None, factory_info=None):
 
-def process_wafer_ASE(lot, wafer, filename, product, stage, zip_timestamp=None, factory_info=None):
     """
-    Convert wafer map TXT into UMC format - supports old & new OSAT formats.
+    Convert wafer map TXT into UMC format.
     """
-    print(f"[UMC WRITER] Processing file: {filename}")
-    print(f"[UMC WRITER] Stage: {stage}")
+    log.debug(f"[UMC WRITER] Processing file: {filename}")
+    log.debug(f"[UMC WRITER] Stage: {stage}")
 
-    # ── Read all lines once ─────────────────────────────────────────────────────
-    all_lines = []
-    with open(filename, "r", encoding="utf-8", errors="ignore") as f:
-        all_lines = [line.rstrip('\n') for line in f]
+    with map_file(filename) as buf, closing(iter_text_lines(buf)) as lines:
+        lot_prefix, umc_name, umc_text = convert_GTK(
+            lines, lot, wafer, product, stage, zip_timestamp, factory_info
+        )
 
-    # ── Parse metadata, bin information, and map ────────────────────────────────
+    return write_umc(lot_prefix, stage, umc_name, umc_text)
+
+
+# ============================================================
+# ASE converter stages (old & new OSAT formats)
+# ============================================================
+def parse_ASE(lines):
+    """
+    Parse metadata, bin information, and map.
+    Returns (metadata, bin_counts, bin_descriptions, wafer_map_raw).
+    """
     metadata = {}
     wafer_map_raw = []
     bin_counts = {}
@@ -275,7 +355,8 @@ def process_wafer_ASE(lot, wafer, filename, product, stage, zip_timestamp=None,
     in_bin_desc_table = False
     bin_headers = []
 
-    for line in all_lines:
+    for line in lines:
+        line = line.rstrip('\n')
         stripped = line.strip()
 
         if not stripped and not in_map:
@@ -358,6 +439,98 @@ def process_wafer_ASE(lot, wafer, filename, product, stage, zip_timestamp=None,
             if "[EXTENSION]" in line or "[EOF]" in line:
                 in_map = False
 
+    return metadata, bin_counts, bin_descriptions, wafer_map_raw
+
+
+def trim_map_ASE(wafer_map_raw):
+    """
+    Trim empty rows/columns of the ASE grid.
+    Returns (trimmed_map, map_row_count, map_col_count).
+    """
+    if not wafer_map_raw:
+        return [], 0, 0
+
+    # ⭐ detect real die rows
+    active_rows = [
+        i for i, row in enumerate(wafer_map_raw)
+        if any(c.isalnum() for c in row)
+    ]
+
+    if not active_rows:
+        return [], 0, 0
+
+    first_row = min(active_rows)
+    last_row = max(active_rows)
+
+    # ⭐ Y normalized slice
+    map_lines = wafer_map_raw[first_row:last_row + 1]
+
+    max_width = max(len(row) for row in map_lines)
+
+    # ⭐ detect real die columns
+    col_has_data = [False] * max_width
+    for row in map_lines:
+        for i, c in enumerate(row):
+            if c.isalnum():
+                col_has_data[i] = True
+
+    first_col = next(i for i, v in enumerate(col_has_data) if v)
+    last_col = max(i for i, v in enumerate(col_has_data) if v)
+
+    # ⭐ X normalized slice
+    trimmed_map = [
+        row[first_col:last_col + 1].ljust(last_col - first_col + 1)
+        for row in map_lines
+    ]
+
+    return trimmed_map, len(trimmed_map), last_col - first_col + 1
+
+
+def soft_bin_lines_ASE(soft_bins, bin_counts, total_test):
+    """
+    Soft-bin section, bins 0-9, using the config descriptions.
+    """
+    soft_bin_lines = []
+    for b, desc in soft_bins:
+        if b > 9:
+            continue
+        count = bin_counts.get(b, 0)
+        bin_yield = (count / total_test * 100.0) if total_test > 0 else 0.0
+        line = f"    BIN, {b}, {count:>6}, {bin_yield:>6.2f}%, {{{desc}}}"
+        soft_bin_lines.append(line)
+    return soft_bin_lines
+
+
+def soft_bin_map_ASE(trimmed_map, map_col_count):
+    """
+    Ruler (only when the map has columns), numbered rows and trailer.
+    Yields the lines (rows are formatted as they are written, not all at once).
+    """
+    ruler1 = " " * 4 + "0" * map_col_count
+    ruler2 = " " * 4 + "".join(str((i + 1) // 10) for i in range(map_col_count))
+    ruler3 = " " * 4 + "".join(str((i + 1) % 10) for i in range(map_col_count))
+
+    yield "[SOFT BIN MAP]"
+
+    if map_col_count > 0:
+        yield from [ruler1, ruler2, ruler3]
+
+    yield " "
+
+    for idx, row in enumerate(trimmed_map, 1):
+        yield f"{idx:03} {row}"
+
+    yield from [" ", "[EXTENSION]", " ", "[EOF]", " "]
+
+
+def convert_ASE(lines, lot, wafer, product, stage, zip_timestamp=None, factory_info=None, render=render_umc):
+    """
+    Convert ASE wafer map lines into UMC text (no file I/O).
+    Returns (lot_prefix, umc_name, umc_text).
+    render=iter_umc returns the text as an iterator of pieces instead.
+    """
+    metadata, bin_counts, bin_descriptions, wafer_map_raw = parse_ASE(lines)
+
     # ── Extract fields ──────────────────────────────────────────────────────────
     cfg = PRODUCT_CONFIG.get(product)
     if not cfg:
@@ -397,124 +570,52 @@ def process_wafer_ASE(lot, wafer, filename, product, stage, zip_timestamp=None,
         start_time = format_zip_timestamp(zip_timestamp) if zip_timestamp else ""
 
     # ── Soft bin section (using your config descriptions) ───────────────────────
-    soft_bins = cfg["soft_bins"]
-
-    soft_bin_lines = []
-    for b, desc in soft_bins:
-        if b > 9:
-            continue
-        count = bin_counts.get(b, 0)
-        bin_yield = (count / total_test * 100.0) if total_test > 0 else 0.0
-        line = f"    BIN, {b}, {count:>6}, {bin_yield:>6.2f}%, {{{desc}}}"
-        soft_bin_lines.append(line)
+    soft_bin_lines = soft_bin_lines_ASE(cfg["soft_bins"], bin_counts, total_test)
 
     # ── Map processing ──────────────────────────────────────────────────────────
-    if not wafer_map_raw:
-        trimmed_map = []
-        map_row_count = 0
-        map_col_count = 0
-
-    else:
-        # ⭐ detect real die rows
-        active_rows = [
-            i for i, row in enumerate(wafer_map_raw)
-            if any(c.isalnum() for c in row)
-        ]
-
-        if not active_rows:
-            trimmed_map = []
-            map_row_count = 0
-            map_col_count = 0
-
-        else:
-            first_row = min(active_rows)
-            last_row = max(active_rows)
-
-            # ⭐ Y normalized slice
-            map_lines = wafer_map_raw[first_row:last_row + 1]
-
-            max_width = max(len(row) for row in map_lines)
-
-            # ⭐ detect real die columns
-            col_has_data = [False] * max_width
-            for row in map_lines:
-                for i, c in enumerate(row):
-                    if c.isalnum():
-                        col_has_data[i] = True
-
-            first_col = next(i for i, v in enumerate(col_has_data) if v)
-            last_col = max(i for i, v in enumerate(col_has_data) if v)
-
-            # ⭐ X normalized slice
-            trimmed_map = [
-                row[first_col:last_col + 1].ljust(last_col - first_col + 1)
-                for row in map_lines
-            ]
-
-            map_row_count = len(trimmed_map)
-            map_col_count = last_col - first_col + 1
-    # ── Ruler ───────────────────────────────────────────────────────────────────
-    ruler1 = " " * 4 + "0" * map_col_count
-    ruler2 = " " * 4 + "".join(str((i + 1) // 10) for i in range(map_col_count))
-    ruler3 = " " * 4 + "".join(str((i + 1) % 10) for i in range(map_col_count))
+    trimmed_map, map_row_count, map_col_count = trim_map_ASE(wafer_map_raw)
+    soft_bin_map_lines = soft_bin_map_ASE(trimmed_map, map_col_count)
+
+    header = dict(
+        product=product_id,
+        lot=lot_prefix,
+        wafer=wafer_id,
+        flow=stage,
+        start_time=start_time,
+        stop_time="",
+        subcon=cfg["subcon"],
+        tester_name=tester_name,
+        test_program=test_program,
+        load_board=cfg["load_board"],
+        probe_card=probe_card,
+        operator=operator_id,
+        gross_count=total_test,
+        pass_count=total_pass,
+        yield_perc=yield_str,
+        probing_notch=probing_notch,
+        site_num="",
+        dut="",
+        dut_diff_num="",
+        map_row=map_row_count,
+        map_col=map_col_count,
+        map_bin_len="1",
+        ship=""
+    )
+
+    umc_name = umc_filename(lot_prefix, wafer, stage, zip_timestamp)
+    return lot_prefix, umc_name, render(header, soft_bin_lines, soft_bin_map_lines, "\n")
 
-    soft_bin_map_lines = ["[SOFT BIN MAP]"]
-
-    if map_col_count > 0:
-        soft_bin_map_lines.extend([ruler1, ruler2, ruler3])
-
-    soft_bin_map_lines.append(" ")
-
-    for idx, row in enumerate(trimmed_map, 1):
-        soft_bin_map_lines.append(f"{idx:03} {row}")
 
-    soft_bin_map_lines.extend([" ", "[EXTENSION]", " ", "[EOF]", " "])
-
-    # ── Output ──────────────────────────────────────────────────────────────────
-    out_dir = os.path.join(ROOT_DIR, lot_prefix, stage)
-    mkdir(out_dir)
-    timestamp_fn = format_zip_timestamp_for_filename(zip_timestamp)
-    umc_name = f"{lot_prefix}{str(wafer).zfill(2)}_{timestamp_fn}.{stage}.umc"
-    umc_path = os.path.join(out_dir, umc_name)
-    print(umc_path)
-
-    if os.path.exists(umc_path):
-        os.remove(umc_path)
+def process_wafer_ASE(lot, wafer, filename, product, stage, zip_timestamp=None, factory_info=None):
+    """
+    Convert wafer map TXT into UMC format - supports old & new OSAT formats.
+    """
+    log.debug(f"[UMC WRITER] Processing file: {filename}")
+    log.debug(f"[UMC WRITER] Stage: {stage}")
 
-    with open(umc_path, "w", encoding="utf-8") as f:
-        f.write(
-            umc_wafer_header_data.safe_substitute(
-                product=product_id,
-                lot=lot_prefix,
-                wafer=wafer_id,
-                flow=stage,
-                start_time=start_time,
-                stop_time="",
-                subcon=cfg["subcon"],
-                tester_name=tester_name,
-                test_program=test_program,
-                load_board=cfg["load_board"],
-                probe_card=probe_card,
-                operator=operator_id,
-                gross_count=total_test,
-                pass_count=total_pass,
-                yield_perc=yield_str,
-                probing_notch=probing_notch,
-                site_num="",
-                dut="",
-                dut_diff_num="",
-                map_row=map_row_count,
-                map_col=map_col_count,
-                map_bin_len="1",
-                ship=""
-            )
+    with map_file(filename) as buf, closing(iter_text_lines(buf, "utf-8")) as lines:
+        lot_prefix, umc_name, umc_text = convert_ASE(
+            lines, lot, wafer, product, stage, zip_timestamp, factory_info
         )
 
-        for ln in soft_bin_lines:
-            f.write(ln + "\n")
-        f.write("\n")
-
-        for ln in soft_bin_map_lines:
-            f.write(ln + "\n")
-
-    return umc_path
\ No newline at end of file
+    return write_umc(lot_prefix, stage, umc_name, umc_text, encoding="utf-8")
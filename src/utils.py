@@ -1,11 +1,14 @@
 # utils.py
 import hashlib
+import logging
 import os
 import shutil
 import sys
-import difflib
 from html import escape
 import time
+import metrics
+
+log = logging.getLogger(__name__)
 
 if getattr(sys, 'frozen', False):
     # Running from PyInstaller EXE
@@ -14,6 +17,7 @@ if getattr(sys, 'frozen', False):
 else:
     BASE_DIR = os.path.dirname(os.path.abspath(__file__))
     EXE_DIR = BASE_DIR
+EXE_DIR = os.getenv("WMU_EXE_DIR", EXE_DIR)   # Local override for run outputs (benchmarks / dry runs)
 
 # -------------------------
 # Filesystem helpers
@@ -66,60 +70,110 @@ def sha256_file(file_path):
 # Side-by-side HTML diff
 # -------------------------
 diff_file = os.path.join(BASE_DIR, "wafer_upload_diff.html")
+DIFF_FIELD_SEP = " | "
+DIFF_STYLE = (
+    "table {border-collapse: collapse; width: 100%;}\n"
+    "td {padding: 2px 4px; font-family: Consolas, monospace; vertical-align: top;}\n"
+    ".diff_add {background-color: #d0ffd0;}\n"          # green: new on the 2nd scan
+    ".diff_del {background-color: #ffd0d0;}\n"          # red: gone on the 2nd scan
+    ".diff_change {color: red;}\n"                      # red font for changed fields
+)
 
 
-
-def html_diff(first_lines, second_lines):
+def status_line_key(line):
     """
-    Generate a side-by-side HTML diff highlighting differences.
-    - Only changed characters in red
-    - Added lines in green
+    Row key for html_diff:
+      "FT233H-B | Lot=ABC | W1 | CP1 | UPLOADED" -> "FT233H-B | Lot=ABC | W1 | CP1"
+      "Uploaded: 12"                              -> "Uploaded"
     """
-    html = []
-    html.append("<html><head><style>")
-    html.append("table {border-collapse: collapse; width: 100%;}")
-    html.append("td {padding: 2px 4px; font-family: Consolas, monospace; vertical-align: top;}")
-    html.append(".diff_add {background-color: #d0ffd0;}")   # green
-    html.append(".diff_change {color: red;}")               # red font for changed characters
-    html.append("</style></head><body><table border='1'>")
-
-    # Pad both lists to same length
-    max_len = max(len(first_lines), len(second_lines))
-    first_lines += [""] * (max_len - len(first_lines))
-    second_lines += [""] * (max_len - len(second_lines))
-
-    for left, right in zip(first_lines, second_lines):
-        if left == right:
-            html.append(f"<tr><td>{escape(left)}</td><td>{escape(right)}</td></tr>")
+    line = line.strip()
+    if DIFF_FIELD_SEP in line:
+        return line.rsplit(DIFF_FIELD_SEP, 1)[0]
+    if ":" in line:
+        return line.split(":", 1)[0]
+    return line
+
+
+def _highlight_fields(left, right):
+    """Wrap the " | " fields that differ in diff_change spans (both sides)."""
+    left_fields = left.split(DIFF_FIELD_SEP)
+    right_fields = right.split(DIFF_FIELD_SEP)
+    if len(left_fields) != len(right_fields):
+        return (f"<span class='diff_change'>{escape(left)}</span>",
+                f"<span class='diff_change'>{escape(right)}</span>")
+    left_html, right_html = [], []
+    for lf, rf in zip(left_fields, right_fields):
+        if lf == rf:
+            left_html.append(escape(lf))
+            right_html.append(escape(rf))
         else:
-            sm = difflib.SequenceMatcher(None, left, right)
-            left_html = ""
-            right_html = ""
+            left_html.append(f"<span class='diff_change'>{escape(lf)}</span>")
+            right_html.append(f"<span class='diff_change'>{escape(rf)}</span>")
+    return DIFF_FIELD_SEP.join(left_html), DIFF_FIELD_SEP.join(right_html)
 
-            for tag, i1, i2, j1, j2 in sm.get_opcodes():
-                l_text = escape(left[i1:i2])
-                r_text = escape(right[j1:j2])
 
-                if tag == "equal":
-                    left_html += l_text
-                    right_html += r_text
-                elif tag == "replace":
-                    left_html += f"<span class='diff_change'>{l_text}</span>"
-                    right_html += f"<span class='diff_change'>{r_text}</span>"
-                elif tag == "delete":
-                    left_html += f"<span class='diff_change'>{l_text}</span>"
-                elif tag == "insert":
-                    right_html += f"<span class='diff_change'>{r_text}</span>"
-
-            html.append(f"<tr><td>{left_html}</td><td>{right_html}</td></tr>")
-
-    html.append("</table></body></html>")
+def html_diff(first_lines, second_lines, product=None, changes_only=False, key=status_line_key):
+    """
+    Side-by-side HTML diff of the 1st and 2nd scan, rows matched by key
+    (product | lot | wafer | stage), so a missing or extra line does not
+    shift the rest. Linear in the number of lines; rows are streamed to
+    the file. The input lists are not modified.
+    - Changed fields in red, rows only on the 2nd scan in green,
+      rows only on the 1st scan in red
+    changes_only: leave out unchanged rows (compact attachment)
+    product: write <diff_file>_<product>.html so concurrent products keep separate reports
+    """
+    # key -> 2nd-scan lines in order (re-deliveries can repeat a key)
+    pending = {}
+    for line in second_lines:
+        pending.setdefault(key(line), []).append(line)
+    used = {k: 0 for k in pending}
 
     output_file = diff_file
-    with open(output_file, "w", encoding="utf-8") as f:
-        f.write("\n".join(html))
-
-    print(f"[INFO] Side-by-side HTML diff saved to {output_file}")
+    if product:
+        base, ext = os.path.splitext(diff_file)
+        output_file = f"{base}_{product}{ext}"
+
+    counts = {"unchanged": 0, "changed": 0, "added": 0, "removed": 0}
+    with open(output_file, "w", encoding="utf-8", buffering=1024 * 1024) as f:
+        f.write(f"<html><head><style>\n{DIFF_STYLE}</style></head><body><table border='1'>\n")
+
+        for left in first_lines:
+            k = key(left)
+            matches = pending.get(k)
+            if matches and used[k] < len(matches):
+                right = matches[used[k]]
+                used[k] += 1
+            else:
+                right = None
+
+            if right is None:
+                counts["removed"] += 1
+                f.write(f"<tr class='diff_del'><td>{escape(left)}</td><td></td></tr>\n")
+            elif left == right:
+                counts["unchanged"] += 1
+                if not changes_only:
+                    f.write(f"<tr><td>{escape(left)}</td><td>{escape(right)}</td></tr>\n")
+            else:
+                counts["changed"] += 1
+                left_html, right_html = _highlight_fields(left, right)
+                f.write(f"<tr><td>{left_html}</td><td>{right_html}</td></tr>\n")
+
+        # Rows that only exist on the 2nd scan, in 2nd-scan order
+        for line in second_lines:
+            k = key(line)
+            matches = pending[k]
+            if used[k] < len(matches) and matches[used[k]] is line:
+                used[k] += 1
+                counts["added"] += 1
+                f.write(f"<tr class='diff_add'><td></td><td>{escape(line)}</td></tr>\n")
+
+        f.write("</table>\n")
+        f.write(f"<p>{counts['changed']} changed, {counts['added']} added, {counts['removed']} removed, "
+                f"{counts['unchanged']} unchanged{' (not shown)' if changes_only else ''}</p>\n")
+        f.write("</body></html>\n")
+
+    log.info(f"[INFO] Side-by-side HTML diff saved to {output_file}")
 
     return output_file
 
@@ -178,44 +232,43 @@ def cleanup_duplicate(log_path):
             for line in unique_lines:
                 f.write(line + "\n")
 
-        print("[LOG] Duplicates removed")
+        log.debug("[LOG] Duplicates removed")
     else:
-        print("[LOG] No duplicates found")
-
-
+        log.debug("[LOG] No duplicates found")
 
-# -----------------------------
-# Safe copy function
-# -----------------------------
-def safe_copy(src, dst, retries=5):
-    """Copy a file safely, creating destination folders if needed."""
-    os.makedirs(os.path.dirname(dst), exist_ok=True)
-    for attempt in range(1, retries + 1):
-        try:
-            shutil.copy2(src, dst)
-            return True
-        except (PermissionError, FileNotFoundError):
-            if attempt == retries:
-                raise
-            time.sleep(attempt)  # simple backoff
 
 
 # -----------------------------
 # Your wait_until_stable function
 # -----------------------------
-def wait_until_stable(path, checks=3, delay=1):
+def wait_until_stable(path, checks=3, delay=1, last=None):
     """
-    Wait until file size stops changing.
-    Returns True if file is stable, False otherwise.
+    Wait until file size and mtime stop changing.
+    last: earlier (size, mtime_ns, time.monotonic()) observation, e.g. the
+          NAS inventory snapshot; it counts as the first check.
+    Returns the os.stat_result once stable, None otherwise.
     """
-    last_size = -1
-    for _ in range(checks):
+    with metrics.span("nas_wait_stable"):
+        return _wait_until_stable(path, checks, delay, last)
+
+
+def _wait_until_stable(path, checks, delay, last):
+    previous = None
+    if last is not None:
+        remaining = delay - (time.monotonic() - last[2])
+        if remaining > 0:
+            time.sleep(remaining)
+        previous = (last[0], last[1])
+        checks -= 1
+    for attempt in range(checks):
         try:
-            size = os.path.getsize(path)
+            st = os.stat(path)
         except FileNotFoundError:
-            return False
-        if size == last_size:
-            return True
-        last_size = size
-        time.sleep(delay)
-    return False
\ No newline at end of file
+            return None
+        current = (st.st_size, st.st_mtime_ns)
+        if current == previous:
+            return st
+        previous = current
+        if attempt < checks - 1:
+            time.sleep(delay)
+    return None
@@ -0,0 +1,230 @@
+# workspace.py
+import logging
+import os
+import shutil
+import stat
+import threading
+import time
+
+from configs import SCRATCH_MAX_BYTES, SCRATCH_MAX_AGE_DAYS, SCRATCH_IDLE_SECONDS
+from staging import META_SUFFIX
+
+log = logging.getLogger(__name__)
+
+# ============================================================
+# Scratch workspace under TEMP_DL_DIR
+#   TEMP_DL_DIR/staged/<zip> (+ .stage.json)             staged NAS ZIP (staging.py)
+#   TEMP_DL_DIR/run_<run id>_<pid>/extracted/<zip stem>/  its members
+# Staged ZIPs are shared between runs. A staged ZIP and its extracted
+# members are deleted as soon as the last wafer that needs them is done;
+# if one of those wafers gave up, the staged ZIP is kept for the next run.
+# The run directory is removed at the end of the run.
+# Leftovers (crashed runs, stale staged ZIPs, pre-workspace files directly
+# in TEMP_DL_DIR) are evicted when older than SCRATCH_MAX_AGE_DAYS, and
+# oldest first while the scratch area is over SCRATCH_MAX_BYTES. Leftovers
+# modified in the last SCRATCH_IDLE_SECONDS are never touched (another
+# instance may still be using them).
+# ============================================================
+RUN_PREFIX = "run_"
+STAGE_DIRNAME = "staged"
+
+
+def _remove_readonly(func, path, _):
+    os.chmod(path, stat.S_IWRITE)
+    func(path)
+
+
+def tree_size(path):
+    """Total bytes under path (a file or a directory)."""
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    total = 0
+    for root_dir, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root_dir, name))
+            except OSError:
+                pass
+    return total
+
+
+def tree_mtime(path):
+    """Newest modification time under path."""
+    newest = os.path.getmtime(path)
+    if os.path.isdir(path):
+        for root_dir, dirs, files in os.walk(path):
+            for name in dirs + files:
+                try:
+                    newest = max(newest, os.path.getmtime(os.path.join(root_dir, name)))
+                except OSError:
+                    pass
+    return newest
+
+
+def remove_path(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, onerror=_remove_readonly)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+class ScratchWorkspace:
+    """
+    One per run, shared by the subcon worker threads.
+        workspace.zip_path(zip_file)       -> where to stage the NAS ZIP
+        workspace.extract_dir(zip_file)    -> where to extract it
+        workspace.need(zip_file, n)        -> n wafers will read this ZIP
+        workspace.done(zip_file, keep)     -> one of them finished (keep=True: gave up)
+    """
+
+    def __init__(self, base_dir, run_id, max_bytes=SCRATCH_MAX_BYTES, max_age_days=SCRATCH_MAX_AGE_DAYS,
+                 idle_seconds=SCRATCH_IDLE_SECONDS):
+        self.base_dir = base_dir
+        self.run_dir = os.path.join(base_dir, f"{RUN_PREFIX}{run_id}_{os.getpid()}")
+        self.stage_dir = os.path.join(base_dir, STAGE_DIRNAME)
+        self.max_bytes = max_bytes
+        self.max_age = max_age_days * 86400
+        self.idle_seconds = idle_seconds
+        self.run_bytes = 0
+        self.leftover_bytes = 0
+        self._users = {}          # zip name -> wafers still needing it
+        self._keep = set()        # zip names with a wafer that gave up (staged copy kept)
+        self._bytes = {}          # zip name -> bytes of its copy + extracted members
+        self._extracted = set()
+        self._zip_locks = {}      # zip name -> lock around its copy / extraction
+        self._over_cap_logged = False
+        self._lock = threading.Lock()
+        os.makedirs(self.run_dir, exist_ok=True)
+        os.makedirs(self.stage_dir, exist_ok=True)
+        self.evict()
+
+    # -------------------------
+    # Paths
+    # -------------------------
+    def zip_path(self, zip_file):
+        return os.path.join(self.stage_dir, zip_file)
+
+    def extract_dir(self, zip_file):
+        stem = zip_file[:-len(".zip")] if zip_file.lower().endswith(".zip") else zip_file
+        return os.path.join(self.run_dir, "extracted", stem)
+
+    def is_extracted(self, zip_file):
+        return zip_file in self._extracted
+
+    def zip_lock(self, zip_file):
+        """Serializes copying / extracting one ZIP when several of its wafers are prepared at once."""
+        with self._lock:
+            return self._zip_locks.setdefault(zip_file, threading.Lock())
+
+    # -------------------------
+    # Accounting
+    # -------------------------
+    def add_copy(self, zip_file):
+        self._add(zip_file, os.path.getsize(self.zip_path(zip_file)))
+
+    def add_extracted(self, zip_file, nbytes):
+        with self._lock:
+            self._extracted.add(zip_file)
+        self._add(zip_file, nbytes)
+
+    def _add(self, zip_file, nbytes):
+        with self._lock:
+            self._bytes[zip_file] = self._bytes.get(zip_file, 0) + nbytes
+            self.run_bytes += nbytes
+            over = self.run_bytes + self.leftover_bytes > self.max_bytes
+        if over:
+            self.evict()
+
+    def need(self, zip_file, wafers):
+        with self._lock:
+            self._users[zip_file] = self._users.get(zip_file, 0) + wafers
+
+    def done(self, zip_file, keep=False):
+        """
+        A wafer of zip_file is finished; drop the members (and the staged
+        copy, unless a wafer gave up: keep=True) after the last one.
+        """
+        with self._lock:
+            if keep:
+                self._keep.add(zip_file)
+            left = self._users.get(zip_file, 0) - 1
+            if left > 0:
+                self._users[zip_file] = left
+                return
+            self._users.pop(zip_file, None)
+            keep = zip_file in self._keep
+        self.discard(zip_file, keep_staged=keep)
+
+    def discard(self, zip_file, keep_staged=False):
+        """Delete the extracted members and staged copy of zip_file (e.g. after a bad ZIP)."""
+        if not keep_staged:
+            remove_path(self.zip_path(zip_file))
+            remove_path(self.zip_path(zip_file) + META_SUFFIX)
+        remove_path(self.extract_dir(zip_file))
+        with self._lock:
+            self.run_bytes -= self._bytes.pop(zip_file, 0)
+            self._extracted.discard(zip_file)
+        log.debug(f"[SCRATCH] Released {zip_file}{' (staged copy kept)' if keep_staged else ''}")
+
+    # -------------------------
+    # Eviction / close
+    # -------------------------
+    def evict(self):
+        """Remove leftovers older than the age limit, then oldest first while over the size cap."""
+        now = time.time()
+        leftovers = []
+        try:
+            paths = [os.path.join(self.base_dir, name) for name in os.listdir(self.base_dir)]
+            # staged ZIPs are evicted one by one (with their sidecar), not as a directory
+            paths = [p for p in paths if p not in (self.run_dir, self.stage_dir)]
+            paths += [os.path.join(self.stage_dir, name) for name in os.listdir(self.stage_dir)
+                      if not name.endswith(META_SUFFIX)]
+        except OSError as e:
+            log.warning(f"[SCRATCH] Cannot list {self.base_dir}: {e}")
+            return
+        with self._lock:   # subcon / async step threads change _users in need() / done()
+            users = list(self._users)
+        in_use = {self.zip_path(z) for z in users}
+        for path in paths:
+            if path in in_use:
+                continue
+            try:
+                leftovers.append((tree_mtime(path), tree_size(path), path))
+            except OSError:
+                continue
+        leftovers.sort()
+
+        kept_bytes = sum(size for _, size, _ in leftovers)
+        removed = 0
+        for mtime, size, path in leftovers:
+            idle = now - mtime
+            if idle < self.idle_seconds:
+                continue
+            if idle < self.max_age and kept_bytes + self.run_bytes <= self.max_bytes:
+                continue
+            try:
+                remove_path(path)
+                if os.path.dirname(path) == self.stage_dir:
+                    remove_path(path + META_SUFFIX)
+            except OSError as e:
+                log.warning(f"[SCRATCH] Cannot evict {path}: {e}")
+                continue
+            kept_bytes -= size
+            removed += 1
+        if removed:
+            log.info(f"[SCRATCH] Evicted {removed} old item(s) from {self.base_dir}")
+
+        with self._lock:
+            self.leftover_bytes = kept_bytes
+            over = kept_bytes + self.run_bytes > self.max_bytes
+        if over and not self._over_cap_logged:
+            self._over_cap_logged = True
+            log.warning(f"[SCRATCH] {self.base_dir} holds {(kept_bytes + self.run_bytes) / 2**20:.0f} MiB, "
+                        f"over the {self.max_bytes / 2**20:.0f} MiB cap (files in use are kept)")
+
+    def close(self):
+        """End of run: remove the run directory (staged ZIPs of unfinished wafers stay)."""
+        try:
+            remove_path(self.run_dir)
+        except OSError as e:
+            log.warning(f"[SCRATCH] Cannot remove {self.run_dir}: {e}")